@@ -3,6 +3,7 @@ Enhanced Agent Type Definitions
 Each task is a unique agent - extremely flexible and context-aware
 """
 
+import os
 from enum import Enum
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel, Field
@@ -46,7 +47,7 @@ class AgentConfig(BaseModel):
     # Core settings
     temperature: float = Field(default=0.7, ge=0.0, le=2.0)
     max_tokens: int = Field(default=4096, ge=100, le=100000)
-    model: str = Field(default="gemini-2.5-flash")
+    model: str = Field(default_factory=lambda: os.getenv("AGENT_DEFAULT_MODEL", "gemini-2.5-flash"))  # "local?..." for the offline provider
     
     # Context settings
     use_simulation_data: bool = True
@@ -61,7 +62,11 @@ class AgentConfig(BaseModel):
     # Execution settings
     streaming: bool = True
     max_retries: int = 3
-    timeout_seconds: int = 300
+    timeout_seconds: int = 300  # Deadline for the whole task, including retries
+    attempt_timeout_seconds: Optional[int] = None  # Deadline per LLM attempt, defaults to timeout_seconds
+    retry_backoff_seconds: float = Field(default=1.0, ge=0.0)  # Base delay for jittered exponential backoff
+    hedge_after_seconds: Optional[float] = Field(default=None, gt=0.0)  # Send a second request if no first token by then (p95 TTFT)
+    candidates: int = Field(default=1, ge=1, le=8)  # Parallel generations; the first whose output passes validate_output is used
     
     # Additional flexible config
     extra: Dict[str, Any] = Field(default_factory=dict)
@@ -80,6 +85,10 @@ class AgentTask(BaseModel):
     policy_data: Optional[Dict[str, Any]] = None
     custom_input: Optional[Dict[str, Any]] = None
     
+    # Input name -> token that changes whenever that input changes; lets
+    # agents reuse serialized context across tasks (see context_budget.py)
+    context_versions: Dict[str, str] = Field(default_factory=dict)
+    
     # Configuration
     config: AgentConfig = Field(default_factory=AgentConfig)
     
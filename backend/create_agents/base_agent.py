@@ -3,16 +3,21 @@ Base Agent Class - Foundation for all agent types
 Works directly with simulated data + aggregated context
 """
 
+import asyncio
 import json
 import logging
+import random
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional, AsyncGenerator, List
+from typing import Dict, Any, Optional, AsyncGenerator, List, Tuple
 from datetime import datetime
-import google.generativeai as genai
-import os
 from dotenv import load_dotenv
 
 from agent_types import AgentType, AgentConfig, AgentTask, AGENT_CAPABILITIES
+from context_budget import ContextAssembler, MIN_SECTION_TOKENS, PROMPT_RESERVED_TOKENS
+from llm_providers import get_provider
+from response_cache import get_response_cache, response_cache_key
+from similarity_cache import get_similarity_cache
+from stream_buffer import StreamBuffer
 
 # Load environment variables
 load_dotenv()
@@ -21,20 +26,50 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configure Gemini API - CRITICAL: This must use API key, not default credentials
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    logger.error("GEMINI_API_KEY not found in environment variables!")
-    logger.error("Create a .env file with: GEMINI_API_KEY=your_key_here")
-    raise ValueError("GEMINI_API_KEY must be set in environment variables or .env file")
-
-# Configure with API key explicitly to avoid default credentials error
+# Errors worth retrying - rate limits, overloaded backends and stalled streams
 try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    logger.info(f"[OK] Gemini API configured with key (length: {len(GEMINI_API_KEY)})")
-except Exception as e:
-    logger.error(f"Failed to configure Gemini API: {e}")
-    raise
+    from google.api_core import exceptions as google_exceptions
+    RETRYABLE_ERRORS = (
+        asyncio.TimeoutError,
+        ConnectionError,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded,
+    )
+except ImportError:
+    RETRYABLE_ERRORS = (asyncio.TimeoutError, ConnectionError)
+
+MAX_BACKOFF_SECONDS = 30.0
+
+
+class PromptParts:
+    """
+    A prompt split by how often each part changes
+    
+    - prefix: static instructions, identical for every run of an agent type
+    - context: the shared context block (build_context_section)
+    - suffix: per-request values - task, parameters, seeds, timestamps
+    
+    Keeping per-request values out of the first two parts lets providers
+    (and the local PrefixCache) reuse the leading tokens across runs.
+    """
+    
+    def __init__(self, prefix: str = "", context: str = "", suffix: str = ""):
+        self.prefix = prefix
+        self.context = context
+        self.suffix = suffix
+    
+    @property
+    def text(self) -> str:
+        return "\n\n".join(part for part in (self.prefix, self.context, self.suffix) if part)
+    
+    def cacheable_parts(self) -> List[str]:
+        """Leading parts as they appear in text, including their separators"""
+        parts = [part for part in (self.prefix, self.context) if part]
+        if self.suffix:
+            return [part + "\n\n" for part in parts]
+        return [part + "\n\n" for part in parts[:-1]] + parts[-1:]
 
 
 class BaseAgent(ABC):
@@ -50,14 +85,19 @@ class BaseAgent(ABC):
         task: AgentTask,
         config: Optional[AgentConfig] = None
     ):
+        # The default build_prompt and build_prompt_parts call each other, so one must be overridden
+        cls = type(self)
+        if cls.build_prompt is BaseAgent.build_prompt and cls.build_prompt_parts is BaseAgent.build_prompt_parts:
+            raise TypeError(f"{cls.__name__} must implement build_prompt or build_prompt_parts")
+        
         self.agent_id = agent_id
         self.agent_type = agent_type
         self.task = task
         self.config = config or AgentConfig()
         self.capability = AGENT_CAPABILITIES.get(agent_type)
         
-        # Initialize LLM
-        self.model = genai.GenerativeModel(self.config.model)
+        # Initialize LLM backend for the configured model (Gemini, or "local" for offline runs)
+        self.llm = get_provider(self.config.model)
         
         # Context storage
         self.simulation_data = task.simulation_data or {}
@@ -66,9 +106,13 @@ class BaseAgent(ABC):
         self.custom_input = task.custom_input or {}
         
         # Execution state
+        self.prompt_parts: Optional[PromptParts] = None
+        self.output = StreamBuffer()  # This run's output; read through self.output.cursor()
+        self.stream_events: List[Tuple[int, Dict[str, Any]]] = []  # (output chunks before it, event) from emit()
         self.status = "initialized"
         self.result = None
         self.error = None
+        self.execution_stats: Dict[str, Any] = {"attempts": 0, "hedged": False}
         
         logger.info(f"Initialized {self.agent_type} agent: {self.agent_id}")
     
@@ -80,13 +124,20 @@ class BaseAgent(ABC):
         """
         pass
     
-    @abstractmethod
     def build_prompt(self) -> str:
         """
         Build the prompt for the LLM based on agent type and task.
-        Must be implemented by each agent type.
+        Agent types implement this or build_prompt_parts.
         """
-        pass
+        return self.build_prompt_parts().text
+    
+    def build_prompt_parts(self) -> PromptParts:
+        """
+        Build the prompt as a static prefix, shared context and per-request suffix.
+        Agents that only implement build_prompt get a single suffix part,
+        which no prefix cache can reuse.
+        """
+        return PromptParts(suffix=self.build_prompt())
     
     async def stream_execute(self) -> AsyncGenerator[str, None]:
         """
@@ -99,32 +150,19 @@ class BaseAgent(ABC):
         
         try:
             # Build the prompt
-            prompt = self.build_prompt()
+            self.prompt_parts = self.build_prompt_parts()
+            prompt = self.prompt_parts.text
             logger.info(f"Agent {self.agent_id} starting execution with prompt length: {len(prompt)}")
             
-            # Verify API key is configured
-            if not GEMINI_API_KEY:
-                raise ValueError("GEMINI_API_KEY not configured")
-            
-            # Stream from LLM
-            full_response = ""
-            response = await self.model.generate_content_async(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=self.config.temperature,
-                    max_output_tokens=self.config.max_tokens,
-                ),
-                stream=True
-            )
-            
-            # Stream tokens - properly handle async iteration
-            async for chunk in response:
-                if hasattr(chunk, 'text') and chunk.text:
-                    full_response += chunk.text
-                    yield chunk.text
+            # Stream from LLM (or the response cache) with deadlines, retries and hedging
+            async for text in self._stream_with_cache(prompt):
+                self.output.append(text)
+                self.on_stream_chunk(text)
+                yield text
+            self.output.close()
             
             # Post-process the response after streaming completes
-            processed_result = await self.post_process(full_response)
+            processed_result = await self.post_process(self.output.text())
             
             self.result = processed_result
             self.task.result = processed_result
@@ -134,6 +172,15 @@ class BaseAgent(ABC):
             
             logger.info(f"Agent {self.agent_id} completed successfully")
             
+        except asyncio.CancelledError:
+            # Cancelled by the orchestrator - the LLM stream was closed on the way out
+            self.status = "cancelled"
+            self.task.status = "cancelled"
+            self.task.completed_at = datetime.utcnow().isoformat()
+            logger.info(f"Agent {self.agent_id} cancelled")
+            self.output.close()
+            raise
+            
         except StopAsyncIteration:
             # This should never happen in properly formed async generators
             # But if it does, treat as completion
@@ -141,16 +188,328 @@ class BaseAgent(ABC):
             self.status = "completed"
             self.task.status = "completed"
             self.task.completed_at = datetime.utcnow().isoformat()
+            self.output.close()
             
         except Exception as e:
             self.status = "failed"
             self.error = str(e)
             self.task.status = "failed"
             self.task.error = str(e)
+            self.output.close(error=e)
             logger.error(f"Agent {self.agent_id} failed: {e}")
             # Don't re-raise, just log - this prevents breaking the generator
             logger.exception(e)
     
+    def on_stream_chunk(self, text: str):
+        """
+        Called with each output chunk as it arrives.
+        Agents override this to publish partial results with emit().
+        """
+        pass
+    
+    def emit(self, event_type: str, data: Any):
+        """Publish a structured event alongside the token stream, after the chunks streamed so far"""
+        self.stream_events.append((len(self.output), {"type": event_type, "data": data}))
+    
+    async def collect_output(self) -> str:
+        """Run stream_execute to completion and return the full output text"""
+        async for _ in self.stream_execute():
+            pass
+        return self.output.text()
+    
+    async def _stream_with_cache(self, prompt: str) -> AsyncGenerator[str, None]:
+        """
+        Stream from the response caches when enabled in config.extra, falling
+        back to the LLM and caching the response once it completes.
+        
+        "cache" looks up the exact prompt; "similarity_cache" also accepts a
+        near-duplicate prompt at or above "similarity_threshold", and marks
+        the result approximate. Hits are replayed chunk by chunk, paced at
+        "cache_replay_chunks_per_second" if given.
+        """
+        use_exact = bool(self.config.extra.get("cache"))
+        use_similar = bool(self.config.extra.get("similarity_cache"))
+        if not (use_exact or use_similar):
+            async for text in self._stream_generation(prompt):
+                yield text
+            return
+        
+        if use_exact:
+            cache = get_response_cache()
+            key = response_cache_key(self.config.model, self.config.temperature, self.config.max_tokens, prompt)
+            chunks = cache.get(key)
+            if chunks is not None:
+                self.execution_stats["cache"] = "hit"
+                async for chunk in self._replay_chunks(chunks):
+                    yield chunk
+                return
+        
+        if use_similar:
+            similarity_cache = get_similarity_cache()
+            scope = f"{self.config.model}|{self.config.temperature}|{self.config.max_tokens}"
+            signature = await asyncio.to_thread(similarity_cache.signature, prompt)
+            match = similarity_cache.lookup(scope, signature, self.config.extra.get("similarity_threshold"))
+            if match is not None:
+                chunks, similarity = match
+                self.execution_stats["cache"] = "approximate"
+                self.execution_stats["similarity"] = round(similarity, 4)
+                async for chunk in self._replay_chunks(chunks):
+                    yield chunk
+                return
+        
+        self.execution_stats["cache"] = "miss"
+        chunks = []
+        async for text in self._stream_generation(prompt):
+            chunks.append(text)
+            yield text
+        
+        if chunks:
+            if use_exact:
+                cache.put(key, chunks)
+            if use_similar:
+                similarity_cache.put(scope, signature, chunks)
+    
+    async def _stream_generation(self, prompt: str) -> AsyncGenerator[str, None]:
+        """Stream one LLM generation, or the best of config.candidates"""
+        if self.prompt_parts is not None and prompt == self.prompt_parts.text:
+            reused = self.llm.prepare_prefix(self.prompt_parts.cacheable_parts(), prompt)
+            self.execution_stats["prefix_reused_chars"] = reused
+        
+        if self.config.candidates > 1:
+            async for text in self._stream_best_candidate(prompt):
+                yield text
+        else:
+            async for text in self._stream_with_retries(prompt):
+                yield text
+    
+    async def _stream_best_candidate(self, prompt: str) -> AsyncGenerator[str, None]:
+        """
+        Run config.candidates generations in parallel and stream the first
+        complete one that passes validate_output; the rest are cancelled.
+        
+        Nothing is streamed until a candidate wins, so this suits agents whose
+        output is only usable once complete (JSON payloads). If no candidate
+        passes, the first complete one is used so post_process can report why.
+        Each candidate's attempts and timings are kept in candidates["runs"];
+        the top-level stats are those of the candidate used.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        runs = [{"attempts": 0, "hedged": False} for _ in range(self.config.candidates)]
+        stats = {"launched": self.config.candidates, "completed": 0, "rejected": 0, "failed": 0, "winner": None, "runs": runs}
+        self.execution_stats["candidates"] = stats
+        
+        async def generate(index: int) -> Tuple[int, List[str]]:
+            chunks = []
+            async for text in self._stream_with_retries(prompt, runs[index]):
+                chunks.append(text)
+            return index, chunks
+        
+        pending = {asyncio.ensure_future(generate(index)) for index in range(self.config.candidates)}
+        chosen: Optional[List[str]] = None
+        fallback: Optional[List[str]] = None
+        fallback_index: Optional[int] = None
+        last_error: Optional[BaseException] = None
+        
+        try:
+            while pending and chosen is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is not None:
+                        stats["failed"] += 1
+                        last_error = future.exception()
+                        continue
+                    
+                    index, chunks = future.result()
+                    stats["completed"] += 1
+                    if chosen is None and self.validate_output("".join(chunks)):
+                        chosen = chunks
+                        stats["winner"] = index
+                    elif chosen is None:
+                        stats["rejected"] += 1
+                        if fallback is None:
+                            fallback, fallback_index = chunks, index
+        finally:
+            stats["cancelled"] = len(pending)
+            for future in pending:
+                future.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        
+        stats["seconds"] = round(loop.time() - started, 3)
+        if chosen is None:
+            if fallback is None:
+                raise last_error
+            logger.warning(f"Agent {self.agent_id}: no valid output from {self.config.candidates} candidates")
+            chosen = fallback
+            self.execution_stats.update(runs[fallback_index])
+        else:
+            logger.info(f"Agent {self.agent_id}: candidate {stats['winner']} won after {stats['seconds']}s")
+            self.execution_stats.update(runs[stats["winner"]])
+        
+        for chunk in chosen:
+            yield chunk
+    
+    async def _replay_chunks(self, chunks: List[str]) -> AsyncGenerator[str, None]:
+        chunks_per_second = self.config.extra.get("cache_replay_chunks_per_second")
+        for chunk in chunks:
+            yield chunk
+            await asyncio.sleep(1 / chunks_per_second if chunks_per_second else 0)
+    
+    async def _stream_with_retries(self, prompt: str, stats: Optional[Dict[str, Any]] = None) -> AsyncGenerator[str, None]:
+        """
+        Stream LLM output while enforcing config.timeout_seconds for the whole
+        task and config.attempt_timeout_seconds for each attempt.
+        
+        Retryable errors are retried up to config.max_retries times with
+        jittered exponential backoff, but only while nothing has been yielded -
+        restarting a stream after tokens were sent would duplicate them.
+        Attempts and timings go to stats (default: self.execution_stats).
+        """
+        stats = self.execution_stats if stats is None else stats
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.config.timeout_seconds
+        attempt_timeout = self.config.attempt_timeout_seconds or self.config.timeout_seconds
+        yielded = False
+        attempt = 0
+        
+        while True:
+            attempt += 1
+            stats["attempts"] = attempt
+            attempt_deadline = min(deadline, loop.time() + attempt_timeout)
+            stream = None
+            
+            try:
+                first_text, stream = await self._open_stream_hedged(prompt, attempt_deadline, stats)
+                if first_text:
+                    yielded = True
+                    yield first_text
+                
+                while True:
+                    remaining = attempt_deadline - loop.time()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError("LLM stream exceeded its deadline")
+                    try:
+                        text = await asyncio.wait_for(stream.__anext__(), timeout=remaining)
+                    except StopAsyncIteration:
+                        break
+                    yielded = True
+                    yield text
+                return
+            
+            except RETRYABLE_ERRORS as e:
+                backoff = min(MAX_BACKOFF_SECONDS, self.config.retry_backoff_seconds * 2 ** (attempt - 1))
+                backoff *= random.uniform(0.5, 1.0)
+                
+                if yielded or attempt > self.config.max_retries or loop.time() + backoff >= deadline:
+                    raise
+                
+                logger.warning(
+                    f"Agent {self.agent_id} attempt {attempt} failed ({type(e).__name__}: {e}), "
+                    f"retrying in {backoff:.1f}s"
+                )
+                await asyncio.sleep(backoff)
+            
+            finally:
+                if stream is not None:
+                    await self._close_stream(stream)
+    
+    async def _open_stream_hedged(self, prompt: str, deadline: float, stats: Dict[str, Any]) -> Tuple[Optional[str], AsyncGenerator[str, None]]:
+        """
+        Open an LLM stream and wait for its first token.
+        
+        If config.hedge_after_seconds passes without a first token, a second
+        identical request is sent and whichever stream answers first is kept;
+        the other is cancelled.
+        
+        Returns:
+            The first text chunk (None for an empty response) and the stream
+            positioned after it
+        """
+        loop = asyncio.get_running_loop()
+        contenders = {asyncio.ensure_future(self._read_first_token(prompt))}
+        started = loop.time()
+        last_error: Optional[BaseException] = None
+        
+        try:
+            hedge_after = self.config.hedge_after_seconds
+            if hedge_after and hedge_after < deadline - loop.time():
+                done, _ = await asyncio.wait(contenders, timeout=hedge_after)
+                if not done:
+                    logger.info(f"Agent {self.agent_id}: no first token after {hedge_after}s, sending hedge request")
+                    stats["hedged"] = True
+                    contenders.add(asyncio.ensure_future(self._read_first_token(prompt)))
+            
+            while contenders:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                
+                done, _ = await asyncio.wait(contenders, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                
+                winner = None
+                for future in done:
+                    if future.exception() is not None:
+                        contenders.discard(future)
+                        last_error = future.exception()
+                    elif winner is None:
+                        contenders.discard(future)
+                        winner = future
+                
+                # First healthy stream wins; every other contender is closed below
+                if winner is not None:
+                    stats["time_to_first_token"] = round(loop.time() - started, 3)
+                    return winner.result()
+            
+            if last_error is not None:
+                raise last_error
+            raise asyncio.TimeoutError("No first token from LLM before the deadline")
+        
+        finally:
+            for future in contenders:
+                future.cancel()
+            # A contender may have finished, or finish before its cancellation lands - close its stream
+            for outcome in await asyncio.gather(*contenders, return_exceptions=True):
+                if isinstance(outcome, tuple):
+                    await self._close_stream(outcome[1])
+    
+    async def _read_first_token(self, prompt: str) -> Tuple[Optional[str], AsyncGenerator[str, None]]:
+        """Open one LLM stream and read up to its first token"""
+        stream = self._open_stream(prompt)
+        try:
+            first_text = await stream.__anext__()
+        except StopAsyncIteration:
+            first_text = None
+        except BaseException:
+            await self._close_stream(stream)
+            raise
+        return first_text, stream
+    
+    def _open_stream(self, prompt: str) -> AsyncGenerator[str, None]:
+        """Stream non-empty text chunks for a single LLM request"""
+        return self.llm.stream(
+            prompt,
+            temperature=self.config.temperature,
+            max_tokens=self.config.max_tokens
+        )
+    
+    async def _close_stream(self, stream: AsyncGenerator[str, None]):
+        """Close a stream without letting cleanup errors mask the real outcome"""
+        try:
+            await stream.aclose()
+        except Exception as e:
+            logger.debug(f"Error closing LLM stream for {self.agent_id}: {e}")
+    
+    def validate_output(self, raw_output: str) -> bool:
+        """
+        Whether a complete LLM output is usable, e.g. contains valid JSON.
+        Decides which candidate wins when config.candidates > 1;
+        by default the first complete candidate does.
+        """
+        return True
+    
     async def post_process(self, raw_output: str) -> Dict[str, Any]:
         """
         Post-process the LLM output into structured format.
@@ -167,37 +526,60 @@ class BaseAgent(ABC):
         """
         Build the context section from available data sources.
         This is used by all agents to get relevant context.
+        
+        Sections are fitted to the token budget from context_budget_tokens()
+        in priority order - custom input, simulation data, policy data, then
+        aggregated context (newest results kept first) - and the report of
+        what was shrunk or dropped is kept in execution_stats["context"].
+        Sections with a version in task.context_versions are serialized once
+        per version; extra["compact_context"] drops the JSON indentation.
         """
-        context_parts = []
+        assembler = ContextAssembler(
+            self.context_budget_tokens(),
+            compact=bool(self.config.extra.get("compact_context", False))
+        )
+        versions = self.task.context_versions
         
         # Add simulation data if available and configured
         if self.config.use_simulation_data and self.simulation_data:
-            context_parts.append("## SIMULATION DATA")
-            context_parts.append("Recent simulation results and metrics:")
-            context_parts.append(json.dumps(self.simulation_data, indent=2))
-            context_parts.append("")
+            assembler.add("simulation_data", "## SIMULATION DATA", self.simulation_data, priority=1,
+                          description="Recent simulation results and metrics:",
+                          version=versions.get("simulation_data"))
         
         # Add aggregated context if available and configured
         if self.config.use_aggregated_context and self.aggregated_context:
-            context_parts.append("## AGGREGATED CONTEXT")
-            context_parts.append("Compiled insights from multiple sources:")
-            context_parts.append(json.dumps(self.aggregated_context, indent=2))
-            context_parts.append("")
+            assembler.add("aggregated_context", "## AGGREGATED CONTEXT", self.aggregated_context, priority=3,
+                          description="Compiled insights from multiple sources:", keep="last",
+                          version=versions.get("aggregated_context"))
         
         # Add policy data if available
         if self.policy_data:
-            context_parts.append("## POLICY DATA")
-            context_parts.append("Related policy information:")
-            context_parts.append(json.dumps(self.policy_data, indent=2))
-            context_parts.append("")
+            assembler.add("policy_data", "## POLICY DATA", self.policy_data, priority=2,
+                          description="Related policy information:",
+                          version=versions.get("policy_data"))
         
         # Add custom input
         if self.custom_input:
-            context_parts.append("## ADDITIONAL INPUT")
-            context_parts.append(json.dumps(self.custom_input, indent=2))
-            context_parts.append("")
+            assembler.add("custom_input", "## ADDITIONAL INPUT", self.custom_input, priority=0)
         
-        return "\n".join(context_parts)
+        context, report = assembler.assemble()
+        self.execution_stats["context"] = report
+        if report["reduced"]:
+            logger.info(
+                f"Agent {self.agent_id} context reduced from ~{report['original_tokens']} to "
+                f"~{report['used_tokens']} tokens (budget {report['budget_tokens']}): "
+                f"reduced {report['reduced']}, dropped {report['dropped']}"
+            )
+        return context
+    
+    def context_budget_tokens(self) -> int:
+        """
+        Tokens available to the context section: config.context_window less
+        room for the prompt's own instructions, or extra["context_budget_tokens"]
+        """
+        if "context_budget_tokens" in self.config.extra:
+            return int(self.config.extra["context_budget_tokens"])
+        return max(MIN_SECTION_TOKENS, self.config.context_window - PROMPT_RESERVED_TOKENS)
     
     def get_capability_description(self) -> str:
         """Get a description of this agent's capabilities"""
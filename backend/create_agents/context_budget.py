@@ -0,0 +1,279 @@
+"""
+Context Budget
+Token-budgeted assembly of the context section of agent prompts
+Sections are filled in priority order and shrunk deterministically when they don't fit
+"""
+
+import json
+import math
+import os
+from collections import OrderedDict
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+# Rough characters per token for English text and JSON; no tokenizer needed
+CHARS_PER_TOKEN = 4
+
+# Progressively tighter (max list items, max string length) limits tried on an
+# over-budget section before it is hard-truncated or dropped
+SHRINK_LEVELS = (
+    (None, None),
+    (10, 2000),
+    (5, 1000),
+    (3, 500),
+    (2, 250),
+    (1, 120),
+)
+
+# Tokens of context_window left for a prompt's instructions around the context
+PROMPT_RESERVED_TOKENS = 1500
+
+# Smallest useful slice of a section; anything less and the section is dropped
+MIN_SECTION_TOKENS = 32
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimated token count of a piece of text"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def shrink_data(data: Any, max_items: Optional[int], max_chars: Optional[int], keep: str = "first") -> Tuple[Any, int]:
+    """
+    Copy of data with lists cut to max_items and strings to max_chars
+
+    keep="last" keeps the newest entries of chronological lists.
+
+    Returns:
+        (shrunk data, number of list items and strings that were cut)
+    """
+    if isinstance(data, dict):
+        shrunk, cut = {}, 0
+        for key, value in data.items():
+            shrunk[key], value_cut = shrink_data(value, max_items, max_chars, keep)
+            cut += value_cut
+        return shrunk, cut
+
+    if isinstance(data, list):
+        items, cut = data, 0
+        if max_items is not None and len(data) > max_items:
+            omitted = len(data) - max_items
+            items = data[-max_items:] if keep == "last" else data[:max_items]
+            cut += omitted
+        shrunk = []
+        for item in items:
+            shrunk_item, item_cut = shrink_data(item, max_items, max_chars, keep)
+            shrunk.append(shrunk_item)
+            cut += item_cut
+        if len(items) < len(data):
+            marker = f"[{len(data) - len(items)} {'earlier' if keep == 'last' else 'more'} items omitted]"
+            shrunk = [marker] + shrunk if keep == "last" else shrunk + [marker]
+        return shrunk, cut
+
+    if isinstance(data, str) and max_chars is not None and len(data) > max_chars:
+        return data[:max_chars] + "...[truncated]", 1
+
+    return data, 0
+
+
+class FragmentCache:
+    """
+    Rendered context sections, keyed by the version of the data they came from
+
+    A version is an opaque token that changes whenever the data changes (the
+    orchestrator bumps one on every context update), so a hit is always the
+    text the same data would serialize to. Least recently used fragments are
+    dropped once their total size exceeds max_chars.
+    """
+
+    def __init__(self, max_chars: Optional[int] = None):
+        self.max_chars = max_chars or int(os.getenv("CONTEXT_FRAGMENT_CACHE_MAX_CHARS", str(32 * 1024 * 1024)))
+        # (version, section name, rendering) -> (text, items cut)
+        self._fragments: "OrderedDict[Tuple[str, str, str], Tuple[str, int]]" = OrderedDict()
+        self._chars = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key: Tuple[str, str, str], render: Callable[[], Tuple[str, int]]) -> Tuple[str, int]:
+        fragment = self._fragments.get(key)
+        if fragment is not None:
+            self._fragments.move_to_end(key)
+            self.hits += 1
+            return fragment
+
+        self.misses += 1
+        fragment = render()
+        if len(fragment[0]) <= self.max_chars:
+            self._fragments[key] = fragment
+            self._chars += len(fragment[0])
+            while self._chars > self.max_chars:
+                _, (text, _) = self._fragments.popitem(last=False)
+                self._chars -= len(text)
+        return fragment
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and cache size"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "fragments": len(self._fragments),
+            "chars": self._chars,
+            "max_chars": self.max_chars
+        }
+
+
+# Global cache shared by all agents in the process
+_fragment_cache = None
+
+def get_fragment_cache() -> FragmentCache:
+    """Get or create the global context fragment cache"""
+    global _fragment_cache
+    if _fragment_cache is None:
+        _fragment_cache = FragmentCache()
+    return _fragment_cache
+
+
+class ContextAssembler:
+    """
+    Builds a context section that fits a token budget
+
+    Sections are considered highest priority first. A section that fits the
+    remaining budget is rendered exactly as before (indented JSON); otherwise
+    it is re-rendered as compact JSON at each SHRINK_LEVEL until it fits,
+    then hard-truncated, and dropped if even MIN_SECTION_TOKENS don't fit.
+    The same inputs and budget always give the same text.
+
+    With compact=True sections are always rendered without indentation.
+    Sections added with a version are rendered once per version and reused
+    from the fragment cache afterwards.
+    """
+
+    def __init__(self, budget_tokens: int, compact: bool = False, cache: Optional[FragmentCache] = None):
+        self.budget_tokens = budget_tokens
+        self.compact = compact
+        self.cache = cache or get_fragment_cache()
+        self._sections: List[Dict[str, Any]] = []
+
+    def add(
+        self,
+        name: str,
+        title: str,
+        data: Any,
+        priority: int,
+        description: Optional[str] = None,
+        keep: str = "first",
+        version: Optional[str] = None
+    ):
+        """
+        Add a section; lower priority numbers are kept first
+
+        Args:
+            name: Key used in the report
+            title: Markdown heading, e.g. "## SIMULATION DATA"
+            data: JSON-serializable content
+            priority: Fill order, 0 first
+            description: Line shown under the heading
+            keep: "last" to keep the newest items when lists are cut
+            version: Token that changes whenever data changes; enables caching
+        """
+        self._sections.append({
+            "name": name,
+            "title": title,
+            "description": description,
+            "data": data,
+            "priority": priority,
+            "keep": keep,
+            "version": version,
+            "order": len(self._sections)
+        })
+
+    def _render(self, section: Dict[str, Any], body: str) -> str:
+        lines = [section["title"]]
+        if section["description"]:
+            lines.append(section["description"])
+        lines.append(body)
+        lines.append("")
+        return "\n".join(lines)
+
+    def _rendered(self, section: Dict[str, Any], rendering: str, render: Callable[[], Tuple[str, int]]) -> Tuple[str, int]:
+        """Render a section, through the fragment cache when it has a version"""
+        if section["version"] is None:
+            return render()
+        return self.cache.get_or_render((section["version"], section["name"], rendering), render)
+
+    def _shrunk(self, section: Dict[str, Any], max_items: Optional[int], max_chars: Optional[int]) -> Tuple[str, int]:
+        data, cut = shrink_data(section["data"], max_items, max_chars, section["keep"])
+        return self._render(section, json.dumps(data, separators=(",", ":"), default=str)), cut
+
+    def _fit(self, section: Dict[str, Any], budget: int) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Render a section within budget tokens, shrinking it if needed"""
+        if self.compact:
+            full, _ = self._rendered(section, "compact", lambda: self._shrunk(section, None, None))
+        else:
+            full, _ = self._rendered(
+                section, "indent", lambda: (self._render(section, json.dumps(section["data"], indent=2, default=str)), 0)
+            )
+        report = {"name": section["name"], "priority": section["priority"], "tokens": estimate_tokens(full)}
+
+        if report["tokens"] <= budget:
+            return full, {**report, "action": "compacted" if self.compact else "full", "used_tokens": report["tokens"]}
+
+        for max_items, max_chars in SHRINK_LEVELS:
+            text, cut = self._rendered(
+                section, f"shrink:{max_items}:{max_chars}",
+                lambda max_items=max_items, max_chars=max_chars: self._shrunk(section, max_items, max_chars)
+            )
+            if estimate_tokens(text) <= budget:
+                action = "compacted" if cut == 0 else "shrunk"
+                return text, {**report, "action": action, "used_tokens": estimate_tokens(text), "items_cut": cut}
+
+        if budget < MIN_SECTION_TOKENS:
+            return None, {**report, "action": "dropped", "used_tokens": 0}
+
+        # Still too big at the tightest level - keep the head of the compact rendering
+        marker = "...[truncated to fit context window]"
+        head = self._render(section, "")
+        keep_chars = budget * CHARS_PER_TOKEN - len(head) - len(marker) - 1
+        if keep_chars <= 0:
+            return None, {**report, "action": "dropped", "used_tokens": 0}
+        compact, _ = self._rendered(section, "compact", lambda: self._shrunk(section, None, None))
+        body = compact[len(head) - 1:-1][:keep_chars] + marker
+        text = self._render(section, body)
+        return text, {**report, "action": "truncated", "used_tokens": estimate_tokens(text)}
+
+    def assemble(self) -> Tuple[str, Dict[str, Any]]:
+        """
+        Build the context text
+
+        Returns:
+            (text in the original section order, report of what each section
+            used and which were shrunk, truncated or dropped)
+        """
+        remaining = self.budget_tokens
+        rendered: Dict[int, str] = {}
+        reports = []
+
+        for section in sorted(self._sections, key=lambda s: (s["priority"], s["order"])):
+            text, report = self._fit(section, remaining)
+            reports.append(report)
+            if text is not None:
+                rendered[section["order"]] = text
+                remaining -= report["used_tokens"]
+
+        reduced = [r["name"] for r in reports if r["action"] not in ("full", "compacted")]
+        dropped = [r["name"] for r in reports if r["action"] == "dropped"]
+        parts = [rendered[order] for order in sorted(rendered)]
+        if reduced:
+            parts.append(
+                f"(Context reduced to fit the context window: {', '.join(reduced)}"
+                f"{'; omitted: ' + ', '.join(dropped) if dropped else ''})"
+            )
+
+        return "\n".join(parts), {
+            "budget_tokens": self.budget_tokens,
+            "used_tokens": self.budget_tokens - remaining,
+            "original_tokens": sum(r["tokens"] for r in reports),
+            "reduced": reduced,
+            "dropped": dropped,
+            "sections": reports
+        }
@@ -4,9 +4,15 @@ These are the main agents that work together in the policy analysis workflow
 """
 
 from typing import Dict, Any, Optional, List
-from base_agent import BaseAgent
+from base_agent import BaseAgent, PromptParts
 from agent_types import AgentType, AgentTask, AgentConfig
+from debate_messages import DebateMessageParser
+from fenced_json import FencedBlock, FencedJsonExtractor
+from output_parser import parse_output
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class ConsultingSupervisorAgent(BaseAgent):
@@ -18,11 +24,12 @@ class ConsultingSupervisorAgent(BaseAgent):
     def __init__(self, agent_id: str, task: AgentTask, config: AgentConfig = None):
         super().__init__(agent_id, AgentType.CONSULTING, task, config)
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         politician_info = self.custom_input.get("politician_info", {})
         initial_request = self.custom_input.get("initial_request", "")
         
-        return f"""You are a Consulting Supervisor Agent - the strategic advisor and orchestrator for policy initiatives.
+        return PromptParts(
+            prefix=f"""You are a Consulting Supervisor Agent - the strategic advisor and orchestrator for policy initiatives.
 
 Your role is to determine and clarify the GOALS of the politician and create a strategic framework for analysis.
 
@@ -32,10 +39,10 @@ Don't just say "Analyzing goals..."
 
 Instead, write out your COMPLETE thought process:
 
-"Looking at the request from {politician_info.get('name', 'the official')}, I need to deeply understand what they're trying to achieve.
+"Looking at the request from the official, I need to deeply understand what they're trying to achieve.
 
 INITIAL ASSESSMENT:
-- The official is proposing: {initial_request or self.task.description}
+- The official is proposing: [the initial request]
 - This appears to be a [traffic/housing/environmental/economic] policy
 - Primary stakeholders will likely include: [list specific groups]
 - Political context: [analyze political landscape]
@@ -66,12 +73,6 @@ Based on this analysis, here's my framework..."
 
 SHOW YOUR COMPLETE STRATEGIC THINKING PROCESS.
 
-# POLITICIAN/CLIENT INFORMATION
-{json.dumps(politician_info, indent=2) if politician_info else "Information to be gathered"}
-
-# INITIAL REQUEST
-{initial_request or self.task.description}
-
 # YOUR RESPONSIBILITIES
 
 As the supervisor, you must:
@@ -146,15 +147,19 @@ For each simulation perspective needed:
 [How we'll know if this initiative is successful]
 
 ## 8. NEXT STEPS
-[Immediate actions to take]
+[Immediate actions to take]""",
+            suffix=f"""# POLITICIAN/CLIENT INFORMATION
+{json.dumps(politician_info, indent=2) if politician_info else "Information to be gathered"}
+
+# INITIAL REQUEST
+{initial_request or self.task.description}
 
 Generate the complete strategic plan:
 """
+        )
     
     async def execute(self) -> Dict[str, Any]:
-        full_plan = ""
-        async for token in self.stream_execute():
-            full_plan += token
+        full_plan = await self.collect_output()
         
         # Extract structured information for workflow orchestration
         return {
@@ -198,8 +203,11 @@ class EnhancedSimulationAgent(BaseAgent):
                 "emergency_response_time", "waste_management", "street_lighting"
             ]
         }
+        
+        # Finds the parameters and Mapbox JSON blocks while the analysis streams
+        self.json_blocks = FencedJsonExtractor()
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         perspective = self.custom_input.get("perspective", "comprehensive")
         city = self.custom_input.get("city", "")
         policy_document = self.custom_input.get("policy_document", "")
@@ -214,29 +222,19 @@ class EnhancedSimulationAgent(BaseAgent):
         # Determine Mapbox visualization strategy
         viz_strategy = self._determine_visualization_strategy(perspective)
         
-        return f"""You are an Enhanced Simulation Agent with deep knowledge of {city}'s geography, infrastructure, and urban dynamics.
-
-# POLICY TO SIMULATE
-{policy_document or self.task.description}
-
-{f"# FULL POLICY DOCUMENT:{policy_text[:3000]}" if policy_text else ""}
-
-# LOCATION
-{city}
-
-# PERSPECTIVE
-Focus on: **{perspective}**
+        return PromptParts(
+            prefix=f"""You are an Enhanced Simulation Agent with deep knowledge of the target city's geography, infrastructure, and urban dynamics.
 
 # CRITICAL REQUIREMENT: USE REAL LOCATIONS
 
-You MUST identify and use REAL, SPECIFIC locations in {city}:
+You MUST identify and use REAL, SPECIFIC locations in the city given below:
 - Real street names (e.g., "Mission St & 16th St", "Market St & Van Ness Ave")
 - Real neighborhoods (e.g., "Mission District", "SOMA", "Tenderloin", "Castro")
 - Real landmarks (e.g., "Civic Center", "Ferry Building", "Golden Gate Park")
 - Real highways (e.g., "US-101", "I-280", "Highway 1")
 - Real transit stations (e.g., "Powell St BART", "16th St Mission BART")
 
-Use ACTUAL coordinates for {city}:
+Use ACTUAL coordinates for the city (San Francisco examples):
 - Downtown SF: [-122.4194, 37.7749]
 - Mission District: [-122.4194, 37.7599]  
 - SOMA: [-122.3977, 37.7786]
@@ -246,12 +244,6 @@ Use ACTUAL coordinates for {city}:
 - Golden Gate Park: [-122.4862, 37.7694]
 - Civic Center: [-122.4161, 37.7799]
 
-# BASELINE ENVIRONMENT
-{json.dumps(baseline_environment, indent=2) if baseline_environment else "Use real current data for " + city}
-
-# AVAILABLE CONTEXT
-{self.build_context_section()}
-
 # CRITICAL: YOU MUST ANALYZE ALL 20+ IMPACT PARAMETERS
 
 For this policy, you MUST provide detailed analysis and specific numeric changes for ALL of these parameters:
@@ -296,9 +288,6 @@ For this policy, you MUST provide detailed analysis and specific numeric changes
 29. waste_management (tons/day)
 30. street_lighting (coverage %)
 
-# MAPBOX VISUALIZATION STRATEGY
-{viz_strategy}
-
 # YOUR TASK - BE EXTREMELY TRANSPARENT AND DETAILED
 
 You MUST be EXTREMELY VERBOSE and show your complete thinking process. Don't just say "Analyzing traffic..." 
@@ -369,7 +358,7 @@ Example for ONE parameter:
 
 1. **Baseline State**
    - Current conditions for ALL 30 parameters
-   - Realistic baseline values for {city}
+   - Realistic baseline values for the city
    - Current problem areas
 
 2. **Policy Impact - Be Specific!**
@@ -451,8 +440,6 @@ Provide detailed analysis in markdown, then include TWO JSON blocks:
 **JSON BLOCK 2: Mapbox Visualization (MUST INCLUDE 10+ REAL LOCATIONS)**
 ```json
 {{
-  "perspective": "{perspective}",
-  "city": "{city}",
   "center_coordinates": [-122.4194, 37.7749],
   "impact_zones": [
     {{
@@ -541,7 +528,7 @@ CRITICAL REQUIREMENTS FOR REAL DATA - THIS IS MANDATORY:
 YOU ABSOLUTELY MUST INCLUDE THE SECOND JSON BLOCK WITH MAPBOX DATA. WITHOUT IT, THE VISUALIZATION WILL NOT WORK.
 
 1. **You MUST provide AT LEAST 10 different REAL impact zones** with:
-   - Actual street addresses or intersections in {city}
+   - Actual street addresses or intersections in the city
    - Exact GPS coordinates (lat/lng)
    - Specific hover_explanation for EACH zone explaining:
      * What changed at this specific location
@@ -549,7 +536,7 @@ YOU ABSOLUTELY MUST INCLUDE THE SECOND JSON BLOCK WITH MAPBOX DATA. WITHOUT IT,
      * WHO is impacted (residents, businesses, commuters)
      * NUMBERS (before/after metrics specific to this location)
 
-2. **You MUST provide AT LEAST 15 heatmap points** spread across {city} with real coordinates showing intensity of impact
+2. **You MUST provide AT LEAST 15 heatmap points** spread across the city with real coordinates showing intensity of impact
 
 3. **You MUST include blocked_roads array** with specific streets affected by the policy (with real coordinates)
 
@@ -557,7 +544,7 @@ YOU ABSOLUTELY MUST INCLUDE THE SECOND JSON BLOCK WITH MAPBOX DATA. WITHOUT IT,
 
 5. **Each impact zone MUST have**:
    - Real location name (e.g., "16th & Mission BART Station")
-   - Coordinates within {city}'s boundaries
+   - Coordinates within the city's boundaries
    - Logical connection to the policy
    - Detailed hover_explanation (100-200 characters)
 
@@ -569,7 +556,25 @@ If policy is "11PM car curfew", impact zones might include:
 - US-101 @ Cesar Chavez: Highway exit, 35% nighttime volume reduction
 - Valencia St corridor: Restaurant district, -20% late revenue but +15% daytime
 - Embarcadero: Tourist area, safer nighttime walking
-- Financial District intersections: Reduced delivery truck conflicts
+- Financial District intersections: Reduced delivery truck conflicts""",
+            context=f"""# AVAILABLE CONTEXT
+{self.build_context_section()}""",
+            suffix=f"""# POLICY TO SIMULATE
+{policy_document or self.task.description}
+
+{f"# FULL POLICY DOCUMENT:{policy_text[:3000]}" if policy_text else ""}
+
+# LOCATION
+{city}
+
+# PERSPECTIVE
+Focus on: **{perspective}**
+
+# BASELINE ENVIRONMENT
+{json.dumps(baseline_environment, indent=2) if baseline_environment else "Use real current data for " + city}
+
+# MAPBOX VISUALIZATION STRATEGY
+{viz_strategy}
 
 Begin your comprehensive simulation with ALL 30 parameters AND 15+ REAL SPECIFIC IMPACT ZONES:
 
@@ -579,6 +584,7 @@ FINAL REMINDER - YOU MUST OUTPUT BOTH JSON BLOCKS:
 
 WITHOUT THE SECOND JSON BLOCK, THE MAP WILL NOT WORK!
 """
+        )
     
     def _determine_visualization_strategy(self, perspective: str) -> str:
         """Determine which Mapbox APIs and visualizations to use"""
@@ -623,59 +629,84 @@ WITHOUT THE SECOND JSON BLOCK, THE MAP WILL NOT WORK!
         
         return strategies.get(perspective.lower(), strategies["comprehensive"])
     
+    def on_stream_chunk(self, text: str):
+        # Publish each block as soon as it closes so the map and charts can render early
+        for block in self.json_blocks.feed(text):
+            self._emit_block(block)
+    
+    def _emit_block(self, block: FencedBlock):
+        if block.data is None:
+            return
+        if block.index == 0:
+            self.emit("parameters", block.data)
+        elif block.index == 1:
+            self.emit("mapbox_data", self._with_run_fields(block.data))
+    
+    async def post_process(self, raw_output: str) -> Dict[str, Any]:
+        # A block still open when the output ended was cut off - keep its complete elements
+        block = self.json_blocks.finish()
+        if block is not None:
+            self._emit_block(block)
+        
+        # A lone block may hold the Mapbox data, which is only known once the stream ends
+        if len(self.json_blocks.blocks) == 1:
+            mapbox_data = self._mapbox_data(self.json_blocks.blocks)
+            if mapbox_data is not None:
+                self.emit("mapbox_data", mapbox_data)
+        return await super().post_process(raw_output)
+    
+    def validate_output(self, raw_output: str) -> bool:
+        """A candidate is usable if both the parameters and Mapbox JSON blocks parse"""
+        blocks = parse_output(raw_output).json_blocks()
+        return self._parameters_data(blocks) is not None and self._mapbox_data(blocks) is not None
+    
     async def execute(self) -> Dict[str, Any]:
-        full_analysis = ""
-        async for token in self.stream_execute():
-            full_analysis += token
+        full_analysis = await self.collect_output()
         
-        # Extract BOTH JSON blocks for complete visualization
-        parameters_data = self._extract_parameters_data(full_analysis)
-        mapbox_data = self._extract_mapbox_data(full_analysis)
+        # Both JSON blocks were extracted as they streamed
+        parameters_data = self._parameters_data(self.json_blocks.blocks)
+        mapbox_data = self._mapbox_data(self.json_blocks.blocks)
         
         return {
             "analysis": full_analysis,
             "parameters": parameters_data,
             "mapbox_data": mapbox_data,
+            "truncated": any(block.truncated for block in self.json_blocks.blocks),
             "perspective": self.custom_input.get("perspective", "comprehensive"),
             "agent_type": "simulation"
         }
     
-    def _extract_parameters_data(self, text: str) -> Optional[Dict[str, Any]]:
-        """Extract the parameters JSON from the analysis"""
-        try:
-            # Look for first JSON code block (parameters)
-            import re
-            json_blocks = re.findall(r'```json\s*(\{[\s\S]*?\})\s*```', text)
-            if json_blocks and len(json_blocks) > 0:
-                return json.loads(json_blocks[0])
-        except:
-            pass
+    def _parameters_data(self, blocks: List[FencedBlock]) -> Optional[Dict[str, Any]]:
+        """The parameters JSON - the first block"""
+        return blocks[0].data if blocks else None
+    
+    def _mapbox_data(self, blocks: List[FencedBlock]) -> Optional[Dict[str, Any]]:
+        """The Mapbox visualization JSON - the second block, or a lone block with map layers"""
+        logger.debug(f"Found {len(blocks)} JSON blocks in simulation output")
+        
+        if len(blocks) > 1:
+            mapbox_json = blocks[1].data
+            if mapbox_json is not None:
+                logger.debug(f"Extracted mapbox_data with keys: {list(mapbox_json.keys())}")
+                return self._with_run_fields(mapbox_json)
+        elif len(blocks) == 1:
+            data = blocks[0].data
+            if data is not None and ('blocked_roads' in data or 'impact_zones' in data or 'traffic_heatmap' in data):
+                logger.debug("Found mapbox data in single JSON block")
+                return self._with_run_fields(data)
+        
+        logger.debug("No mapbox_data found in simulation output")
         return None
     
-    def _extract_mapbox_data(self, text: str) -> Optional[Dict[str, Any]]:
-        """Extract the SECOND JSON block for Mapbox visualization"""
-        try:
-            import re
-            json_blocks = re.findall(r'```json\s*(\{[\s\S]*?\})\s*```', text)
-            print(f"[DEBUG] Found {len(json_blocks)} JSON blocks in simulation output")
-            
-            if json_blocks and len(json_blocks) > 1:
-                # Return the second JSON block (Mapbox data)
-                mapbox_json = json.loads(json_blocks[1])
-                print(f"[DEBUG] Extracted mapbox_data with keys: {list(mapbox_json.keys())}")
-                return mapbox_json
-            elif json_blocks and len(json_blocks) == 1:
-                # Check if the single block contains mapbox data
-                data = json.loads(json_blocks[0])
-                if 'blocked_roads' in data or 'impact_zones' in data or 'traffic_heatmap' in data:
-                    print(f"[DEBUG] Found mapbox data in single JSON block")
-                    return data
-            
-            print("[WARNING] No mapbox_data found in AI output!")
-            return None
-        except Exception as e:
-            print(f"[ERROR] Failed to extract mapbox_data: {e}")
-            return None
+    def _with_run_fields(self, mapbox_data: Dict[str, Any]) -> Dict[str, Any]:
+        """The Mapbox JSON with this run's perspective and city, which the static prompt prefix leaves out"""
+        if not isinstance(mapbox_data, dict):
+            return mapbox_data
+        return {
+            **mapbox_data,
+            "perspective": self.custom_input.get("perspective", "comprehensive"),
+            "city": self.custom_input.get("city", "")
+        }
 
 
 class EnhancedDebateAgent(BaseAgent):
@@ -686,24 +717,17 @@ class EnhancedDebateAgent(BaseAgent):
     
     def __init__(self, agent_id: str, task: AgentTask, config: AgentConfig = None):
         super().__init__(agent_id, AgentType.DEBATE, task, config)
+        
+        # Finds the chat-style messages while the debate streams
+        self.debate_messages = DebateMessageParser()
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         rounds = self.custom_input.get("rounds", 3)
         focus_areas = self.custom_input.get("focus_areas", [])
         human_question = self.custom_input.get("human_question", None)
         
-        return f"""You are a Debate Agent conducting a CONVERSATIONAL back-and-forth analysis of the policy.
-
-# POLICY PROPOSAL
-{self.task.description}
-
-# SIMULATION DATA AVAILABLE
-{self.build_context_section()}
-
-# DEBATE CONFIGURATION
-- Rounds: {rounds}
-- Focus Areas: {', '.join(focus_areas) if focus_areas else 'All aspects'}
-{f"- Human Question: {human_question}" if human_question else ""}
+        return PromptParts(
+            prefix=f"""You are a Debate Agent conducting a CONVERSATIONAL back-and-forth analysis of the policy.
 
 NOTE: You have access to simulation results with ALL 30 parameters. Use this data in your arguments!
 
@@ -807,18 +831,47 @@ Based on the debate, provide:
 - Proceed / Modify / Reconsider
 - Key modifications needed
 - Critical questions to resolve
-- Next steps for decision-makers
+- Next steps for decision-makers""",
+            context=f"""# SIMULATION DATA AVAILABLE
+{self.build_context_section()}""",
+            suffix=f"""# POLICY PROPOSAL
+{self.task.description}
+
+# DEBATE CONFIGURATION
+- Rounds: {rounds}
+- Focus Areas: {', '.join(focus_areas) if focus_areas else 'All aspects'}
+{f"- Human Question: {human_question}" if human_question else ""}
 
 Generate the complete debate analysis:
 """
+        )
+    
+    def on_stream_chunk(self, text: str):
+        # Publish each message as soon as it ends so clients can render it as a chat bubble
+        for message in self.debate_messages.feed(text):
+            self.emit("debate_message", message.to_dict())
+    
+    async def post_process(self, raw_output: str) -> Dict[str, Any]:
+        # The last message ends with the output
+        message = self.debate_messages.finish()
+        if message is not None:
+            self.emit("debate_message", message.to_dict())
+        
+        # Streaming clients get this result, not execute()'s
+        result = await super().post_process(raw_output)
+        result["transcript"] = self.transcript()
+        return result
+    
+    def transcript(self) -> List[Dict[str, Any]]:
+        """The debate's messages so far, in order"""
+        return [message.to_dict() for message in self.debate_messages.messages]
     
     async def execute(self) -> Dict[str, Any]:
-        full_debate = ""
-        async for token in self.stream_execute():
-            full_debate += token
+        full_debate = await self.collect_output()
         
         return {
             "debate_analysis": full_debate,
+            "transcript": self.transcript(),
             "requires_human_review": True,
             "agent_type": "debate"
         }
@@ -833,22 +886,14 @@ class EnhancedAggregatorAgent(BaseAgent):
     def __init__(self, agent_id: str, task: AgentTask, config: AgentConfig = None):
         super().__init__(agent_id, AgentType.AGGREGATOR, task, config)
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         output_format = self.custom_input.get("format", "PDF")
         include_sections = self.custom_input.get("sections", [
             "executive_summary", "simulations", "debate", "recommendations"
         ])
         
-        return f"""You are an Aggregator Agent compiling a comprehensive policy analysis report.
-
-# OUTPUT FORMAT
-{output_format} (structure content accordingly)
-
-# SECTIONS TO INCLUDE
-{', '.join(include_sections)}
-
-# ALL AVAILABLE DATA
-{self.build_context_section()}
+        return PromptParts(
+            prefix=f"""You are an Aggregator Agent compiling a comprehensive policy analysis report.
 
 # YOUR TASK
 
@@ -1005,15 +1050,21 @@ Final synthesis and call to action
 - Describe where charts/graphs should go
 - Use bullet points for clarity
 - Bold key findings
-- Include executive-friendly summaries at start of each section
+- Include executive-friendly summaries at start of each section""",
+            context=f"""# ALL AVAILABLE DATA
+{self.build_context_section()}""",
+            suffix=f"""# OUTPUT FORMAT
+{output_format} (structure content accordingly)
+
+# SECTIONS TO INCLUDE
+{', '.join(include_sections)}
 
 Generate the complete report document:
 """
+        )
     
     async def execute(self) -> Dict[str, Any]:
-        full_report = ""
-        async for token in self.stream_execute():
-            full_report += token
+        full_report = await self.collect_output()
         
         return {
             "final_report": full_report,
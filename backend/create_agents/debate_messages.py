@@ -0,0 +1,98 @@
+"""
+Debate Messages
+Incremental parsing of the **SIDE** / **ROUND** / **MESSAGE** blocks a debate streams
+Each message is returned as soon as its block ends; only the current line and message are held
+"""
+
+import re
+from typing import Any, Dict, List, Optional
+
+# "**SIDE**: FOR", "**SIDE:** FOR", "SIDE: FOR" ...
+_HEADER = re.compile(r"^\s*\**\s*(SIDE|ROUND|MESSAGE)\s*\**\s*:\s*\**\s*(.*?)\s*$", re.IGNORECASE)
+# A horizontal rule or markdown heading ends the message being written
+_BREAK = re.compile(r"^\s*(?:-{3,}|#{1,6}\s.*)\s*$")
+_ROUND_NUMBER = re.compile(r"\d+")
+
+
+class DebateMessage:
+    """One argument in the debate; round is None if the model didn't give one"""
+
+    def __init__(self, index: int, side: str, round: Optional[int], text: str):
+        self.index = index
+        self.side = side
+        self.round = round
+        self.text = text
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"index": self.index, "side": self.side, "round": self.round, "text": self.text}
+
+
+class DebateMessageParser:
+    """
+    Finds debate messages in text fed chunk by chunk
+
+    A message starts at a SIDE header and its text follows the MESSAGE
+    header. It is complete at the next ---, heading or SIDE header, or when
+    finish() is called. Messages with no side or no text are skipped.
+    """
+
+    def __init__(self):
+        self.messages: List[DebateMessage] = []
+        self._line = ""  # Text after the last newline
+        self._side: Optional[str] = None  # Side of the open message, None outside one
+        self._round: Optional[int] = None
+        self._text: Optional[List[str]] = None  # Lines after MESSAGE, None before it
+
+    def feed(self, text: str) -> List[DebateMessage]:
+        """Scan the next chunk; returns messages completed by it"""
+        completed = []
+        lines = (self._line + text).split("\n")
+        self._line = lines.pop()
+        for line in lines:
+            message = self._read_line(line)
+            if message is not None:
+                completed.append(message)
+        return completed
+
+    def finish(self) -> Optional[DebateMessage]:
+        """End of output: completes and returns the message still being written, if any"""
+        line, self._line = self._line, ""
+        message = self._read_line(line)
+        return message if message is not None else self._complete()
+
+    def _read_line(self, line: str) -> Optional[DebateMessage]:
+        header = _HEADER.match(line)
+        if header is not None:
+            name, value = header.group(1).upper(), header.group(2).strip("* ")
+            if name == "SIDE":
+                message = self._complete()
+                self._side = value.upper()
+                return message
+            if self._side is None:
+                return None
+            if self._text is not None:
+                self._text.append(line)  # Part of the message, e.g. quoting the format
+            elif name == "ROUND":
+                number = _ROUND_NUMBER.search(value)
+                self._round = int(number.group()) if number else None
+            else:
+                self._text = [value] if value else []
+            return None
+
+        if _BREAK.match(line):
+            return self._complete()
+        if self._text is not None:
+            self._text.append(line)
+        return None
+
+    def _complete(self) -> Optional[DebateMessage]:
+        side, round_number, lines = self._side, self._round, self._text
+        self._side, self._round, self._text = None, None, None
+        if not side or lines is None:
+            return None
+        text = "\n".join(lines).strip()
+        if not text:
+            return None
+        message = DebateMessage(len(self.messages), side, round_number, text)
+        self.messages.append(message)
+        return message
@@ -0,0 +1,99 @@
+"""
+Fenced JSON
+Incremental extraction of ```json code blocks from streamed LLM output
+Each block is returned as soon as its closing fence arrives; no text is scanned twice
+"""
+
+import json
+from typing import Any, List, Optional
+
+from json_repair import repair_json
+
+OPEN_FENCE = "```json"
+CLOSE_FENCE = "```"
+
+
+class FencedBlock:
+    """
+    A ```json block holding an object; data is None if it didn't parse
+
+    truncated blocks were still open when the output ended and have been
+    closed at their last complete element.
+    """
+
+    def __init__(self, index: int, text: str, truncated: bool = False):
+        self.index = index
+        self.text = text
+        self.truncated = truncated
+        self.data: Optional[Any] = None
+        if truncated:
+            self.data, _ = repair_json(text)
+            return
+        try:
+            self.data = json.loads(text)
+        except json.JSONDecodeError:
+            pass
+
+
+class FencedJsonExtractor:
+    """
+    Finds ```json blocks in text fed chunk by chunk
+
+    Matches the blocks the agents' old ```json\\s*(\\{...\\})\\s*``` regex did:
+    blocks whose content is not a {...} object are skipped and not counted.
+    Only the text of an open block and a possible partial fence are held.
+    """
+
+    def __init__(self):
+        self.blocks: List[FencedBlock] = []
+        self._tail = ""  # Unscanned text: a partial fence, or the end of an open block
+        self._block_parts: Optional[List[str]] = None  # Text of the open block, None outside one
+
+    def feed(self, text: str) -> List[FencedBlock]:
+        """Scan the next chunk; returns blocks closed by it"""
+        closed = []
+        pending = self._tail + text
+        while True:
+            if self._block_parts is None:
+                start = pending.find(OPEN_FENCE)
+                if start < 0:
+                    self._tail = pending[-(len(OPEN_FENCE) - 1):]
+                    return closed
+                pending = pending[start + len(OPEN_FENCE):]
+                self._block_parts = []
+                continue
+
+            end = pending.find(CLOSE_FENCE)
+            if end < 0:
+                # Hold back what could be the start of the closing fence
+                keep = len(CLOSE_FENCE) - 1
+                self._block_parts.append(pending[:-keep])
+                self._tail = pending[-keep:]
+                return closed
+
+            self._block_parts.append(pending[:end])
+            content = "".join(self._block_parts).strip()
+            self._block_parts = None
+            pending = pending[end + len(CLOSE_FENCE):]
+            if content.startswith("{") and content.endswith("}"):
+                block = FencedBlock(len(self.blocks), content)
+                self.blocks.append(block)
+                closed.append(block)
+
+    def finish(self) -> Optional[FencedBlock]:
+        """
+        End of output: a block left open (e.g. cut off by max_tokens) is
+        repaired, added and returned if anything in it could be recovered
+        """
+        if self._block_parts is None:
+            return None
+        content = ("".join(self._block_parts) + self._tail).strip()
+        self._block_parts = None
+        self._tail = ""
+        if not content.startswith("{"):
+            return None
+        block = FencedBlock(len(self.blocks), content, truncated=True)
+        if block.data is None:
+            return None
+        self.blocks.append(block)
+        return block
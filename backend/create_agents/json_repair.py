@@ -0,0 +1,133 @@
+"""
+JSON Repair
+Recovers the largest valid prefix of JSON cut off mid-value, e.g. by max_tokens
+The trailing incomplete element is dropped and open arrays and objects are closed
+"""
+
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+_DECODER = json.JSONDecoder()
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+# An escape sequence cut off at the end of an open string
+_PARTIAL_ESCAPE = re.compile(r"\\(u[0-9a-fA-F]{0,3})?$")
+
+# Tries from the end before giving up; each try is one json.loads
+MAX_CUT_ATTEMPTS = 32
+
+
+def _cut_points(text: str, start: int) -> Tuple[List[Tuple[int, str, str]], Optional[Tuple[int, str, str]], bool]:
+    """
+    Scan JSON from start, recording every place it could be cut and closed
+
+    Returns:
+        ([(end index, open containers, text to insert before the closers)]
+        after each complete element, the same for closing a string value the
+        text ends in, and whether the top-level value was closed)
+    """
+    cuts: List[Tuple[int, str, str]] = []
+    stack: List[str] = []
+    expect_key = False  # Next string in the current object is a key
+    in_string = False
+    string_is_key = False
+    string_start = 0
+    escaped = False
+    scalar_end = None  # End of an unquoted number/literal, recorded once something follows it
+
+    i = start
+    while i < len(text):
+        char = text[i]
+
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+                if not string_is_key:
+                    cuts.append((i + 1, "".join(stack), ""))
+            i += 1
+            continue
+
+        if scalar_end is not None and (char in ",]} \t\r\n"):
+            cuts.append((scalar_end, "".join(stack), ""))
+            scalar_end = None
+
+        if char == '"':
+            in_string = True
+            string_is_key = bool(stack) and stack[-1] == "{" and expect_key
+            string_start = i + 1
+        elif char in "{[":
+            stack.append(char)
+            expect_key = char == "{"
+        elif char in "}]":
+            if not stack or _CLOSERS[stack[-1]] != char:
+                break  # Not JSON any more
+            stack.pop()
+            expect_key = False
+            if not stack:
+                return cuts, None, True
+            cuts.append((i + 1, "".join(stack), ""))
+        elif char == ",":
+            expect_key = bool(stack) and stack[-1] == "{"
+        elif char == ":":
+            expect_key = False
+        elif not char.isspace():
+            # Number or true/false/null; complete only once a delimiter follows
+            while i + 1 < len(text) and text[i + 1] not in ',]} \t\r\n"':
+                i += 1
+            scalar_end = i + 1
+        i += 1
+
+    # Cut off inside a string value: what arrived can be kept by closing it
+    open_string = None
+    if in_string and not string_is_key:
+        partial = _PARTIAL_ESCAPE.sub("", text[string_start:])
+        open_string = (string_start, "".join(stack), partial + '"')
+
+    return cuts, open_string, False
+
+
+def repair_json(text: str) -> Tuple[Optional[Any], bool]:
+    """
+    Parse the first JSON object or array in text, repairing it if truncated
+
+    Returns:
+        (parsed value or None if nothing could be recovered, truncated) where
+        truncated is True if the value was cut off and had to be closed
+    """
+    starts = [index for index in (text.find("{"), text.find("[")) if index >= 0]
+    if not starts:
+        return None, False
+    start = min(starts)
+
+    try:
+        value, _ = _DECODER.raw_decode(text, start)
+        return value, False
+    except json.JSONDecodeError:
+        pass
+
+    cuts, open_string, closed = _cut_points(text, start)
+    if closed:
+        # Balanced but invalid (e.g. a stray comma) - repairing truncation won't help
+        return None, False
+
+    # Prefer dropping the element that was cut off; a partial string is kept
+    # only when nothing complete came before it (e.g. one long text field),
+    # and an empty top-level container is the last resort
+    attempts = list(reversed(cuts[-MAX_CUT_ATTEMPTS:]))
+    if open_string is not None:
+        attempts.append(open_string)
+    attempts.append((start + 1, text[start], ""))
+
+    for end, stack, insert in attempts:
+        candidate = text[start:end] + insert + "".join(_CLOSERS[opener] for opener in reversed(stack))
+        try:
+            return json.loads(candidate), True
+        except json.JSONDecodeError:
+            continue
+    return None, True
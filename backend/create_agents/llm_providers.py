@@ -0,0 +1,406 @@
+"""
+LLM Providers
+Pluggable text-generation backends, selected by AgentConfig.model
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import re
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Any, AsyncGenerator, Callable, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+try:
+    import google.generativeai as genai
+except ImportError:
+    genai = None
+
+_gemini_configured = False
+
+
+def configure_gemini():
+    """Configure the Gemini SDK with GEMINI_API_KEY, once per process"""
+    global _gemini_configured
+    if _gemini_configured:
+        return
+    if genai is None:
+        raise ValueError("google-generativeai is not installed; use a local model or install it")
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        logger.error("GEMINI_API_KEY not found in environment variables!")
+        logger.error("Create a .env file with: GEMINI_API_KEY=your_key_here")
+        raise ValueError("GEMINI_API_KEY must be set to use Gemini models")
+
+    # Configure with API key explicitly to avoid default credentials error
+    genai.configure(api_key=api_key)
+    _gemini_configured = True
+    logger.info(f"[OK] Gemini API configured with key (length: {len(api_key)})")
+
+
+class PrefixCache:
+    """
+    Tracks reuse of stable prompt prefixes, per model
+
+    Prompts are laid out as a static instruction prefix, then shared context,
+    then per-request text (see PromptParts in base_agent.py). Each request
+    reports its cacheable leading parts; a level is a hit when the same text
+    up to and including that part was seen recently. This is a local stand-in
+    for provider-side prefix caching and the measure of how much of our input
+    a provider cache could serve. Providers that report cached input tokens
+    (Gemini's implicit caching) add the measured counts via record_usage.
+    """
+
+    def __init__(self, max_prefixes: Optional[int] = None):
+        self.max_prefixes = max_prefixes or int(os.getenv("PREFIX_CACHE_MAX_ENTRIES", "1024"))
+        self._seen: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+        self.requests = 0
+        self.level_hits: List[int] = []
+        self.prompt_chars = 0
+        self.reused_chars = 0
+        self.provider_prompt_tokens = 0
+        self.provider_cached_tokens = 0
+
+    def observe(self, model: str, parts: List[str], prompt_chars: int) -> int:
+        """
+        Record a request whose prompt starts with the given parts
+
+        Returns:
+            Number of leading chars already seen, i.e. reusable from a prefix cache
+        """
+        self.requests += 1
+        self.prompt_chars += prompt_chars
+        digest = hashlib.sha256(model.encode("utf-8"))
+        length = 0
+        reused = 0
+        for level, part in enumerate(parts):
+            if not part:
+                continue
+            digest.update(part.encode("utf-8"))
+            length += len(part)
+            key = (model, digest.hexdigest())
+            while len(self.level_hits) <= level:
+                self.level_hits.append(0)
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                self.level_hits[level] += 1
+                reused = length
+            else:
+                self._seen[key] = None
+                if len(self._seen) > self.max_prefixes:
+                    self._seen.popitem(last=False)
+        self.reused_chars += reused
+        return reused
+
+    def record_usage(self, prompt_tokens: int, cached_tokens: int):
+        """Add provider-reported prompt and cached-prompt token counts"""
+        self.provider_prompt_tokens += prompt_tokens
+        self.provider_cached_tokens += cached_tokens
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get prefix hit ratios per level and the share of prompt text that was reusable"""
+        return {
+            "requests": self.requests,
+            "hit_ratio_by_level": [
+                round(hits / self.requests, 4) if self.requests else None for hits in self.level_hits
+            ],
+            "reusable_share": round(self.reused_chars / self.prompt_chars, 4) if self.prompt_chars else None,
+            "provider_prompt_tokens": self.provider_prompt_tokens,
+            "provider_cached_tokens": self.provider_cached_tokens,
+            "provider_cached_share": (
+                round(self.provider_cached_tokens / self.provider_prompt_tokens, 4)
+                if self.provider_prompt_tokens else None
+            ),
+            "tracked_prefixes": len(self._seen)
+        }
+
+
+# Global prefix statistics shared by all providers in the process
+_prefix_cache = None
+
+def get_prefix_cache() -> PrefixCache:
+    """Get or create the global prefix cache"""
+    global _prefix_cache
+    if _prefix_cache is None:
+        _prefix_cache = PrefixCache()
+    return _prefix_cache
+
+
+class LLMProvider(ABC):
+    """
+    A streaming text-generation backend
+    Agents only call stream(); retries, deadlines and hedging stay in BaseAgent.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+
+    @abstractmethod
+    def stream(self, prompt: str, temperature: float, max_tokens: int) -> AsyncGenerator[str, None]:
+        """Stream non-empty text chunks for a single request"""
+
+    def prepare_prefix(self, parts: List[str], prompt: str) -> int:
+        """
+        Prefix-cache hook, called once per task before its first request
+
+        parts are the leading, cacheable parts of prompt, most stable first.
+        The default records them in the process-wide PrefixCache; providers
+        with explicit context caching can override this to create or look up
+        a cache entry. Returns the number of leading chars already seen.
+        """
+        return get_prefix_cache().observe(self.model, parts, len(prompt))
+
+
+class GeminiClientPool:
+    """
+    Process-wide GenerativeModel clients, keyed by model and generation settings
+
+    Each client is built once with its GenerationConfig baked in, so agents
+    skip client setup and share the SDK's underlying connection. The least
+    recently used client is dropped once max_clients is exceeded.
+    """
+
+    def __init__(self, max_clients: Optional[int] = None):
+        self.max_clients = max_clients or int(os.getenv("LLM_CLIENT_POOL_SIZE", "32"))
+        # (model, temperature, max_tokens) -> client
+        self._clients: "OrderedDict[Tuple[str, float, int], Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.warmed = 0
+        self.setup_seconds = 0.0
+
+    def get(self, model: str, temperature: float, max_tokens: int):
+        """Get the pooled client for these settings, creating it on first use"""
+        client, created = self._client(model, temperature, max_tokens)
+        if created:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return client
+
+    def _client(self, model: str, temperature: float, max_tokens: int) -> Tuple[Any, bool]:
+        key = (model, temperature, max_tokens)
+        client = self._clients.get(key)
+        if client is not None:
+            self._clients.move_to_end(key)
+            return client, False
+        configure_gemini()
+        started = time.perf_counter()
+        client = genai.GenerativeModel(
+            model,
+            generation_config=genai.types.GenerationConfig(
+                temperature=temperature,
+                max_output_tokens=max_tokens,
+            )
+        )
+        self.setup_seconds += time.perf_counter() - started
+        self._clients[key] = client
+        while len(self._clients) > self.max_clients:
+            self._clients.popitem(last=False)
+            self.evictions += 1
+        return client, True
+
+    async def warm_up(
+        self,
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        ping: bool = True,
+        ping_timeout: float = 5.0
+    ):
+        """
+        Create a client ahead of the first request and optionally open its connection
+
+        Raises:
+            asyncio.TimeoutError: If the ping takes longer than ping_timeout
+        """
+        client, created = self._client(model, temperature, max_tokens)
+        if created:
+            self.warmed += 1
+        if ping:
+            # Cheap call that sets up the channel without generating anything
+            await asyncio.wait_for(client.count_tokens_async("ping"), timeout=ping_timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get pool hit and reuse metrics
+        Every hit is a request sent on an existing client and its open connection.
+        """
+        lookups = self.hits + self.misses
+        created = self.misses + self.warmed
+        return {
+            "clients": len(self._clients),
+            "max_clients": self.max_clients,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "warmed": self.warmed,
+            "client_setup_seconds": round(self.setup_seconds, 4),
+            "avg_client_setup_ms": round(1000 * self.setup_seconds / created, 2) if created else None
+        }
+
+
+# Global pool shared by all Gemini agents in the process
+_client_pool = None
+
+def get_client_pool() -> GeminiClientPool:
+    """Get or create the global Gemini client pool"""
+    global _client_pool
+    if _client_pool is None:
+        _client_pool = GeminiClientPool()
+    return _client_pool
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini via google-generativeai, using pooled clients"""
+
+    def __init__(self, model: str):
+        super().__init__(model)
+        configure_gemini()
+
+    async def stream(self, prompt: str, temperature: float, max_tokens: int) -> AsyncGenerator[str, None]:
+        client = get_client_pool().get(self.model, temperature, max_tokens)
+        response = await client.generate_content_async(prompt, stream=True)
+
+        usage = None
+        async for chunk in response:
+            usage = getattr(chunk, 'usage_metadata', None) or usage
+            if hasattr(chunk, 'text') and chunk.text:
+                yield chunk.text
+
+        # Stable prefixes are cached implicitly by Gemini 2.5 models; measure it
+        if usage is not None:
+            get_prefix_cache().record_usage(
+                getattr(usage, 'prompt_token_count', 0) or 0,
+                getattr(usage, 'cached_content_token_count', 0) or 0
+            )
+
+
+class LocalProvider(LLMProvider):
+    """
+    Offline provider that streams canned or synthetic text at a realistic pace
+
+    Configured through the model string, falling back to environment defaults:
+
+        local?ttft=0.8&tps=40&error_rate=0.05&tokens=400&response=fixtures/sim.txt
+
+    - ttft: seconds before the first token (LOCAL_LLM_TTFT_SECONDS)
+    - tps: tokens per second after the first (LOCAL_LLM_TOKENS_PER_SECOND)
+    - error_rate: chance a request fails with a retryable ConnectionError
+      before its first token (LOCAL_LLM_ERROR_RATE)
+    - tokens: length of synthetic responses (LOCAL_LLM_TOKENS)
+    - response: file whose text is replayed instead (LOCAL_LLM_RESPONSE_FILE)
+    - seed: makes error injection reproducible; output is always a function
+      of the prompt (LOCAL_LLM_SEED)
+    """
+
+    WORDS = (
+        "policy", "traffic", "housing", "residents", "impact", "analysis", "zoning", "transit",
+        "budget", "community", "emissions", "stakeholders", "corridor", "density", "safety",
+        "access", "economic", "neighborhood", "infrastructure", "recommendation"
+    )
+
+    def __init__(self, model: str):
+        super().__init__(model)
+        _, _, query = model.partition("?")
+        params = {key: values[-1] for key, values in parse_qs(query).items()}
+
+        self.ttft = float(params.get("ttft", os.getenv("LOCAL_LLM_TTFT_SECONDS", "0.5")))
+        self.tokens_per_second = float(params.get("tps", os.getenv("LOCAL_LLM_TOKENS_PER_SECOND", "50")))
+        self.error_rate = float(params.get("error_rate", os.getenv("LOCAL_LLM_ERROR_RATE", "0")))
+        self.synthetic_tokens = int(params.get("tokens", os.getenv("LOCAL_LLM_TOKENS", "300")))
+        self.response_file = params.get("response", os.getenv("LOCAL_LLM_RESPONSE_FILE"))
+        seed = params.get("seed", os.getenv("LOCAL_LLM_SEED"))
+        self._random = random.Random(int(seed)) if seed is not None else random.Random()
+
+        self._canned: Optional[str] = None
+        if self.response_file:
+            with open(self.response_file, encoding="utf-8") as f:
+                self._canned = f.read()
+
+    def _response_text(self, prompt: str, max_tokens: int) -> str:
+        if self._canned is not None:
+            return self._canned
+
+        # Same prompt, same text - so runs are reproducible and cacheable
+        prompt_random = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+        count = min(self.synthetic_tokens, max_tokens)
+        words = [prompt_random.choice(self.WORDS) for _ in range(count)]
+        sentences = [" ".join(words[i:i + 12]).capitalize() + "." for i in range(0, len(words), 12)]
+        return "\n".join(" ".join(sentences[i:i + 4]) for i in range(0, len(sentences), 4))
+
+    async def stream(self, prompt: str, temperature: float, max_tokens: int) -> AsyncGenerator[str, None]:
+        loop = asyncio.get_running_loop()
+        tokens = re.findall(r"\S+\s*|\s+", self._response_text(prompt, max_tokens))
+
+        await asyncio.sleep(self.ttft)
+        if self._random.random() < self.error_rate:
+            raise ConnectionError("Injected local provider error")
+
+        # Pace against the clock rather than sleeping per token, so high rates
+        # are delivered in small batches instead of drifting behind
+        started = loop.time()
+        sent = 0
+        while sent < len(tokens):
+            due = len(tokens) if self.tokens_per_second <= 0 else min(
+                len(tokens), max(sent + 1, int((loop.time() - started) * self.tokens_per_second) + 1)
+            )
+            yield "".join(tokens[sent:due])
+            sent = due
+            if sent < len(tokens):
+                await asyncio.sleep(max(0.0, started + sent / self.tokens_per_second - loop.time()))
+
+
+# Model-name prefix -> provider factory; anything unmatched goes to Gemini
+PROVIDERS: Dict[str, Callable[[str], LLMProvider]] = {
+    "local": LocalProvider,
+}
+
+
+def register_provider(prefix: str, factory: Callable[[str], LLMProvider]):
+    """Route model names starting with prefix to a provider"""
+    PROVIDERS[prefix] = factory
+
+
+async def warm_up_providers(models: Optional[List[str]] = None, temperature: float = 0.7, max_tokens: int = 4096):
+    """
+    Pre-create pooled Gemini clients at startup so the first agents skip client setup
+
+    Models default to LLM_WARMUP_MODELS (comma-separated) or AGENT_DEFAULT_MODEL.
+    Set LLM_WARMUP_PING=0 to skip the connection-opening request; a ping slower
+    than LLM_WARMUP_TIMEOUT_SECONDS is abandoned. Local models need no warm-up;
+    failures are logged, never raised.
+    """
+    if models is None:
+        configured = os.getenv("LLM_WARMUP_MODELS") or os.getenv("AGENT_DEFAULT_MODEL", "gemini-2.5-flash")
+        models = [model.strip() for model in configured.split(",") if model.strip()]
+    ping = os.getenv("LLM_WARMUP_PING", "1") != "0"
+    ping_timeout = float(os.getenv("LLM_WARMUP_TIMEOUT_SECONDS", "5"))
+
+    for model in models:
+        try:
+            if not isinstance(get_provider(model), GeminiProvider):
+                continue
+            started = time.perf_counter()
+            await get_client_pool().warm_up(model, temperature, max_tokens, ping=ping, ping_timeout=ping_timeout)
+            logger.info(f"[OK] Warmed up {model} client in {time.perf_counter() - started:.2f}s")
+        except asyncio.TimeoutError:
+            logger.warning(f"Warm-up ping of {model} timed out after {ping_timeout}s, continuing without it")
+        except Exception as e:
+            logger.warning(f"Warm-up of {model} failed: {e}")
+
+
+def get_provider(model: str) -> LLMProvider:
+    """Create the provider for a model name such as 'gemini-2.5-flash' or 'local?tps=30'"""
+    prefix = re.split(r"[?:]", model, maxsplit=1)[0]
+    factory = PROVIDERS.get(prefix, GeminiProvider)
+    return factory(model)
@@ -0,0 +1,234 @@
+"""
+Map Schemas
+Typed schemas for the map overlay sections the visualization agents generate
+Features are validated one at a time; invalid ones are repaired where possible, otherwise dropped
+"""
+
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, Type
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+Severity = Literal["high", "medium", "low"]
+
+# Words models use instead of the three severity levels
+SEVERITY_ALIASES = {
+    "critical": "high", "severe": "high", "major": "high", "very high": "high",
+    "moderate": "medium", "med": "medium", "mid": "medium",
+    "minor": "low", "minimal": "low", "very low": "low",
+}
+
+# Impact zone radius (degrees) by severity, for zones generated without one
+DEFAULT_RADIUS = {"high": 0.010, "medium": 0.008, "low": 0.005}
+
+METERS_PER_DEGREE = 111_320
+
+
+def _check_coordinates(coordinates: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    for lng, lat in coordinates:
+        if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+            raise ValueError(f"[{lng}, {lat}] is not a [lng, lat] pair")
+    return coordinates
+
+
+class LngLat(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    lng: float = Field(ge=-180, le=180)
+    lat: float = Field(ge=-90, le=90)
+
+
+class BlockedRoad(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    name: str = Field(min_length=1)
+    coordinates: List[Tuple[float, float]] = Field(min_length=2)
+    reason: str = ""
+    impact: Dict[str, Any] = Field(default_factory=dict)
+    severity: Severity = "medium"
+
+    @field_validator("coordinates")
+    @classmethod
+    def coordinates_in_range(cls, value):
+        return _check_coordinates(value)
+
+
+class ImpactZone(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    center: LngLat
+    radius: float = Field(gt=0, le=1)
+    severity: Severity = "medium"
+    description: str = ""
+
+
+class HeatmapPoint(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    lat: float = Field(ge=-90, le=90)
+    lng: float = Field(ge=-180, le=180)
+    intensity: float = Field(ge=0, le=1)
+
+
+class AlternateRoute(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    name: str = Field(min_length=1)
+    coordinates: List[Tuple[float, float]] = Field(min_length=1)
+    delay: str = ""
+    description: str = ""
+    traffic_increase: str = ""
+
+    @field_validator("coordinates")
+    @classmethod
+    def coordinates_in_range(cls, value):
+        return _check_coordinates(value)
+
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        return float(str(value).strip().rstrip("%"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _lng_lat(lng: Any, lat: Any) -> Optional[Tuple[float, float]]:
+    """Numeric (lng, lat), swapped back if the model wrote [lat, lng]"""
+    lng, lat = _number(lng), _number(lat)
+    if lng is None or lat is None:
+        return None
+    if abs(lat) > 90 >= abs(lng):
+        lng, lat = lat, lng
+    return lng, lat
+
+
+def _point(value: Any) -> Optional[Tuple[float, float]]:
+    if isinstance(value, dict):
+        return _lng_lat(
+            value.get("lng", value.get("lon", value.get("longitude"))),
+            value.get("lat", value.get("latitude"))
+        )
+    if isinstance(value, (list, tuple)) and len(value) >= 2:
+        return _lng_lat(value[0], value[1])
+    return None
+
+
+def _repair_coordinates(value: Any) -> List[List[float]]:
+    points = [_point(point) for point in value] if isinstance(value, list) else []
+    return [list(point) for point in points if point is not None]
+
+
+def _repair_severity(value: Any) -> str:
+    severity = str(value or "").strip().lower()
+    if severity in ("high", "medium", "low"):
+        return severity
+    return SEVERITY_ALIASES.get(severity, "medium")
+
+
+def _repair_text(feature: Dict[str, Any], *keys: str):
+    for key in keys:
+        if key in feature and not isinstance(feature[key], str):
+            feature[key] = "" if feature[key] is None else str(feature[key])
+
+
+def _repair_road(feature: Dict[str, Any]) -> Dict[str, Any]:
+    feature["coordinates"] = _repair_coordinates(feature.get("coordinates"))
+    feature["severity"] = _repair_severity(feature.get("severity"))
+    if not isinstance(feature.get("impact"), dict):
+        feature["impact"] = {"description": str(feature["impact"])} if feature.get("impact") else {}
+    _repair_text(feature, "name", "reason")
+    return feature
+
+
+def _repair_zone(feature: Dict[str, Any]) -> Dict[str, Any]:
+    center = _point(feature.get("center")) or _point(feature)
+    if center is not None:
+        feature["center"] = {"lng": center[0], "lat": center[1]}
+    feature["severity"] = _repair_severity(feature.get("severity"))
+
+    radius = _number(feature.get("radius"))
+    if radius is None or radius <= 0:
+        radius = DEFAULT_RADIUS[feature["severity"]]
+    elif radius > 1:
+        radius /= METERS_PER_DEGREE  # Given in meters
+    feature["radius"] = radius
+    _repair_text(feature, "description")
+    return feature
+
+
+def _repair_heatmap_point(feature: Dict[str, Any]) -> Dict[str, Any]:
+    point = _point(feature) or _point(feature.get("coordinates"))
+    if point is not None:
+        feature["lng"], feature["lat"] = point
+
+    intensity = _number(feature.get("intensity", feature.get("weight", 0.5)))
+    if intensity is not None:
+        if 1 < intensity <= 100:
+            intensity /= 100  # Given as a percentage
+        feature["intensity"] = min(1.0, max(0.0, intensity))
+    return feature
+
+
+def _repair_route(feature: Dict[str, Any]) -> Dict[str, Any]:
+    feature["coordinates"] = _repair_coordinates(feature.get("coordinates"))
+    _repair_text(feature, "name", "delay", "description", "traffic_increase")
+    return feature
+
+
+# Section key -> (schema, repair function, how much to ask for when re-asking)
+MAP_SECTIONS: Dict[str, Tuple[Type[BaseModel], Callable[[Dict[str, Any]], Dict[str, Any]], str]] = {
+    "blocked_roads": (BlockedRoad, _repair_road, "4-8 roads, each with 2+ [lng, lat] points, a reason, impact and severity"),
+    "impact_zones": (ImpactZone, _repair_zone, "3-6 zones, each with a {lng, lat} center, radius in degrees (0.004-0.012), severity and description"),
+    "traffic_heatmap": (HeatmapPoint, _repair_heatmap_point, "15-25 points, each with lat, lng and intensity from 0 to 1"),
+    "alternate_routes": (AlternateRoute, _repair_route, "2-4 routes, each with a name, [lng, lat] coordinates, delay, description and traffic_increase"),
+}
+
+
+def validate_map_data(data: Any) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Validate each feature of each map section against its schema
+
+    A feature that fails is repaired (coordinate order and types, severity
+    spelling, radius units, intensity range) and validated again; if it
+    still fails it is dropped. Keys other than the map sections are kept.
+
+    Returns:
+        (data with only valid features, report with per-section counts of
+        valid, repaired and dropped features and the sections left empty)
+    """
+    data = dict(data) if isinstance(data, dict) else {}
+    report: Dict[str, Any] = {"sections": {}, "missing": []}
+
+    for key, (schema, repair, _) in MAP_SECTIONS.items():
+        features = data.get(key)
+        if isinstance(features, dict):
+            features = [features]
+        if not isinstance(features, list):
+            features = []
+
+        kept: List[Dict[str, Any]] = []
+        counts = {"valid": 0, "repaired": 0, "dropped": 0, "errors": []}
+        for feature in features:
+            if not isinstance(feature, dict):
+                counts["dropped"] += 1
+                continue
+            try:
+                kept.append(schema.model_validate(feature).model_dump())
+                counts["valid"] += 1
+                continue
+            except ValidationError:
+                pass
+            try:
+                kept.append(schema.model_validate(repair(dict(feature))).model_dump())
+                counts["repaired"] += 1
+            except ValidationError as e:
+                counts["dropped"] += 1
+                if len(counts["errors"]) < 3:
+                    error = e.errors()[0]
+                    counts["errors"].append(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}")
+
+        data[key] = kept
+        report["sections"][key] = counts
+        if not kept:
+            report["missing"].append(key)
+
+    return data, report
@@ -6,8 +6,9 @@ Uses Mapbox MCP to select appropriate visualization tools
 import logging
 import json
 from typing import Dict, Any, AsyncGenerator
-from .base_agent import BaseAgent
+from .base_agent import BaseAgent, PromptParts
 from .agent_types import AgentType, AgentTask, AgentConfig
+from .output_parser import parse_output
 import sys
 import os
 
@@ -56,7 +57,7 @@ You have access to REAL San Francisco data and should use actual:
 - Real coordinates
 """
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         # Get policy info from custom_input
         policy_text = self.custom_input.get("policy_text", "")
         policy_overview = self.custom_input.get("overview", "")
@@ -81,31 +82,11 @@ You have access to REAL San Francisco data and should use actual:
             for tool in recommended_tools
         ])
         
-        return f"""You are a Mapbox Visualization Agent with access to powerful geospatial tools.
+        return PromptParts(
+            prefix=f"""You are a Mapbox Visualization Agent with access to powerful geospatial tools.
 
 {self.get_capability_description()}
 
-# YOUR TASK
-{self.task.description}
-
-# POLICY INFORMATION
-## Overview
-{policy_overview}
-
-## Full Policy Text
-{policy_text[:2000]}{"..." if len(policy_text) > 2000 else ""}
-
-## Recent Discussion
-{message_history}
-
-# RECOMMENDED MAPBOX TOOLS
-Based on analysis, these tools are recommended:
-
-{tools_description}
-
-# CONTEXT FROM OTHER AGENTS
-{self.build_context_section()}
-
 # YOUR DELIVERABLE
 Generate a JSON configuration for Mapbox visualization with the following structure:
 
@@ -175,26 +156,59 @@ Generate a JSON configuration for Mapbox visualization with the following struct
 
 ## IMPORTANT:
 - Base everything on the policy document
-- Use the recommended tools listed above
+- Use the recommended tools listed below
 - Make data realistic and verifiable
-- Explain WHY each visualization was chosen
+- Explain WHY each visualization was chosen""",
+            context=f"""# CONTEXT FROM OTHER AGENTS
+{self.build_context_section()}""",
+            suffix=f"""# YOUR TASK
+{self.task.description}
+
+# POLICY INFORMATION
+## Overview
+{policy_overview}
+
+## Full Policy Text
+{policy_text[:2000]}{"..." if len(policy_text) > 2000 else ""}
+
+## Recent Discussion
+{message_history}
+
+# RECOMMENDED MAPBOX TOOLS
+Based on analysis, these tools are recommended:
+
+{tools_description}
 
 Generate the complete JSON configuration now:
 """
+        )
+    
+    def validate_output(self, raw_output: str) -> bool:
+        """A candidate is usable if it holds a complete JSON config with visualizations"""
+        mapbox_config, truncated = parse_output(raw_output).json_object()
+        return isinstance(mapbox_config, dict) and not truncated and bool(mapbox_config.get('visualizations'))
     
     async def post_process(self, raw_output: str) -> Dict[str, Any]:
         """
         Extract and validate the Mapbox configuration JSON
+        A config cut off by max_tokens is closed at its last complete element
         """
         try:
             # Try to extract JSON from the output
             json_start = raw_output.find('{')
-            json_end = raw_output.rfind('}') + 1
             
-            if json_start >= 0 and json_end > json_start:
-                json_str = raw_output[json_start:json_end]
-                mapbox_config = json.loads(json_str)
+            if json_start >= 0:
+                mapbox_config, truncated = parse_output(raw_output).json_object()
+                if not isinstance(mapbox_config, dict):
+                    logger.error("Failed to parse JSON configuration")
+                    return {
+                        "success": False,
+                        "error": "Invalid JSON configuration",
+                        "raw_output": raw_output
+                    }
                 
+                if truncated:
+                    logger.warning("⚠️ Mapbox config was cut off, keeping its complete elements")
                 logger.info(f"✅ Extracted Mapbox config with {len(mapbox_config.get('visualizations', []))} visualizations")
                 
                 return {
@@ -202,6 +216,7 @@ Generate the complete JSON configuration now:
                     "mapbox_config": mapbox_config,
                     "visualization_count": len(mapbox_config.get('visualizations', [])),
                     "tools_used": mapbox_config.get('selected_tools', []),
+                    "truncated": truncated,
                     "raw_output": raw_output
                 }
             else:
@@ -212,13 +227,6 @@ Generate the complete JSON configuration now:
                     "raw_output": raw_output
                 }
                 
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse JSON: {e}")
-            return {
-                "success": False,
-                "error": f"Invalid JSON: {str(e)}",
-                "raw_output": raw_output
-            }
         except Exception as e:
             logger.error(f"Post-processing failed: {e}")
             return {
@@ -229,9 +237,7 @@ Generate the complete JSON configuration now:
     
     async def execute(self) -> Dict[str, Any]:
         """Execute the agent and return Mapbox configuration"""
-        full_output = ""
-        async for token in self.stream_execute():
-            full_output += token
+        await self.collect_output()
         return self.result  # Result is set by stream_execute with post_process
 
 
@@ -0,0 +1,159 @@
+"""
+Output Parser
+Single-pass scan of an agent's output for fenced blocks, marker blocks and JSON objects
+Results are cached per output text, so every post-processor reuses the same scan
+"""
+
+import json
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from fenced_json import FencedBlock, FencedJsonExtractor
+from json_repair import repair_json
+
+# Everything the scanner reacts to; the text between tokens is skipped at C speed
+_TOKENS = re.compile(r'```|\b[A-Z][A-Z0-9_]*_(?:START|END)\b|[{}"\\]')
+
+# Outputs kept parsed; agents post-process their own output right after it completes
+PARSE_CACHE_SIZE = 32
+
+
+class Span:
+    """A located piece of the output; data is its JSON, parsed on first use (None if invalid)"""
+
+    _UNPARSED = object()
+
+    def __init__(self, text: str, start: int, end: int, name: str = ""):
+        self.name = name
+        self.start = start
+        self.end = end
+        self._source = text
+        self._data: Any = Span._UNPARSED
+
+    @property
+    def text(self) -> str:
+        return self._source[self.start:self.end]
+
+    @property
+    def data(self) -> Any:
+        if self._data is Span._UNPARSED:
+            try:
+                self._data = json.loads(self.text)
+            except json.JSONDecodeError:
+                self._data = None
+        return self._data
+
+
+class ParsedOutput:
+    """
+    Where the markers, top-level JSON objects and ```json blocks are in one output
+
+    - markers: NAME_START ... NAME_END blocks, name is NAME
+    - objects: balanced {...} spans outside JSON strings, outermost only
+    - json_blocks(): found exactly as the streaming FencedJsonExtractor finds them
+
+    Strings are only tracked inside an object, and a fence or marker ends any
+    open object, so a stray brace or quote in prose or in another language's
+    code block can't hide what follows it. An object still open at the end of
+    the text is kept as open_object_start for repair.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.markers: List[Span] = []
+        self.objects: List[Span] = []
+        self.open_object_start: Optional[int] = None
+        self._json_blocks: Optional[List[FencedBlock]] = None
+        self._scan()
+
+    def _scan(self):
+        text = self.text
+        open_markers: Dict[str, int] = {}
+        depth = 0
+        object_start = 0
+        in_string = False
+        skip_until = 0  # End of an escape sequence inside a string
+
+        for match in _TOKENS.finditer(text):
+            position = match.start()
+            if position < skip_until:
+                continue
+            token = match.group()
+
+            if depth and token != "```" and not token.endswith(("_START", "_END")):
+                if in_string:
+                    if token == "\\":
+                        skip_until = position + 2
+                    elif token == '"':
+                        in_string = False
+                elif token == '"':
+                    in_string = True
+                elif token == "{":
+                    depth += 1
+                elif token == "}":
+                    depth -= 1
+                    if not depth:
+                        self.objects.append(Span(text, object_start, position + 1))
+                continue
+
+            # Outside an object - or at a fence or marker, which ends any object left open
+            depth = 0
+            in_string = False
+            if token == "{":
+                depth = 1
+                object_start = position
+            elif token.endswith("_START"):
+                open_markers[token[:-len("_START")]] = match.end()
+            elif token.endswith("_END"):
+                name = token[:-len("_END")]
+                if name in open_markers:
+                    self.markers.append(Span(text, open_markers.pop(name), position, name=name))
+
+        if depth:
+            self.open_object_start = object_start
+
+    def json_blocks(self) -> List[FencedBlock]:
+        """
+        ```json blocks whose content is a {...} object, in order
+        Uses the same extractor agents stream through, so a candidate is
+        checked against the blocks its post-processing will see.
+        """
+        if self._json_blocks is None:
+            extractor = FencedJsonExtractor()
+            extractor.feed(self.text)
+            self._json_blocks = extractor.blocks
+        return self._json_blocks
+
+    def marker(self, name: str) -> Optional[Span]:
+        """The first NAME_START ... NAME_END block"""
+        for span in self.markers:
+            if span.name == name:
+                return span
+        return None
+
+    def json_object(self, key: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """
+        The first top-level JSON object that parses (and has key, if given)
+
+        If none does and the output ends inside an object, that object is
+        repaired instead.
+
+        Returns:
+            (object or None, whether it was truncated and repaired)
+        """
+        for span in self.objects:
+            data = span.data
+            if isinstance(data, dict) and (key is None or key in data):
+                return data, False
+        if self.open_object_start is not None:
+            data, truncated = repair_json(self.text[self.open_object_start:])
+            if isinstance(data, dict) and (key is None or key in data):
+                return data, truncated
+        return None, False
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_output(text: str) -> ParsedOutput:
+    """Parse an output once; later calls with the same text reuse the result"""
+    return ParsedOutput(text)
@@ -0,0 +1,186 @@
+"""
+Response Cache
+Two-tier cache of LLM streams for repeated runs with identical prompts
+Memory LRU in front of a size-capped SQLite file, shared by every agent in the process
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), '..', '.data', 'response_cache.db')
+
+
+def response_cache_key(model: str, temperature: float, max_tokens: int, prompt: str) -> str:
+    """Key a response by everything that shapes it: model, sampling settings and the built prompt"""
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{model}|{temperature}|{max_tokens}|{prompt_hash}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cached LLM responses, stored as the list of streamed chunks
+
+    Keeping the chunks (rather than the joined text) lets a hit be replayed
+    through the normal streaming path. Disk entries are evicted least recently
+    used first once the file's payload exceeds max_disk_bytes.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        disk_path: Optional[str] = None,
+        max_disk_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None
+    ):
+        self.max_entries = max_entries or int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+        self.max_disk_bytes = max_disk_bytes or int(os.getenv("RESPONSE_CACHE_MAX_DISK_BYTES", str(200 * 1024 * 1024)))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+        # key -> (stored_at, chunks)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+        disk_path = disk_path if disk_path is not None else os.getenv("RESPONSE_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_bytes = 0
+        if disk_path:
+            try:
+                self._db = self._open_db(disk_path)
+                self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+            except sqlite3.Error as e:
+                logger.error(f"Could not open response cache at {disk_path}, using memory only: {e}")
+
+    def _open_db(self, path: str) -> sqlite3.Connection:
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                chunks TEXT,
+                size INTEGER,
+                created_at REAL,
+                last_used_at REAL
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_used ON response_cache (last_used_at)")
+        db.commit()
+        return db
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """Get cached chunks, promoting disk hits into memory"""
+        now = time.time()
+
+        if key in self._memory:
+            stored_at, chunks = self._memory[key]
+            if now - stored_at < self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return chunks
+            del self._memory[key]
+
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT chunks, created_at FROM response_cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE response_cache SET last_used_at = ? WHERE key = ?", (now, key))
+                self._db.commit()
+                chunks = json.loads(row[0])
+                self._remember(key, chunks, row[1])
+                self.disk_hits += 1
+                return chunks
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, chunks: List[str]):
+        """Cache a complete response in both tiers"""
+        now = time.time()
+        self._remember(key, chunks, now)
+        self.stores += 1
+
+        if self._db is None:
+            return
+        payload = json.dumps(chunks, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        if size > self.max_disk_bytes:
+            return
+
+        try:
+            existing = self._db.execute("SELECT size FROM response_cache WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO response_cache (key, chunks, size, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, size, now, now)
+            )
+            self._disk_bytes += size - (existing[0] if existing else 0)
+            self._evict_disk(now)
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to write response cache entry: {e}")
+
+    def _remember(self, key: str, chunks: List[str], stored_at: float):
+        self._memory[key] = (stored_at, chunks)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now: float):
+        """Drop expired entries, then least recently used ones until under the size cap"""
+        expired = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM response_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+        ).fetchone()[0]
+        if expired:
+            self._db.execute("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._disk_bytes -= expired
+
+        while self._disk_bytes > self.max_disk_bytes:
+            rows = self._db.execute(
+                "SELECT key, size FROM response_cache ORDER BY last_used_at LIMIT 32"
+            ).fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+            for key, size in rows:
+                self._db.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self._disk_bytes -= size
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and tier sizes"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else None,
+            "memory_entries": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+            "max_entries": self.max_entries,
+            "max_disk_bytes": self.max_disk_bytes
+        }
+
+
+# Global cache shared by all agents in the process
+_response_cache = None
+
+def get_response_cache() -> ResponseCache:
+    """Get or create the global response cache"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
@@ -0,0 +1,197 @@
+"""
+Similarity Cache
+Near-duplicate prompt cache using MinHash signatures and an LSH index
+Catches prompts that differ only in whitespace, timestamps or IDs - no embedding service needed
+"""
+
+import hashlib
+import logging
+import os
+import random
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Mersenne prime for the universal hash family used as MinHash permutations
+_PRIME = (1 << 61) - 1
+
+# Volatile tokens replaced before hashing so they don't count as differences
+_NORMALIZERS = [
+    (re.compile(r"\d{4}-\d{2}-\d{2}[t ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(z|[+-]\d{2}:?\d{2})?"), " <ts> "),
+    (re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b"), " <uuid> "),
+    (re.compile(r"\b\d{9,}(\.\d+)?\b"), " <num> "),  # epoch timestamps and generated numeric IDs
+    (re.compile(r"\s+"), " "),
+]
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercase, mask timestamps/UUIDs/long numbers and collapse whitespace"""
+    text = prompt.lower()
+    for pattern, replacement in _NORMALIZERS:
+        text = pattern.sub(replacement, text)
+    return text.strip()
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class MinHasher:
+    """MinHash signatures over word shingles"""
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+    def shingles(self, text: str) -> Set[int]:
+        words = text.split(" ")
+        if len(words) <= self.shingle_size:
+            return {_hash64(text)}
+        return {
+            _hash64(" ".join(words[i:i + self.shingle_size]))
+            for i in range(len(words) - self.shingle_size + 1)
+        }
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        hashes = self.shingles(text)
+        return tuple(
+            min((a * x + b) % _PRIME for x in hashes)
+            for a, b in self._perms
+        )
+
+    @staticmethod
+    def similarity(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+        """Estimated Jaccard similarity of the underlying shingle sets"""
+        return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+
+class SimilarityCache:
+    """
+    In-memory LSH index of recent responses
+
+    Signatures are split into bands; prompts sharing any band bucket (within
+    the same model and sampling settings) are candidates, and a candidate is
+    a hit only if its estimated similarity reaches the threshold. With the
+    default 16 bands of 8 rows, pairs above ~0.7 similarity almost always
+    collide, so thresholds of 0.8 and up are served reliably.
+    """
+
+    def __init__(
+        self,
+        threshold: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        bands: int = 16,
+        rows: int = 8
+    ):
+        self.threshold = threshold or float(os.getenv("SIMILARITY_CACHE_THRESHOLD", "0.9"))
+        self.max_entries = max_entries or int(os.getenv("SIMILARITY_CACHE_MAX_ENTRIES", "512"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("SIMILARITY_CACHE_TTL_SECONDS", str(24 * 3600)))
+        self.bands = bands
+        self.rows = rows
+        self.hasher = MinHasher(num_perm=bands * rows)
+
+        # entry_id -> (stored_at, scope, signature, chunks)
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, int], Set[int]] = {}
+        self._next_id = 0
+
+        self.hits = 0
+        self.misses = 0
+        self._hit_similarity_total = 0.0
+
+    def signature(self, prompt: str) -> Tuple[int, ...]:
+        """Signature of a prompt; CPU-bound, so callers may run it in a thread"""
+        return self.hasher.signature(normalize_prompt(prompt))
+
+    def _band_keys(self, scope: str, signature: Tuple[int, ...]) -> List[Tuple[int, int]]:
+        return [
+            (band, hash((scope, signature[band * self.rows:(band + 1) * self.rows])))
+            for band in range(self.bands)
+        ]
+
+    def lookup(
+        self,
+        scope: str,
+        signature: Tuple[int, ...],
+        threshold: Optional[float] = None
+    ) -> Optional[Tuple[List[str], float]]:
+        """
+        Find the most similar cached response in the same scope
+
+        Returns:
+            (chunks, similarity) for the best match at or above the threshold
+        """
+        threshold = threshold or self.threshold
+        now = time.time()
+        candidates: Set[int] = set()
+        for key in self._band_keys(scope, signature):
+            candidates |= self._buckets.get(key, set())
+
+        best: Optional[Tuple[int, float]] = None
+        for entry_id in candidates:
+            stored_at, entry_scope, entry_signature, _ = self._entries[entry_id]
+            if entry_scope != scope or now - stored_at >= self.ttl_seconds:
+                continue
+            similarity = MinHasher.similarity(signature, entry_signature)
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (entry_id, similarity)
+
+        if best is None:
+            self.misses += 1
+            return None
+
+        entry_id, similarity = best
+        self._entries.move_to_end(entry_id)
+        self.hits += 1
+        self._hit_similarity_total += similarity
+        return self._entries[entry_id][3], similarity
+
+    def put(self, scope: str, signature: Tuple[int, ...], chunks: List[str]):
+        """Index a complete response"""
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (time.time(), scope, signature, chunks)
+        for key in self._band_keys(scope, signature):
+            self._buckets.setdefault(key, set()).add(entry_id)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int):
+        _, scope, signature, _ = self._entries.pop(entry_id)
+        for key in self._band_keys(scope, signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and index size"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "avg_hit_similarity": round(self._hit_similarity_total / self.hits, 4) if self.hits else None,
+            "entries": len(self._entries),
+            "threshold": self.threshold,
+            "max_entries": self.max_entries
+        }
+
+
+# Global cache shared by all agents in the process
+_similarity_cache = None
+
+def get_similarity_cache() -> SimilarityCache:
+    """Get or create the global similarity cache"""
+    global _similarity_cache
+    if _similarity_cache is None:
+        _similarity_cache = SimilarityCache()
+    return _similarity_cache
@@ -4,7 +4,7 @@ Each agent type has its own execution logic and prompt building
 """
 
 from typing import Dict, Any
-from base_agent import BaseAgent
+from base_agent import BaseAgent, PromptParts
 from agent_types import AgentType, AgentTask, AgentConfig
 import logging
 
@@ -17,29 +17,21 @@ class ReportAgent(BaseAgent):
     def __init__(self, agent_id: str, task: AgentTask, config: AgentConfig = None):
         super().__init__(agent_id, AgentType.REPORT, task, config)
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         target_audience = self.config.target_audience or "policymakers and stakeholders"
         report_type = self.custom_input.get("report_type", "comprehensive analysis")
         
-        return f"""You are a professional Report Agent specializing in {report_type}.
+        return PromptParts(
+            prefix=f"""You are a professional Report Agent specializing in analytical reports.
 
 {self.get_capability_description()}
 
-# YOUR TASK
-{self.task.description}
-
-# TARGET AUDIENCE
-{target_audience}
-
-# CONTEXT AND DATA
-{self.build_context_section()}
-
 # REPORT REQUIREMENTS
 - Create a comprehensive, well-structured report
 - Use clear section headings (##)
 - Include data-driven insights and evidence
 - Provide actionable recommendations
-- Use professional tone appropriate for {target_audience}
+- Use professional tone appropriate for the target audience
 - Include executive summary at the beginning
 - Add visual data representations where appropriate (describe charts/graphs)
 
@@ -51,15 +43,24 @@ Generate the report in markdown format with the following structure:
 4. Detailed Analysis
 5. Implications and Impact
 6. Recommendations
-7. Conclusion
+7. Conclusion""",
+            context=f"""# CONTEXT AND DATA
+{self.build_context_section()}""",
+            suffix=f"""# YOUR TASK
+{self.task.description}
+
+# TARGET AUDIENCE
+{target_audience}
+
+# REPORT TYPE
+{report_type}
 
 Begin your report:
 """
+        )
     
     async def execute(self) -> Dict[str, Any]:
-        full_report = ""
-        async for token in self.stream_execute():
-            full_report += token
+        full_report = await self.collect_output()
         return {"report": full_report}
 
 
@@ -69,30 +70,16 @@ class MediaCallingAgent(BaseAgent):
     def __init__(self, agent_id: str, task: AgentTask, config: AgentConfig = None):
         super().__init__(agent_id, AgentType.MEDIA_CALLING, task, config)
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         urgency = self.custom_input.get("urgency", "normal")
         media_list = self.custom_input.get("media_list", [])
         phone_number = self.custom_input.get("phone_number", "+18582108648")
         
-        return f"""You are a Media Calling Agent responsible for coordinating with media outlets.
+        return PromptParts(
+            prefix=f"""You are a Media Calling Agent responsible for coordinating with media outlets.
 
 {self.get_capability_description()}
 
-# YOUR TASK
-{self.task.description}
-
-# TARGET PHONE NUMBER FOR CALL
-{phone_number}
-
-# URGENCY LEVEL
-{urgency}
-
-# TARGET MEDIA OUTLETS
-{', '.join(media_list) if media_list else "Major news outlets and relevant journalists"}
-
-# CONTEXT
-{self.build_context_section()}
-
 # DELIVERABLES REQUIRED
 Create the following materials for media outreach:
 
@@ -122,10 +109,24 @@ Create the following materials for media outreach:
 
 5. **Contact Log Template**: Format for tracking outreach
 
-6. **PHONE CALL SUMMARY**: A concise 2-3 sentence message to deliver via phone call
+6. **PHONE CALL SUMMARY**: A concise 2-3 sentence message to deliver via phone call""",
+            context=f"""# CONTEXT
+{self.build_context_section()}""",
+            suffix=f"""# YOUR TASK
+{self.task.description}
+
+# TARGET PHONE NUMBER FOR CALL
+{phone_number}
+
+# URGENCY LEVEL
+{urgency}
+
+# TARGET MEDIA OUTLETS
+{', '.join(media_list) if media_list else "Major news outlets and relevant journalists"}
 
 Generate all materials in a clear, organized format:
 """
+        )
     
     async def post_process(self, raw_output: str) -> Dict[str, Any]:
         """
@@ -185,9 +186,7 @@ Generate all materials in a clear, organized format:
         }
     
     async def execute(self) -> Dict[str, Any]:
-        full_output = ""
-        async for token in self.stream_execute():
-            full_output += token
+        full_output = await self.collect_output()
         return self.result  # Result is already set by stream_execute with post_process
 
 
@@ -197,26 +196,15 @@ class PlanningAgent(BaseAgent):
     def __init__(self, agent_id: str, task: AgentTask, config: AgentConfig = None):
         super().__init__(agent_id, AgentType.PLANNING, task, config)
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         timeline = self.custom_input.get("timeline", "6 months")
         budget = self.custom_input.get("budget", "not specified")
         
-        return f"""You are a Strategic Planning Agent specializing in government and publishing initiatives.
+        return PromptParts(
+            prefix=f"""You are a Strategic Planning Agent specializing in government and publishing initiatives.
 
 {self.get_capability_description()}
 
-# PLANNING OBJECTIVE
-{self.task.description}
-
-# TIMELINE
-{timeline}
-
-# BUDGET CONSTRAINTS
-{budget}
-
-# AVAILABLE CONTEXT
-{self.build_context_section()}
-
 # PLAN REQUIREMENTS
 Create a comprehensive strategic plan including:
 
@@ -265,15 +253,24 @@ Create a comprehensive strategic plan including:
 9. **Evaluation Framework**
    - Progress tracking methods
    - Review schedule
-   - Adjustment triggers
+   - Adjustment triggers""",
+            context=f"""# AVAILABLE CONTEXT
+{self.build_context_section()}""",
+            suffix=f"""# PLANNING OBJECTIVE
+{self.task.description}
+
+# TIMELINE
+{timeline}
+
+# BUDGET CONSTRAINTS
+{budget}
 
 Generate the complete strategic plan:
 """
+        )
     
     async def execute(self) -> Dict[str, Any]:
-        full_plan = ""
-        async for token in self.stream_execute():
-            full_plan += token
+        full_plan = await self.collect_output()
         return {"strategic_plan": full_plan}
 
 
@@ -283,22 +280,14 @@ class ConsultingAgent(BaseAgent):
     def __init__(self, agent_id: str, task: AgentTask, config: AgentConfig = None):
         super().__init__(agent_id, AgentType.CONSULTING, task, config)
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         tone = self.config.tone or "professional and balanced"
         
-        return f"""You are an Expert Consulting Agent providing high-level strategic advice.
+        return PromptParts(
+            prefix=f"""You are an Expert Consulting Agent providing high-level strategic advice.
 
 {self.get_capability_description()}
 
-# CONSULTATION REQUEST
-{self.task.description}
-
-# COMMUNICATION STYLE
-{tone}
-
-# RELEVANT CONTEXT
-{self.build_context_section()}
-
 # CONSULTING APPROACH
 Provide comprehensive consulting advice with:
 
@@ -340,15 +329,21 @@ Provide comprehensive consulting advice with:
 7. **Discussion Points**
    - Questions to consider
    - Areas needing more information
-   - Stakeholders to consult
+   - Stakeholders to consult""",
+            context=f"""# RELEVANT CONTEXT
+{self.build_context_section()}""",
+            suffix=f"""# CONSULTATION REQUEST
+{self.task.description}
+
+# COMMUNICATION STYLE
+{tone}
 
 Provide your expert consulting advice:
 """
+        )
     
     async def execute(self) -> Dict[str, Any]:
-        full_advice = ""
-        async for token in self.stream_execute():
-            full_advice += token
+        full_advice = await self.collect_output()
         return {"consulting_advice": full_advice}
 
 
@@ -358,30 +353,16 @@ class PitchDeckAgent(BaseAgent):
     def __init__(self, agent_id: str, task: AgentTask, config: AgentConfig = None):
         super().__init__(agent_id, AgentType.PITCH_DECK, task, config)
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         audience = self.config.target_audience or "decision makers and stakeholders"
         duration = self.custom_input.get("duration", "10-15 minutes")
         style = self.custom_input.get("style", "professional and data-driven")
         
-        return f"""You are a Pitch Deck Creator specializing in compelling presentations.
+        return PromptParts(
+            prefix=f"""You are a Pitch Deck Creator specializing in compelling presentations.
 
 {self.get_capability_description()}
 
-# PRESENTATION OBJECTIVE
-{self.task.description}
-
-# TARGET AUDIENCE
-{audience}
-
-# PRESENTATION DURATION
-{duration}
-
-# STYLE
-{style}
-
-# AVAILABLE CONTENT
-{self.build_context_section()}
-
 # PITCH DECK REQUIREMENTS
 Create a complete slide deck outline with detailed content for each slide.
 
@@ -445,15 +426,27 @@ For each slide, provide:
 
 **Slide 14: Closing**
 - Memorable summary
-- Contact information
+- Contact information""",
+            context=f"""# AVAILABLE CONTENT
+{self.build_context_section()}""",
+            suffix=f"""# PRESENTATION OBJECTIVE
+{self.task.description}
+
+# TARGET AUDIENCE
+{audience}
+
+# PRESENTATION DURATION
+{duration}
+
+# STYLE
+{style}
 
 Create the complete pitch deck content:
 """
+        )
     
     async def execute(self) -> Dict[str, Any]:
-        full_deck = ""
-        async for token in self.stream_execute():
-            full_deck += token
+        full_deck = await self.collect_output()
         return {"pitch_deck": full_deck}
 
 
@@ -463,26 +456,15 @@ class NewsAgent(BaseAgent):
     def __init__(self, agent_id: str, task: AgentTask, config: AgentConfig = None):
         super().__init__(agent_id, AgentType.NEWS_AGENT, task, config)
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         angle = self.custom_input.get("angle", "balanced and informative")
         target_publication = self.custom_input.get("target_publication", "general news outlet")
         
-        return f"""You are a News Agent specializing in policy and government reporting.
+        return PromptParts(
+            prefix=f"""You are a News Agent specializing in policy and government reporting.
 
 {self.get_capability_description()}
 
-# ASSIGNMENT
-{self.task.description}
-
-# STORY ANGLE
-{angle}
-
-# TARGET PUBLICATION
-{target_publication}
-
-# AVAILABLE INFORMATION
-{self.build_context_section()}
-
 # DELIVERABLES
 
 Generate the following news content:
@@ -516,15 +498,24 @@ Generate the following news content:
 4. **Key Facts Box**
    - 5-7 bullet points with critical information
    - Statistics and data points
-   - Important dates
+   - Important dates""",
+            context=f"""# AVAILABLE INFORMATION
+{self.build_context_section()}""",
+            suffix=f"""# ASSIGNMENT
+{self.task.description}
+
+# STORY ANGLE
+{angle}
+
+# TARGET PUBLICATION
+{target_publication}
 
 Generate all news content:
 """
+        )
     
     async def execute(self) -> Dict[str, Any]:
-        full_content = ""
-        async for token in self.stream_execute():
-            full_content += token
+        full_content = await self.collect_output()
         return {"news_content": full_content}
 
 
@@ -534,22 +525,14 @@ class DataAnalystAgent(BaseAgent):
     def __init__(self, agent_id: str, task: AgentTask, config: AgentConfig = None):
         super().__init__(agent_id, AgentType.DATA_ANALYST, task, config)
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         analysis_questions = self.custom_input.get("analysis_questions", [])
         
-        return f"""You are a Data Analyst Agent specializing in urban policy and simulation data.
+        return PromptParts(
+            prefix=f"""You are a Data Analyst Agent specializing in urban policy and simulation data.
 
 {self.get_capability_description()}
 
-# ANALYSIS OBJECTIVE
-{self.task.description}
-
-# KEY QUESTIONS TO ANSWER
-{chr(10).join(f"- {q}" for q in analysis_questions) if analysis_questions else "Comprehensive data analysis"}
-
-# AVAILABLE DATA
-{self.build_context_section()}
-
 # ANALYSIS REQUIREMENTS
 
 Provide a thorough data analysis including:
@@ -597,15 +580,21 @@ Provide a thorough data analysis including:
 9. **Data Tables**
    - Present key data in structured tables
    - Summary statistics
-   - Comparison tables
+   - Comparison tables""",
+            context=f"""# AVAILABLE DATA
+{self.build_context_section()}""",
+            suffix=f"""# ANALYSIS OBJECTIVE
+{self.task.description}
+
+# KEY QUESTIONS TO ANSWER
+{chr(10).join(f"- {q}" for q in analysis_questions) if analysis_questions else "Comprehensive data analysis"}
 
 Provide your complete data analysis:
 """
+        )
     
     async def execute(self) -> Dict[str, Any]:
-        full_analysis = ""
-        async for token in self.stream_execute():
-            full_analysis += token
+        full_analysis = await self.collect_output()
         return {"data_analysis": full_analysis}
 
 
@@ -615,26 +604,15 @@ class SocialMediaAgent(BaseAgent):
     def __init__(self, agent_id: str, task: AgentTask, config: AgentConfig = None):
         super().__init__(agent_id, AgentType.SOCIAL_MEDIA, task, config)
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         platforms = self.custom_input.get("platforms", ["Twitter", "LinkedIn", "Facebook", "Instagram"])
         schedule = self.custom_input.get("schedule", "2 weeks")
         
-        return f"""You are a Social Media Agent specializing in government and policy communications.
+        return PromptParts(
+            prefix=f"""You are a Social Media Agent specializing in government and policy communications.
 
 {self.get_capability_description()}
 
-# CAMPAIGN GOAL
-{self.task.description}
-
-# TARGET PLATFORMS
-{', '.join(platforms)}
-
-# CAMPAIGN DURATION
-{schedule}
-
-# BACKGROUND INFORMATION
-{self.build_context_section()}
-
 # DELIVERABLES
 
 Create a comprehensive social media campaign:
@@ -645,7 +623,7 @@ Create a comprehensive social media campaign:
    - Target audience per platform
    - Success metrics
 
-2. **Content Calendar** ({schedule})
+2. **Content Calendar** (covering the campaign duration)
    - Daily posting schedule
    - Platform-specific content
    - Optimal posting times
@@ -694,15 +672,24 @@ Create a comprehensive social media campaign:
    - Bio updates for each platform
    - Pinned post content
    - Story highlights
-   - Link in bio strategy
+   - Link in bio strategy""",
+            context=f"""# BACKGROUND INFORMATION
+{self.build_context_section()}""",
+            suffix=f"""# CAMPAIGN GOAL
+{self.task.description}
+
+# TARGET PLATFORMS
+{', '.join(platforms)}
+
+# CAMPAIGN DURATION
+{schedule}
 
 Generate the complete social media campaign:
 """
+        )
     
     async def execute(self) -> Dict[str, Any]:
-        full_campaign = ""
-        async for token in self.stream_execute():
-            full_campaign += token
+        full_campaign = await self.collect_output()
         return {"social_media_campaign": full_campaign}
 
 
@@ -712,20 +699,14 @@ class StakeholderAgent(BaseAgent):
     def __init__(self, agent_id: str, task: AgentTask, config: AgentConfig = None):
         super().__init__(agent_id, AgentType.STAKEHOLDER, task, config)
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         stakeholder_type = self.custom_input.get("stakeholder_type", "community member")
         
-        return f"""You are a Stakeholder Agent simulating the perspective of: {stakeholder_type}
+        return PromptParts(
+            prefix=f"""You are a Stakeholder Agent simulating the perspective of the stakeholder group described below.
 
 {self.get_capability_description()}
 
-# YOUR ROLE
-Authentically represent the views, concerns, and interests of {stakeholder_type} regarding:
-{self.task.description}
-
-# RELEVANT INFORMATION
-{self.build_context_section()}
-
 # STAKEHOLDER PERSPECTIVE REQUIREMENTS
 
 Provide a comprehensive stakeholder perspective including:
@@ -768,15 +749,19 @@ Provide a comprehensive stakeholder perspective including:
 8. **Support Level**
    - Current stance (strongly oppose, oppose, neutral, support, strongly support)
    - What could change your position
-   - Conditions for engagement
+   - Conditions for engagement""",
+            context=f"""# RELEVANT INFORMATION
+{self.build_context_section()}""",
+            suffix=f"""# YOUR ROLE
+Authentically represent the views, concerns, and interests of {stakeholder_type} regarding:
+{self.task.description}
 
 Provide your stakeholder perspective:
 """
+        )
     
     async def execute(self) -> Dict[str, Any]:
-        full_perspective = ""
-        async for token in self.stream_execute():
-            full_perspective += token
+        full_perspective = await self.collect_output()
         return {"stakeholder_perspective": full_perspective}
 
 
@@ -786,22 +771,14 @@ class PolicyWriterAgent(BaseAgent):
     def __init__(self, agent_id: str, task: AgentTask, config: AgentConfig = None):
         super().__init__(agent_id, AgentType.POLICY_WRITER, task, config)
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         legal_framework = self.custom_input.get("legal_framework", "standard municipal code")
         
-        return f"""You are a Policy Writer Agent specializing in formal policy and legislative drafting.
+        return PromptParts(
+            prefix=f"""You are a Policy Writer Agent specializing in formal policy and legislative drafting.
 
 {self.get_capability_description()}
 
-# DRAFTING ASSIGNMENT
-{self.task.description}
-
-# LEGAL FRAMEWORK
-{legal_framework}
-
-# BACKGROUND AND CONTEXT
-{self.build_context_section()}
-
 # POLICY DOCUMENT REQUIREMENTS
 
 Create a comprehensive policy document including:
@@ -857,15 +834,21 @@ Create a comprehensive policy document including:
 10. **Fiscal Note**
    - Estimated costs
    - Funding sources
-   - Budget impact analysis
+   - Budget impact analysis""",
+            context=f"""# BACKGROUND AND CONTEXT
+{self.build_context_section()}""",
+            suffix=f"""# DRAFTING ASSIGNMENT
+{self.task.description}
+
+# LEGAL FRAMEWORK
+{legal_framework}
 
 Draft the complete policy document in formal legislative language:
 """
+        )
     
     async def execute(self) -> Dict[str, Any]:
-        full_policy = ""
-        async for token in self.stream_execute():
-            full_policy += token
+        full_policy = await self.collect_output()
         return {"policy_document": full_policy}
 
 
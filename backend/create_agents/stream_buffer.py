@@ -0,0 +1,107 @@
+"""
+Stream Buffer
+Append-only buffer of LLM output chunks for one run, shared by every reader
+The LLM loop appends; the orchestrator, post-processing and fan-out read through cursors
+"""
+
+import asyncio
+from typing import AsyncIterator, List, Optional
+
+
+class StreamBuffer:
+    """
+    Chunks of a single run's output, in order
+
+    Appending is O(1) and readers never copy what they have already seen.
+    The full text is joined once, on first request after the buffer is
+    closed, and the same string is returned from then on.
+    """
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._size = 0
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._text: Optional[str] = None
+        self._updated = asyncio.Event()
+
+    def append(self, chunk: str):
+        if self._closed:
+            raise RuntimeError("Cannot append to a closed stream buffer")
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        self._notify()
+
+    def close(self, error: Optional[BaseException] = None):
+        """Mark the stream finished; readers stop after the last chunk"""
+        if self._closed:
+            return
+        self._closed = True
+        self._error = error
+        self._notify()
+
+    def _notify(self):
+        # Wake current waiters; later ones wait on a fresh event
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        return self._error
+
+    @property
+    def size(self) -> int:
+        """Total characters appended"""
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def chunks(self, start: int = 0, end: Optional[int] = None) -> List[str]:
+        return self._chunks[start:end]
+
+    def text(self) -> str:
+        """All output so far; cached once the buffer is closed"""
+        if self._text is not None:
+            return self._text
+        text = "".join(self._chunks)
+        if self._closed:
+            self._text = text
+        return text
+
+    def cursor(self, position: int = 0) -> "StreamCursor":
+        """A reader starting at chunk index position (0 replays everything)"""
+        return StreamCursor(self, position)
+
+    async def wait_for(self, position: int):
+        """Wait until there is a chunk at position or the buffer is closed"""
+        while len(self._chunks) <= position and not self._closed:
+            await self._updated.wait()
+
+
+class StreamCursor:
+    """A reader's position in a StreamBuffer"""
+
+    def __init__(self, buffer: StreamBuffer, position: int = 0):
+        self.buffer = buffer
+        self.position = position
+
+    def read(self) -> List[str]:
+        """Chunks appended since the last read, without waiting"""
+        chunks = self.buffer.chunks(self.position)
+        self.position += len(chunks)
+        return chunks
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        """Yield chunks as they are appended until the buffer is closed"""
+        while True:
+            await self.buffer.wait_for(self.position)
+            chunks = self.read()
+            if not chunks and self.buffer.closed:
+                return
+            for chunk in chunks:
+                yield chunk
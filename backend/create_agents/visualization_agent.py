@@ -3,10 +3,15 @@ Mapbox Visualization Agent
 Takes the full report/analysis and generates interactive map overlays
 """
 
-from typing import Dict, Any
-from base_agent import BaseAgent
+from typing import Dict, Any, List, Tuple
+from base_agent import BaseAgent, PromptParts
 from agent_types import AgentType, AgentTask, AgentConfig
+from output_parser import parse_output
+from map_schemas import MAP_SECTIONS, validate_map_data
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class MapboxVisualizationAgent(BaseAgent):
@@ -18,7 +23,7 @@ class MapboxVisualizationAgent(BaseAgent):
     def __init__(self, agent_id: str, task: AgentTask, config: AgentConfig = None):
         super().__init__(agent_id, AgentType.MAPBOX_AGENT, task, config)
     
-    def build_prompt(self) -> str:
+    def build_prompt_parts(self) -> PromptParts:
         import random
         import datetime
         
@@ -29,30 +34,15 @@ class MapboxVisualizationAgent(BaseAgent):
         run_seed = random.randint(1000, 9999)
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        return f"""You are a Mapbox Visualization Agent. Your ONLY job is to create interactive map overlays.
-
-# UNIQUE RUN ID: {run_seed} (Generated at {timestamp})
-⚠️ CRITICAL: This run must be COMPLETELY UNIQUE from previous runs. Vary:
-- Which specific streets are blocked
-- Number and location of impact zones  
-- Heatmap point positions and intensities
-- Alternate route suggestions
+        return PromptParts(
+            prefix=f"""You are a Mapbox Visualization Agent. Your ONLY job is to create interactive map overlays.
 
 # YOUR MISSION
 Read the complete policy analysis and report, then generate SPECIFIC, DETAILED map visualization data.
 
-# POLICY BEING ANALYZED
-{policy_goal or self.task.description}
-
-# CITY
-{city}
-
-# ANALYSIS FROM OTHER AGENTS
-{self.build_context_section()}
-
 # YOUR TASK - CREATE VISUAL MAP DATA
 
-Based on ALL the analysis above, you must create detailed map visualization data showing:
+Based on ALL the analysis and the policy given below, you must create detailed map visualization data showing:
 
 1. **BLOCKED ROADS** - Which specific streets are blocked/restricted by this policy
 2. **IMPACT ZONES** - Circles showing affected areas with severity levels
@@ -139,9 +129,9 @@ Detour paths created by the policy:
 }}
 ```
 
-## REAL COORDINATES FOR {city.upper()}:
+## REAL COORDINATES
 
-Use ACTUAL street coordinates:
+Use ACTUAL street coordinates for the city given below. San Francisco examples:
 - Market St @ 5th: [-122.4082, 37.7835]
 - Market St @ 6th: [-122.4092, 37.7840]
 - Market St @ 7th: [-122.4102, 37.7845]
@@ -162,8 +152,6 @@ Then end with exactly: MAPBOX_JSON_END
 Format:
 MAPBOX_JSON_START
 {{
-  "city": "{city}",
-  "policy": "{policy_goal}",
   "run_id": "UNIQUE_ID_HERE",
   "blocked_roads": [
     {{
@@ -198,76 +186,148 @@ MAPBOX_JSON_START
 MAPBOX_JSON_END
 
 REQUIREMENTS:
-1. Use RUN_ID {run_seed} to ensure uniqueness
+1. Use the RUN ID given below to ensure uniqueness
 2. Generate 4-8 blocked roads (vary the number each time!)
 3. Generate 3-6 impact zones in different locations
 4. Generate 15-25 heatmap points scattered across the city
 5. Generate 2-4 alternate routes
-6. Base ALL data on the policy analysis above
-7. Use REAL coordinates for {city}
+6. Base ALL data on the policy analysis below
+7. Use REAL coordinates for the city
 8. Make it DIFFERENT from any previous run
 
 REMEMBER:
-- Use REAL street names from {city}
+- Use REAL street names from the city
 - Use REAL coordinates 
 - Base everything on the analysis and report
 - Make it logical - if policy blocks Market St, show Mission St as alternate
 - Create 15-25 heatmap points spread across affected areas
-- Be specific and detailed
+- Be specific and detailed""",
+            context=f"""# ANALYSIS FROM OTHER AGENTS
+{self.build_context_section()}""",
+            suffix=f"""# UNIQUE RUN ID: {run_seed} (Generated at {timestamp})
+⚠️ CRITICAL: This run must be COMPLETELY UNIQUE from previous runs. Vary:
+- Which specific streets are blocked
+- Number and location of impact zones  
+- Heatmap point positions and intensities
+- Alternate route suggestions
+
+# POLICY BEING ANALYZED
+{policy_goal or self.task.description}
+
+# CITY
+{city}
 
 Output ONLY the JSON block. No other text.
 """
+        )
 
     async def execute(self) -> Dict[str, Any]:
         """Execute and return visualization data"""
-        full_output = ""
-        async for token in self.stream_execute():
-            full_output += token
+        full_output = await self.collect_output()
+        
+        # Extract JSON and keep only the features that match the map schemas
+        visualization_data, truncated = self._parse_json(full_output)
+        visualization_data, validation = validate_map_data(visualization_data)
+        # Not in the static prompt prefix, so set from the run's input rather than the model
+        visualization_data["city"] = self.custom_input.get("city", "San Francisco, CA")
+        visualization_data["policy"] = self.custom_input.get("policy_goal", "")
         
-        # Extract JSON
-        visualization_data = self._extract_json(full_output)
+        # Regenerate only the sections that came back empty, not the whole map
+        if validation["missing"] and self.config.extra.get("map_reask", True):
+            visualization_data, validation = await self._reask_missing(visualization_data, validation)
+        self.execution_stats["map_validation"] = validation
         
         return {
             "visualization_data": visualization_data,
             "raw_output": full_output,
+            "validation": validation,
+            "truncated": truncated,
             "agent_type": "mapbox_visualization"
         }
     
-    def _extract_json(self, text: str) -> Dict[str, Any]:
-        """Extract JSON from output with improved parsing"""
+    async def _reask_missing(self, data: Dict[str, Any], validation: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Ask the LLM for just the missing sections and merge the valid features in"""
+        missing: List[str] = validation["missing"]
+        logger.info(f"Agent {self.agent_id}: re-asking for missing map sections {missing}")
+        
         try:
-            import re
-            
-            print(f"[DEBUG] Attempting to parse visualization output (length: {len(text)})")
-            
-            # First try to find JSON between markers
-            marker_match = re.search(r'MAPBOX_JSON_START\s*(\{[\s\S]*?\})\s*MAPBOX_JSON_END', text, re.DOTALL)
-            if marker_match:
-                json_str = marker_match.group(1)
-                print(f"[DEBUG] Found JSON between markers (length: {len(json_str)})")
-                return json.loads(json_str)
-            
-            # Try to find JSON in code blocks
-            json_match = re.search(r'```json\s*(\{[\s\S]*?\})\s*```', text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-                print(f"[DEBUG] Found JSON in code block (length: {len(json_str)})")
-                return json.loads(json_str)
-            
-            # Try to find any JSON object
-            json_match = re.search(r'(\{[\s\S]*"blocked_roads"[\s\S]*?\})', text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-                print(f"[DEBUG] Found JSON object with blocked_roads (length: {len(json_str)})")
-                return json.loads(json_str)
-            
-            # Try to parse entire output as JSON
-            print("[DEBUG] Attempting to parse entire output as JSON")
-            return json.loads(text.strip())
-            
+            chunks = [text async for text in self._stream_with_retries(self._build_reask_prompt(data, missing))]
         except Exception as e:
-            print(f"[ERROR] Failed to parse visualization JSON: {e}")
-            print(f"[ERROR] Output preview: {text[:500]}...")
-            return {}
+            logger.warning(f"Agent {self.agent_id}: re-ask for missing map sections failed: {e}")
+            return data, {**validation, "reasked": missing}
+        
+        regenerated, reask_validation = validate_map_data(self._extract_json("".join(chunks)))
+        for key in missing:
+            data[key] = regenerated[key]
+            validation["sections"][key] = reask_validation["sections"][key]
+        
+        return data, {
+            **validation,
+            "reasked": missing,
+            "missing": [key for key in missing if not data[key]]
+        }
+    
+    def _build_reask_prompt(self, data: Dict[str, Any], missing: List[str]) -> str:
+        city = self.custom_input.get("city", "San Francisco, CA")
+        policy_goal = self.custom_input.get("policy_goal", "") or self.task.description
+        existing = {key: data[key] for key in MAP_SECTIONS if data.get(key)}
+        sections = "\n".join(f"- {key}: {MAP_SECTIONS[key][2]}" for key in missing)
+        
+        return f"""You are a Mapbox Visualization Agent. A map overlay for the policy below is missing some sections.
+
+Generate ONLY these sections, as one JSON object with exactly these keys:
+{sections}
+
+Use REAL street names and REAL coordinates for the city. Coordinates are [lng, lat].
+Keep them consistent with the features already on the map:
+{json.dumps(existing, separators=(",", ":"))[:3000]}
+
+# POLICY BEING ANALYZED
+{policy_goal}
+
+# CITY
+{city}
+
+Output ONLY the JSON object. No other text.
+"""
+    
+    def validate_output(self, raw_output: str) -> bool:
+        """A candidate is usable if its JSON is complete and has at least one valid map feature"""
+        data, truncated = self._parse_json(raw_output)
+        _, validation = validate_map_data(data)
+        return not truncated and len(validation["missing"]) < len(MAP_SECTIONS)
+    
+    def _extract_json(self, text: str) -> Dict[str, Any]:
+        """Extract JSON from output with improved parsing"""
+        return self._parse_json(text)[0]
+    
+    def _parse_json(self, text: str) -> Tuple[Dict[str, Any], bool]:
+        """Extract JSON from output; also returns whether it was cut off and repaired"""
+        logger.debug(f"Parsing visualization output (length: {len(text)})")
+        parsed = parse_output(text)
+        
+        # First try to find JSON between markers
+        marker = parsed.marker("MAPBOX_JSON")
+        if marker is not None and isinstance(marker.data, dict):
+            logger.debug(f"Found JSON between markers (length: {len(marker.text.strip())})")
+            return marker.data, False
+        
+        # Try to find JSON in code blocks
+        blocks = parsed.json_blocks()
+        if blocks and isinstance(blocks[0].data, dict):
+            logger.debug(f"Found JSON in code block (length: {len(blocks[0].text)})")
+            return blocks[0].data, False
+        
+        # Try to find any JSON object, preferring one with blocked_roads; an
+        # object cut off by max_tokens is kept up to its last complete element
+        data, truncated = parsed.json_object("blocked_roads")
+        if data is None:
+            data, truncated = parsed.json_object()
+        if data:
+            logger.debug(f"Found JSON object (truncated: {truncated})")
+            return data, truncated
+        
+        logger.warning(f"Agent {self.agent_id}: failed to parse visualization JSON; output preview: {text[:500]}...")
+        return {}, False
 
 
@@ -3,11 +3,11 @@ FastAPI Backend for Multi-Agent System
 Provides REST API and WebSocket streaming for all agent types
 """
 
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, File, UploadFile
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, File, UploadFile, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import asyncio
 import json
 import logging
@@ -23,9 +23,12 @@ try:
 except:
     pass
 
-# Verify GEMINI_API_KEY is set
+# Verify GEMINI_API_KEY is set (not needed when agents default to the offline "local" model)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
+LOCAL_MODELS_ONLY = os.getenv("AGENT_DEFAULT_MODEL", "").startswith("local")
+if not GEMINI_API_KEY and LOCAL_MODELS_ONLY:
+    print("[WARNING] GEMINI_API_KEY not set - only local models are available")
+elif not GEMINI_API_KEY:
     print("\n" + "="*60)
     print("ERROR: GEMINI_API_KEY not found!")
     print("="*60)
@@ -34,16 +37,21 @@ if not GEMINI_API_KEY:
     print("\nGet your API key from: https://makersuite.google.com/app/apikey")
     print("="*60 + "\n")
     raise ValueError("GEMINI_API_KEY must be set")
-
-print(f"[OK] GEMINI_API_KEY loaded (length: {len(GEMINI_API_KEY)})")
+else:
+    print(f"[OK] GEMINI_API_KEY loaded (length: {len(GEMINI_API_KEY)})")
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'create_agents'))
 sys.path.append(os.path.join(os.path.dirname(__file__), 'simulation_agents'))
 
+from stream_coalescer import StreamCoalescer, CoalescerStats, DEFAULT_FLUSH_MS, DEFAULT_FLUSH_BYTES
+
 # Try to import agent modules, but don't fail if they're not available yet
 try:
     from agent_types import AgentType, AgentConfig, AGENT_CAPABILITIES
-    from orchestrate import get_orchestrator
+    from orchestrate import get_orchestrator, get_registry, DEFAULT_SESSION
+    from scheduler import SchedulerFullError, resolve_priority
+    from job_queue import JobQueue, TERMINAL_STATUSES
+    from llm_providers import warm_up_providers
     AGENTS_AVAILABLE = True
     print("[OK] Agent modules loaded successfully")
 except Exception as e:
@@ -55,8 +63,19 @@ except Exception as e:
         pass
     class AgentConfig:
         pass
+    class SchedulerFullError(Exception):
+        pass
     AGENT_CAPABILITIES = {}
-    def get_orchestrator():
+    def get_orchestrator(session_id=None):
+        return None
+    def get_registry():
+        return None
+    DEFAULT_SESSION = "default"
+    def resolve_priority(config=None, default="interactive"):
+        return default
+    JobQueue = None
+    TERMINAL_STATUSES = ()
+    async def warm_up_providers(models=None, temperature=0.7, max_tokens=4096):
         return None
 
 # Configure logging
@@ -83,18 +102,72 @@ app.add_middleware(
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
+        # Per-client buffers that merge stream tokens into fewer frames
+        self.coalescers: Dict[str, StreamCoalescer] = {}
+        self.coalescing_stats = CoalescerStats()
+        # (session_id, agent_id) -> clients watching that run
+        self.run_subscribers: Dict[Tuple[str, str], set] = {}
+        # Called with an agent_id and session_id when the last subscriber of a run disconnects
+        self.on_run_abandoned = None
     
-    async def connect(self, client_id: str, websocket: WebSocket):
+    async def connect(
+        self,
+        client_id: str,
+        websocket: WebSocket,
+        coalesce_ms: Optional[str] = None,
+        coalesce_bytes: Optional[str] = None
+    ):
         await websocket.accept()
         self.active_connections[client_id] = websocket
+        coalescer = StreamCoalescer(
+            lambda message: self._send_now(client_id, message),
+            stats=self.coalescing_stats
+        )
+        try:
+            coalescer.configure(coalesce_ms, coalesce_bytes)
+        except ValueError:
+            logger.warning(f"Client {client_id} sent invalid coalescing settings, using defaults")
+        self.coalescers[client_id] = coalescer
         logger.info(f"Client {client_id} connected. Total connections: {len(self.active_connections)}")
     
     def disconnect(self, client_id: str):
         if client_id in self.active_connections:
             del self.active_connections[client_id]
+        coalescer = self.coalescers.pop(client_id, None)
+        if coalescer is not None:
+            coalescer.close()
         logger.info(f"Client {client_id} disconnected. Total connections: {len(self.active_connections)}")
+        
+        for (session_id, agent_id), subscribers in list(self.run_subscribers.items()):
+            if client_id not in subscribers:
+                continue
+            subscribers.discard(client_id)
+            if not subscribers:
+                del self.run_subscribers[(session_id, agent_id)]
+                logger.info(f"Last subscriber of {agent_id} disconnected")
+                if self.on_run_abandoned:
+                    self.on_run_abandoned(agent_id, session_id)
+    
+    def subscribe(self, client_id: str, agent_id: str, session_id: Optional[str] = None):
+        self.run_subscribers.setdefault((session_id or DEFAULT_SESSION, agent_id), set()).add(client_id)
+    
+    def forget_run(self, agent_id: str, session_id: Optional[str] = None):
+        """Drop a finished run's subscriptions"""
+        self.run_subscribers.pop((session_id or DEFAULT_SESSION, agent_id), None)
+    
+    def configure_client(self, client_id: str, coalesce_ms: Optional[float], coalesce_bytes: Optional[int]) -> Dict[str, Any]:
+        """Change a client's coalescing settings; raises ValueError on bad values"""
+        coalescer = self.coalescers[client_id]
+        coalescer.configure(coalesce_ms, coalesce_bytes)
+        return {"coalesce_ms": coalescer.flush_ms, "coalesce_bytes": coalescer.flush_bytes}
     
     async def send_message(self, client_id: str, message: dict):
+        """Send an event to a client; stream tokens may be merged with the ones after them"""
+        coalescer = self.coalescers.get(client_id)
+        if coalescer is not None:
+            await coalescer.send_event(message)
+    
+    async def _send_now(self, client_id: str, message: dict):
         if client_id in self.active_connections:
             try:
                 await self.active_connections[client_id].send_json(message)
@@ -105,9 +178,77 @@ class ConnectionManager:
     async def broadcast(self, message: dict):
         for client_id in list(self.active_connections.keys()):
             await self.send_message(client_id, message)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "connections": len(self.active_connections),
+            "default_coalesce_ms": DEFAULT_FLUSH_MS,
+            "default_coalesce_bytes": DEFAULT_FLUSH_BYTES,
+            **self.coalescing_stats.get_stats()
+        }
 
 manager = ConnectionManager()
 
+# "inprocess" runs agents in this process; "queue" hands them to worker.py processes
+EXECUTION_BACKEND = os.getenv("AGENT_EXECUTION_BACKEND", "inprocess")
+job_queue = JobQueue() if AGENTS_AVAILABLE and EXECUTION_BACKEND == "queue" else None
+
+
+async def cancel_run(agent_id: str, session_id: Optional[str] = None) -> bool:
+    """
+    Cancel a session's in-process run, or its queued/running job when using the queue backend
+    Runs with the same ID in other sessions are not touched
+    """
+    session_id = session_id or DEFAULT_SESSION
+    if get_registry().cancel(agent_id, session_id):
+        return True
+    return job_queue is not None and await asyncio.to_thread(job_queue.request_cancel, agent_id, session_id)
+
+
+manager.on_run_abandoned = lambda agent_id, session_id: asyncio.ensure_future(cancel_run(agent_id, session_id))
+
+
+def get_session_id(
+    x_session_id: Optional[str] = Header(None),
+    session_id: Optional[str] = None
+) -> Optional[str]:
+    """
+    Session (or workspace) ID from the X-Session-ID header or ?session_id=
+    Requests without one share the default session
+    """
+    return x_session_id or session_id
+
+
+def reserve_execution_slot(
+    orchestrator,
+    agent_id: str,
+    agent_type: AgentType,
+    config: Optional[AgentConfig] = None,
+    priority: str = "interactive"
+):
+    """
+    Admit a run into the orchestrator's scheduler, or reject with 429 if the queue is full
+    config.extra["priority"] overrides the priority inferred from the endpoint
+    """
+    try:
+        priority = resolve_priority(config, priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        return orchestrator.scheduler.reserve(agent_id, agent_type, priority=priority)
+    except SchedulerFullError as e:
+        raise queue_full_error(e)
+
+
+def queue_full_error(error: SchedulerFullError) -> HTTPException:
+    """429 response for a run rejected by the scheduler or job queue"""
+    return HTTPException(
+        status_code=429,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
 
 # Request/Response Models
 class AgentExecutionRequest(BaseModel):
@@ -121,9 +262,15 @@ class AgentExecutionRequest(BaseModel):
 
 
 class AgentChainRequest(BaseModel):
+    # Each entry: agent_type, description, optional agent_id, custom_input,
+    # config and depends_on (list of agent_ids this agent waits for)
     agents: List[Dict[str, Any]]
     simulation_data: Optional[Dict[str, Any]] = None
     policy_data: Optional[Dict[str, Any]] = None
+    # Steps are checkpointed under chain_id (generated if omitted); with
+    # resume=True, steps whose checkpoint still matches are not re-run
+    chain_id: Optional[str] = None
+    resume: bool = False
 
 
 class AgentResponse(BaseModel):
@@ -153,12 +300,13 @@ async def root():
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint"""
-    orchestrator = get_orchestrator()
-    stats = orchestrator.get_stats()
     return {
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
-        "orchestrator": stats
+        "execution_backend": EXECUTION_BACKEND,
+        "orchestrator": get_registry().get_stats(),
+        "websocket": manager.get_stats(),
+        **({"job_queue": await asyncio.to_thread(job_queue.get_stats)} if job_queue else {})
     }
 
 
@@ -234,7 +382,11 @@ async def get_agent(agent_id: str):
 
 
 @app.post("/api/agents/{agent_id}/execute")
-async def execute_custom_agent(agent_id: str, execution_request: dict):
+async def execute_custom_agent(
+    agent_id: str,
+    execution_request: dict,
+    session_id: Optional[str] = Depends(get_session_id)
+):
     """
     Execute a custom created agent
     """
@@ -280,7 +432,28 @@ async def execute_custom_agent(agent_id: str, execution_request: dict):
     
     agent_exec_id = f"{agent['type']}-{agent_id}-{datetime.utcnow().timestamp()}"
     
-    orchestrator = get_orchestrator()
+    orchestrator = get_orchestrator(session_id)
+    
+    if job_queue is not None:
+        try:
+            result = await submit_job(
+                orchestrator=orchestrator,
+                agent_id=agent_exec_id,
+                agent_type=agent_type,
+                description=description,
+                simulation_data=execution_request.get("simulation_data"),
+                policy_data=execution_request.get("policy_data"),
+                custom_input=custom_input,
+                config=config,
+                wait=not stream
+            )
+        except SchedulerFullError as e:
+            raise queue_full_error(e)
+        if agent_id in created_agents:
+            created_agents[agent_id]["_count"]["executions"] += 1
+        return result
+    
+    ticket = reserve_execution_slot(orchestrator, agent_exec_id, agent_type, config)
     
     if stream:
         # Return task ID, client connects to WebSocket
@@ -295,7 +468,8 @@ async def execute_custom_agent(agent_id: str, execution_request: dict):
                 simulation_data=execution_request.get("simulation_data"),
                 policy_data=execution_request.get("policy_data"),
                 custom_input=custom_input,
-                config=config
+                config=config,
+                ticket=ticket
             )
         )
         
@@ -317,7 +491,8 @@ async def execute_custom_agent(agent_id: str, execution_request: dict):
             simulation_data=execution_request.get("simulation_data"),
             policy_data=execution_request.get("policy_data"),
             custom_input=custom_input,
-            config=config
+            config=config,
+            ticket=ticket
         )
         
         created_agents[agent_id]["_count"]["executions"] += 1
@@ -326,7 +501,10 @@ async def execute_custom_agent(agent_id: str, execution_request: dict):
 
 
 @app.post("/api/agents/execute")
-async def execute_agent(request: AgentExecutionRequest):
+async def execute_agent(
+    request: AgentExecutionRequest,
+    session_id: Optional[str] = Depends(get_session_id)
+):
     """
     Execute a single agent task
     Returns immediately with task ID if streaming, or full result if not streaming
@@ -343,7 +521,25 @@ async def execute_agent(request: AgentExecutionRequest):
     # Generate agent ID
     agent_id = f"{agent_type.value}-{datetime.utcnow().timestamp()}"
     
-    orchestrator = get_orchestrator()
+    orchestrator = get_orchestrator(session_id)
+    
+    if job_queue is not None:
+        try:
+            return await submit_job(
+                orchestrator=orchestrator,
+                agent_id=agent_id,
+                agent_type=agent_type,
+                description=request.description,
+                simulation_data=request.simulation_data,
+                policy_data=request.policy_data,
+                custom_input=request.custom_input,
+                config=config,
+                wait=not request.stream
+            )
+        except SchedulerFullError as e:
+            raise queue_full_error(e)
+    
+    ticket = reserve_execution_slot(orchestrator, agent_id, agent_type, config)
     
     if request.stream:
         # Return task ID immediately, client should connect to WebSocket
@@ -359,7 +555,8 @@ async def execute_agent(request: AgentExecutionRequest):
                 simulation_data=request.simulation_data,
                 policy_data=request.policy_data,
                 custom_input=request.custom_input,
-                config=config
+                config=config,
+                ticket=ticket
             )
         )
         
@@ -379,11 +576,39 @@ async def execute_agent(request: AgentExecutionRequest):
             simulation_data=request.simulation_data,
             policy_data=request.policy_data,
             custom_input=request.custom_input,
-            config=config
+            config=config,
+            ticket=ticket
         )
         return result
 
 
+@app.post("/api/agents/{agent_id}/cancel")
+async def cancel_agent(
+    agent_id: str,
+    session_id: Optional[str] = Depends(get_session_id)
+):
+    """
+    Cancel a queued or running agent execution in the caller's session
+    agent_id is the execution ID returned by the execute endpoints
+    """
+    if not await cancel_run(agent_id, session_id):
+        raise HTTPException(status_code=404, detail=f"No queued or running agent: {agent_id}")
+    return {"success": True, "agent_id": agent_id, "status": "cancelling"}
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Get a queued job's status and result (AGENT_EXECUTION_BACKEND=queue only)
+    job_id is the agent_id returned by the execute endpoints
+    """
+    job = await asyncio.to_thread(job_queue.get, job_id) if job_queue is not None else None
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    job.pop("payload")
+    return job
+
+
 @app.get("/api/agents/execute/{agent_id}/stream")
 async def stream_agent_execution(agent_id: str):
     """
@@ -402,58 +627,114 @@ async def stream_agent_execution(agent_id: str):
 
 
 @app.post("/api/agents/chain")
-async def execute_agent_chain(request: AgentChainRequest):
+async def execute_agent_chain(
+    request: AgentChainRequest,
+    session_id: Optional[str] = Depends(get_session_id)
+):
     """
     Execute multiple agents in sequence
     Each agent receives context from previous agents
+    If agents declare depends_on, independent agents run in parallel and
+    each receives context only from its dependencies
+    """
+    return await run_agent_chain(
+        orchestrator=get_orchestrator(session_id),
+        agents=request.agents,
+        simulation_data=request.simulation_data,
+        policy_data=request.policy_data,
+        chain_id=request.chain_id or f"chain-{datetime.utcnow().timestamp()}",
+        resume=request.resume
+    )
+
+
+@app.post("/api/agents/chain/{chain_id}/resume")
+async def resume_agent_chain(
+    chain_id: str,
+    session_id: Optional[str] = Depends(get_session_id)
+):
     """
-    orchestrator = get_orchestrator()
+    Re-run a previous chain of the caller's session, skipping the steps whose
+    checkpoints are still valid. Execution continues from the step that failed
+    """
+    orchestrator = get_orchestrator(session_id)
+    chain = orchestrator.get_chain(chain_id)
+    if chain is None:
+        raise HTTPException(status_code=404, detail=f"Chain not found: {chain_id}")
     
+    return await run_agent_chain(
+        orchestrator=orchestrator,
+        agents=chain["request"]["agents"],
+        simulation_data=chain["request"].get("simulation_data"),
+        policy_data=chain["request"].get("policy_data"),
+        chain_id=chain_id,
+        resume=True
+    )
+
+
+async def run_agent_chain(
+    orchestrator,
+    agents: List[Dict[str, Any]],
+    simulation_data: Optional[Dict[str, Any]],
+    policy_data: Optional[Dict[str, Any]],
+    chain_id: str,
+    resume: bool
+) -> Dict[str, Any]:
     try:
         results = await orchestrator.execute_agent_chain(
-            agents=request.agents,
-            simulation_data=request.simulation_data,
-            policy_data=request.policy_data
+            agents=agents,
+            simulation_data=simulation_data,
+            policy_data=policy_data,
+            chain_id=chain_id,
+            resume=resume
         )
         
         return {
             "success": True,
+            "chain_id": chain_id,
             "chain_results": results,
-            "total_agents": len(request.agents),
-            "completed": len(results)
+            "total_agents": len(agents),
+            "completed": len(results),
+            "resumed": sum(1 for result in results if result.get("resumed"))
         }
+    except SchedulerFullError as e:
+        raise queue_full_error(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error executing agent chain: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/orchestrator/stats")
-async def get_orchestrator_stats():
-    """Get orchestrator statistics"""
-    orchestrator = get_orchestrator()
+async def get_orchestrator_stats(session_id: Optional[str] = Depends(get_session_id)):
+    """Get orchestrator statistics for a session"""
+    orchestrator = get_orchestrator(session_id)
     return orchestrator.get_stats()
 
 
 @app.get("/api/orchestrator/context")
-async def get_aggregated_context():
-    """Get current aggregated context"""
-    orchestrator = get_orchestrator()
+async def get_aggregated_context(session_id: Optional[str] = Depends(get_session_id)):
+    """Get current aggregated context for a session"""
+    orchestrator = get_orchestrator(session_id)
     return orchestrator.get_context()
 
 
 @app.post("/api/orchestrator/context/clear")
-async def clear_context():
-    """Clear aggregated context"""
-    orchestrator = get_orchestrator()
+async def clear_context(session_id: Optional[str] = Depends(get_session_id)):
+    """Clear aggregated context for a session"""
+    orchestrator = get_orchestrator(session_id)
     orchestrator.clear_context()
     return {"success": True, "message": "Context cleared"}
 
 
 @app.get("/api/orchestrator/tasks")
-async def get_completed_tasks():
-    """Get all completed tasks"""
-    orchestrator = get_orchestrator()
-    return orchestrator.get_completed_tasks()
+async def get_completed_tasks(
+    limit: Optional[int] = None,
+    session_id: Optional[str] = Depends(get_session_id)
+):
+    """Get completed tasks for a session, most recent first (optionally only the latest `limit`)"""
+    orchestrator = get_orchestrator(session_id)
+    return orchestrator.get_completed_tasks(limit)
 
 
 @app.post("/api/reports/download")
@@ -525,8 +806,19 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
     """
     WebSocket endpoint for real-time agent streaming
     Clients receive token-by-token updates as agents execute
+    Executions use the session from the message's session_id or ?session_id=
+    A run is cancelled by a "cancel" message, or automatically once every
+    client subscribed to it has disconnected
+    Stream tokens are merged into frames every ?coalesce_ms= milliseconds or
+    ?coalesce_bytes= bytes, changeable later with a "configure" message
     """
-    await manager.connect(client_id, websocket)
+    await manager.connect(
+        client_id,
+        websocket,
+        coalesce_ms=websocket.query_params.get("coalesce_ms"),
+        coalesce_bytes=websocket.query_params.get("coalesce_bytes")
+    )
+    connection_session_id = websocket.query_params.get("session_id")
     
     try:
         while True:
@@ -537,36 +829,91 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
             if message_type == "ping":
                 await manager.send_message(client_id, {"type": "pong"})
             
+            elif message_type == "configure":
+                try:
+                    settings = manager.configure_client(
+                        client_id, data.get("coalesce_ms"), data.get("coalesce_bytes")
+                    )
+                    await manager.send_message(client_id, {"type": "configured", **settings})
+                except (TypeError, ValueError) as e:
+                    await manager.send_message(client_id, {
+                        "type": "error",
+                        "error": f"Invalid coalescing settings: {e}"
+                    })
+            
             elif message_type == "subscribe":
                 # Client wants to subscribe to specific agent
                 agent_id = data.get("agent_id")
+                manager.subscribe(client_id, agent_id, data.get("session_id") or connection_session_id)
                 await manager.send_message(client_id, {
                     "type": "subscribed",
                     "agent_id": agent_id
                 })
             
+            elif message_type == "cancel":
+                agent_id = data.get("agent_id")
+                cancelled = await cancel_run(agent_id, data.get("session_id") or connection_session_id)
+                await manager.send_message(client_id, {
+                    "type": "cancelling" if cancelled else "error",
+                    "agent_id": agent_id,
+                    **({} if cancelled else {"error": f"No queued or running agent: {agent_id}"})
+                })
+            
             elif message_type == "execute":
                 # Client wants to execute an agent
                 try:
                     agent_type = AgentType(data["agent_type"])
                     agent_id = f"{agent_type.value}-{client_id}-{datetime.utcnow().timestamp()}"
+                    description = data["description"]
                     
                     config = AgentConfig(**(data.get("config", {})))
                     
-                    orchestrator = get_orchestrator()
+                    orchestrator = get_orchestrator(data.get("session_id") or connection_session_id)
+                    
+                    if job_queue is not None:
+                        queued = await submit_job(
+                            orchestrator=orchestrator,
+                            agent_id=agent_id,
+                            agent_type=agent_type,
+                            description=description,
+                            simulation_data=data.get("simulation_data"),
+                            policy_data=data.get("policy_data"),
+                            custom_input=data.get("custom_input"),
+                            config=config,
+                            client_id=client_id
+                        )
+                        manager.subscribe(client_id, agent_id, orchestrator.session_id)
+                        await manager.send_message(client_id, queued)
+                        continue
                     
-                    # Stream execution
-                    async for event in orchestrator.execute_agent_stream(
-                        agent_id=agent_id,
-                        agent_type=agent_type,
-                        task_description=data["description"],
-                        simulation_data=data.get("simulation_data"),
-                        policy_data=data.get("policy_data"),
-                        custom_input=data.get("custom_input"),
-                        config=config
-                    ):
-                        await manager.send_message(client_id, event)
+                    # Every field is read above: nothing after reserve may fail and leak the slot
+                    ticket = orchestrator.scheduler.reserve(
+                        agent_id, agent_type, priority=resolve_priority(config, "interactive")
+                    )
+                    manager.subscribe(client_id, agent_id, orchestrator.session_id)
+                    
+                    # Stream in the background so this loop keeps reading cancel messages
+                    asyncio.create_task(
+                        stream_to_client(
+                            client_id=client_id,
+                            orchestrator=orchestrator,
+                            agent_id=agent_id,
+                            agent_type=agent_type,
+                            description=description,
+                            simulation_data=data.get("simulation_data"),
+                            policy_data=data.get("policy_data"),
+                            custom_input=data.get("custom_input"),
+                            config=config,
+                            ticket=ticket
+                        )
+                    )
                 
+                except SchedulerFullError as e:
+                    await manager.send_message(client_id, {
+                        "type": "error",
+                        "error": str(e),
+                        "retry_after": e.retry_after
+                    })
                 except Exception as e:
                     await manager.send_message(client_id, {
                         "type": "error",
@@ -580,6 +927,177 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
         manager.disconnect(client_id)
 
 
+async def submit_job(
+    orchestrator,
+    agent_id: str,
+    agent_type: AgentType,
+    description: str,
+    simulation_data: Optional[Dict[str, Any]],
+    policy_data: Optional[Dict[str, Any]],
+    custom_input: Optional[Dict[str, Any]],
+    config: AgentConfig,
+    client_id: Optional[str] = None,
+    wait: bool = False
+) -> Dict[str, Any]:
+    """
+    Queue an agent run for the worker processes
+    The job carries a snapshot of the session's aggregated context. Its events
+    go to client_id if set, otherwise to every client. With wait=True, block
+    until the job finishes and return its result, or a 202 with its status
+    once AGENT_JOB_WAIT_SECONDS have passed.
+    
+    Raises:
+        SchedulerFullError: If the job queue is full
+    """
+    try:
+        priority = resolve_priority(config, "interactive")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # SQLite calls can wait on the database lock, so keep them off the event loop
+    await asyncio.to_thread(
+        job_queue.enqueue,
+        job_id=agent_id,
+        agent_type=agent_type.value,
+        session_id=orchestrator.session_id,
+        priority=priority,
+        payload={
+            "description": description,
+            "simulation_data": simulation_data,
+            "policy_data": policy_data,
+            "custom_input": custom_input,
+            "config": config.dict(),
+            "aggregated_context": orchestrator.get_context(),
+            "client_id": client_id
+        }
+    )
+    
+    if wait:
+        try:
+            job = await job_queue.wait_for_result(agent_id)
+        except asyncio.TimeoutError:
+            job = await asyncio.to_thread(job_queue.get, agent_id)
+            return JSONResponse(status_code=202, content={
+                "success": True,
+                "agent_id": agent_id,
+                "task_id": f"task-{agent_id}",
+                "status": job["status"],
+                "message": f"Agent job still {job['status']}. Poll /api/jobs/{agent_id} for its result."
+            })
+        return job["result"] or {
+            "success": False,
+            "agent_id": agent_id,
+            "agent_type": agent_type,
+            "error": job["error"],
+            "status": job["status"]
+        }
+    
+    return {
+        "success": True,
+        "agent_id": agent_id,
+        "task_id": f"task-{agent_id}",
+        "status": "queued",
+        "message": "Agent job queued. Connect to WebSocket for streaming updates."
+    }
+
+
+async def relay_job_events(poll_seconds: float = 0.1):
+    """
+    Forward events written by worker processes to WebSocket clients
+    Completed results are also folded into the session's aggregated context.
+    """
+    seq = await asyncio.to_thread(job_queue.last_event_seq)
+    jobs: Dict[str, Dict[str, Any]] = {}
+    
+    while True:
+        try:
+            events = await asyncio.to_thread(job_queue.events_since, seq)
+            if not events:
+                await asyncio.sleep(poll_seconds)
+                continue
+            
+            for seq, job_id, event in events:
+                if job_id not in jobs:
+                    job = await asyncio.to_thread(job_queue.get, job_id) or {"payload": {}}
+                    jobs[job_id] = {
+                        "client_id": job["payload"].get("client_id"),
+                        "session_id": job.get("session_id"),
+                        "agent_type": job.get("agent_type")
+                    }
+                job = jobs[job_id]
+                
+                event.setdefault("timestamp", datetime.utcnow().isoformat())
+                if job["client_id"]:
+                    await manager.send_message(job["client_id"], event)
+                else:
+                    await manager.broadcast(event)
+                
+                if event["type"] == "complete" and event.get("result"):
+                    get_orchestrator(job["session_id"]).record_external_result(
+                        AgentType(job["agent_type"]), event["result"]
+                    )
+                if event["type"] in ("complete", "cancelled", "error"):
+                    manager.forget_run(job_id, job["session_id"])
+                    del jobs[job_id]
+        
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error relaying job events: {e}")
+            await asyncio.sleep(poll_seconds)
+
+
+@app.on_event("startup")
+async def start_job_relay():
+    if job_queue is not None:
+        asyncio.create_task(relay_job_events())
+        logger.info(f"Queue execution backend enabled, relaying events from {job_queue.path}")
+
+
+@app.on_event("startup")
+async def warm_up_llm_clients():
+    # Queued runs execute in the workers, which warm up their own clients.
+    # Runs in the background so a slow LLM endpoint can't hold up startup.
+    if AGENTS_AVAILABLE and job_queue is None:
+        asyncio.create_task(warm_up_providers())
+
+
+async def stream_to_client(
+    client_id: str,
+    orchestrator,
+    agent_id: str,
+    agent_type: AgentType,
+    description: str,
+    simulation_data: Optional[Dict[str, Any]],
+    policy_data: Optional[Dict[str, Any]],
+    custom_input: Optional[Dict[str, Any]],
+    config: AgentConfig,
+    ticket=None
+):
+    """Execute an agent requested over a WebSocket and stream its events back to that client"""
+    try:
+        async for event in orchestrator.execute_agent_stream(
+            agent_id=agent_id,
+            agent_type=agent_type,
+            task_description=description,
+            simulation_data=simulation_data,
+            policy_data=policy_data,
+            custom_input=custom_input,
+            config=config,
+            ticket=ticket
+        ):
+            await manager.send_message(client_id, event)
+    except Exception as e:
+        logger.error(f"Error streaming {agent_id} to {client_id}: {e}")
+        await manager.send_message(client_id, {
+            "type": "error",
+            "agent_id": agent_id,
+            "error": str(e)
+        })
+    finally:
+        manager.forget_run(agent_id, orchestrator.session_id)
+
+
 async def execute_and_broadcast(
     orchestrator,
     agent_id: str,
@@ -588,11 +1106,14 @@ async def execute_and_broadcast(
     simulation_data: Optional[Dict[str, Any]],
     policy_data: Optional[Dict[str, Any]],
     custom_input: Optional[Dict[str, Any]],
-    config: AgentConfig
+    config: AgentConfig,
+    ticket=None
 ):
     """
     Execute agent and broadcast results to all connected clients
+    Queue position updates are broadcast as "queued" events until the run starts
     """
+    completed = False
     try:
         # Send start message
         await manager.broadcast({
@@ -609,20 +1130,23 @@ async def execute_and_broadcast(
             simulation_data=simulation_data,
             policy_data=policy_data,
             custom_input=custom_input,
-            config=config
+            config=config,
+            ticket=ticket
         ):
             # Ensure timestamp is added to event
             if "timestamp" not in event:
                 event["timestamp"] = datetime.utcnow().isoformat()
+            completed = event["type"] == "complete"
             await manager.broadcast(event)
         
         # Send completion message
-        await manager.broadcast({
-            "type": "complete",
-            "agent_id": agent_id,
-            "data": f"{agent_type.value} agent execution completed successfully!",
-            "timestamp": datetime.utcnow().isoformat()
-        })
+        if completed:
+            await manager.broadcast({
+                "type": "complete",
+                "agent_id": agent_id,
+                "data": f"{agent_type.value} agent execution completed successfully!",
+                "timestamp": datetime.utcnow().isoformat()
+            })
         
     except Exception as e:
         logger.error(f"Error in execute_and_broadcast: {e}")
@@ -633,6 +1157,8 @@ async def execute_and_broadcast(
             "data": str(e),
             "timestamp": datetime.utcnow().isoformat()
         })
+    finally:
+        manager.forget_run(agent_id, orchestrator.session_id)
 
 
 # VAPI Phone Call Endpoints
@@ -0,0 +1,189 @@
+"""
+Chain Checkpoints
+Per-step results of agent chains, keyed by a hash of each step's inputs
+Lets a failed chain resume without re-running the steps that already succeeded
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, Any, List, Optional
+
+from task_store import agent_type_name
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_PATH = os.path.join(os.path.dirname(__file__), '..', '.data', 'chain_checkpoints.db')
+
+
+def step_key(
+    agent_type: Any,
+    description: str,
+    custom_input: Optional[Dict[str, Any]],
+    config: Any,
+    simulation_data: Optional[Dict[str, Any]],
+    policy_data: Optional[Dict[str, Any]],
+    upstream_results: List[Any]
+) -> str:
+    """
+    Content hash of everything a chain step's output depends on
+
+    Upstream results are the outputs of the steps this one reads from, so a
+    re-run upstream step with a different output invalidates everything
+    downstream of it.
+    """
+    inputs = {
+        "agent_type": agent_type_name(agent_type),
+        "description": description,
+        "custom_input": custom_input or {},
+        "config": config.dict() if hasattr(config, "dict") else (config or {}),
+        "simulation_data": simulation_data,
+        "policy_data": policy_data,
+        "upstream_results": upstream_results
+    }
+    canonical = json.dumps(inputs, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ChainCheckpointStore:
+    """
+    SQLite store of chain requests and their successful step results
+
+    A checkpoint is only reused when a step's inputs hash to the same key
+    within ttl_seconds, so editing a step or anything upstream of it makes the
+    chain run that step again. Chains not updated within ttl_seconds are
+    dropped along with their checkpoints.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl_seconds: Optional[float] = None):
+        self.ttl_seconds = ttl_seconds or float(os.getenv("CHAIN_CHECKPOINT_TTL_SECONDS", str(24 * 3600)))
+        self.hits = 0
+        self.misses = 0
+
+        path = path if path is not None else os.getenv("CHAIN_CHECKPOINT_PATH", DEFAULT_CHECKPOINT_PATH)
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            try:
+                self._db = self._open_db(path)
+            except sqlite3.Error as e:
+                logger.error(f"Could not open chain checkpoint store at {path}, chains will not be resumable: {e}")
+
+    def _open_db(self, path: str) -> sqlite3.Connection:
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS chains (
+                chain_id TEXT PRIMARY KEY,
+                request TEXT,
+                status TEXT,
+                updated_at REAL
+            )
+        """)
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS chain_checkpoints (
+                chain_id TEXT,
+                step_key TEXT,
+                agent_id TEXT,
+                created_at REAL,
+                result TEXT,
+                PRIMARY KEY (chain_id, step_key)
+            )
+        """)
+        db.commit()
+        return db
+
+    def save_chain(self, chain_id: str, request: Dict[str, Any], status: str = "running"):
+        """Store the chain request so it can be resumed by ID alone"""
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO chains (chain_id, request, status, updated_at) VALUES (?, ?, ?, ?)",
+                (chain_id, json.dumps(request, default=str), status, time.time())
+            )
+            self._prune()
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to save chain {chain_id}, it will not be resumable: {e}")
+
+    def set_chain_status(self, chain_id: str, status: str):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "UPDATE chains SET status = ?, updated_at = ? WHERE chain_id = ?",
+                (status, time.time(), chain_id)
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to update status of chain {chain_id}: {e}")
+
+    def _prune(self):
+        """Drop expired chains and checkpoints"""
+        cutoff = time.time() - self.ttl_seconds
+        self._db.execute("DELETE FROM chains WHERE updated_at < ?", (cutoff,))
+        self._db.execute("DELETE FROM chain_checkpoints WHERE created_at < ?", (cutoff,))
+
+    def get_chain(self, chain_id: str) -> Optional[Dict[str, Any]]:
+        """Get a stored chain's request and status, unless it has expired or can't be read"""
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT request, status, updated_at FROM chains WHERE chain_id = ? AND updated_at >= ?",
+                (chain_id, time.time() - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                return None
+            return {"chain_id": chain_id, "request": json.loads(row[0]), "status": row[1], "updated_at": row[2]}
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"Failed to read chain {chain_id}: {e}")
+            return None
+
+    def get(self, chain_id: str, key: str) -> Optional[Dict[str, Any]]:
+        """Get a step's checkpointed result if it exists and hasn't expired; a read error counts as a miss"""
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT result FROM chain_checkpoints WHERE chain_id = ? AND step_key = ? AND created_at >= ?",
+                (chain_id, key, time.time() - self.ttl_seconds)
+            ).fetchone()
+            result = json.loads(row[0]) if row is not None else None
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"Failed to read checkpoint {key} of chain {chain_id}: {e}")
+            result = None
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, chain_id: str, key: str, result: Dict[str, Any]):
+        """Checkpoint a successful step"""
+        if self._db is None:
+            return
+        stored = {**result, "agent_type": agent_type_name(result.get("agent_type"))}
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO chain_checkpoints (chain_id, step_key, agent_id, created_at, result) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (chain_id, key, result.get("agent_id"), time.time(), json.dumps(stored, default=str))
+            )
+            self._prune()
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to checkpoint step {result.get('agent_id')} of chain {chain_id}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get checkpoint statistics"""
+        return {
+            "enabled": self._db is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttl_seconds": self.ttl_seconds
+        }
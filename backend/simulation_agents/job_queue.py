@@ -0,0 +1,388 @@
+"""
+Durable Job Queue
+SQLite-backed queue of agent runs shared by the API process and worker processes
+Workers append progress events that the API process relays to WebSocket clients
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from scheduler import PRIORITIES, DEFAULT_PRIORITY, SchedulerFullError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_PATH = os.path.join(os.path.dirname(__file__), '..', '.data', 'jobs.db')
+
+# Job states that will not change again
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class JobQueue:
+    """
+    Agent runs persisted in SQLite so they survive API and worker restarts
+
+    Workers claim jobs atomically, in priority order with the same aging rule
+    as the in-process scheduler, and hold a lease they renew with heartbeats.
+    A job whose worker stops heartbeating is handed to another worker, up to
+    max_attempts times. Every connection opens the same file, so any number of
+    worker processes can share one queue without a broker.
+
+    At most max_queued jobs wait at once; enqueue rejects the rest like the
+    in-process scheduler's bounded queue. Calls are serialized by a lock, so
+    the API process can run them in worker threads.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        lease_seconds: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+        aging_seconds: Optional[float] = None,
+        event_ttl_seconds: Optional[float] = None,
+        max_queued: Optional[int] = None,
+        wait_seconds: Optional[float] = None
+    ):
+        self.path = path or os.getenv("AGENT_JOB_QUEUE_PATH", DEFAULT_QUEUE_PATH)
+        self.lease_seconds = lease_seconds or float(os.getenv("AGENT_JOB_LEASE_SECONDS", "60"))
+        self.max_attempts = max_attempts or int(os.getenv("AGENT_JOB_MAX_ATTEMPTS", "3"))
+        self.aging_seconds = aging_seconds or float(os.getenv("AGENT_PRIORITY_AGING_SECONDS", "30"))
+        self.event_ttl_seconds = event_ttl_seconds or float(os.getenv("AGENT_JOB_EVENT_TTL_SECONDS", "3600"))
+        self.max_queued = max_queued or int(os.getenv("AGENT_JOB_MAX_QUEUED", os.getenv("AGENT_MAX_QUEUE", "64")))
+        self.wait_seconds = wait_seconds or float(os.getenv("AGENT_JOB_WAIT_SECONDS", "300"))
+        self._lock = threading.RLock()
+        self._db = self._open_db(self.path)
+
+    def _open_db(self, path: str) -> sqlite3.Connection:
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit mode; multi-statement updates use explicit BEGIN IMMEDIATE
+        db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                session_id TEXT,
+                agent_type TEXT,
+                priority TEXT,
+                payload TEXT,
+                status TEXT,
+                attempts INTEGER DEFAULT 0,
+                worker_id TEXT,
+                cancel_requested INTEGER DEFAULT 0,
+                enqueued_at REAL,
+                started_at REAL,
+                heartbeat_at REAL,
+                finished_at REAL,
+                result TEXT,
+                error TEXT
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, enqueued_at)")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS job_events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT,
+                created_at REAL,
+                event TEXT
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id)")
+        return db
+
+    def enqueue(
+        self,
+        job_id: str,
+        agent_type: str,
+        payload: Dict[str, Any],
+        session_id: Optional[str] = None,
+        priority: str = DEFAULT_PRIORITY
+    ):
+        """
+        Add a run to the queue
+
+        Args:
+            job_id: Run identifier, used as the agent_id when it executes
+            agent_type: Agent type value
+            payload: JSON-serializable execute_agent_stream arguments
+            session_id: Session whose orchestrator runs the job
+            priority: Priority class, one of PRIORITIES
+
+        Raises:
+            SchedulerFullError: If max_queued jobs are already waiting
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Invalid priority {priority!r}, expected one of: {', '.join(PRIORITIES)}")
+
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                queued = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+                full = queued >= self.max_queued
+                if full:
+                    retry_after = self._estimate_retry_after(queued)
+                else:
+                    self._db.execute(
+                        "INSERT INTO jobs (job_id, session_id, agent_type, priority, payload, status, enqueued_at) "
+                        "VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+                        (job_id, session_id, agent_type, priority, json.dumps(payload, default=str), time.time())
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+        if full:
+            raise SchedulerFullError(f"Job queue is full ({queued} waiting). Retry in {retry_after}s.", retry_after)
+
+    def _estimate_retry_after(self, queued: int) -> int:
+        """Rough seconds until the queue has room, from recent run times and the jobs running now"""
+        avg_run_seconds, running = self._db.execute(
+            "SELECT (SELECT AVG(finished_at - started_at) FROM "
+            "(SELECT finished_at, started_at FROM jobs WHERE status = 'completed' ORDER BY finished_at DESC LIMIT 50)), "
+            "(SELECT COUNT(*) FROM jobs WHERE status = 'running')"
+        ).fetchone()
+        waves = (queued + 1) / max(1, running)
+        return max(1, math.ceil((avg_run_seconds or 30.0) * waves))
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Take the most urgent queued job and lease it to a worker
+
+        Jobs whose lease has expired are requeued (or failed once they have
+        used up their attempts) before choosing.
+        """
+        with self._lock:
+            now = time.time()
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire_leases(now)
+                rank = " ".join(f"WHEN '{priority}' THEN {index}" for index, priority in enumerate(PRIORITIES))
+                row = self._db.execute(
+                    f"SELECT job_id FROM jobs WHERE status = 'queued' "
+                    f"ORDER BY MAX(0, (CASE priority {rank} END) - CAST((? - enqueued_at) / ? AS INTEGER)), enqueued_at "
+                    f"LIMIT 1",
+                    (now, self.aging_seconds)
+                ).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+
+                self._db.execute(
+                    "UPDATE jobs SET status = 'running', worker_id = ?, attempts = attempts + 1, "
+                    "started_at = ?, heartbeat_at = ? WHERE job_id = ?",
+                    (worker_id, now, now, row[0])
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+            return self.get(row[0])
+
+    def _expire_leases(self, now: float):
+        stale = self._db.execute(
+            "SELECT job_id, attempts, cancel_requested FROM jobs WHERE status = 'running' AND heartbeat_at < ?",
+            (now - self.lease_seconds,)
+        ).fetchall()
+        for job_id, attempts, cancel_requested in stale:
+            if cancel_requested:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'cancelled', finished_at = ?, error = 'Cancelled' WHERE job_id = ?",
+                    (now, job_id)
+                )
+                self._insert_events(job_id, [{"type": "cancelled", "agent_id": job_id, "data": "Cancelled"}])
+            elif attempts >= self.max_attempts:
+                logger.error(f"Job {job_id} lost its worker {attempts} times, giving up")
+                self._db.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE job_id = ?",
+                    (now, "Worker stopped responding", job_id)
+                )
+                self._insert_events(job_id, [{"type": "error", "agent_id": job_id, "error": "Worker stopped responding"}])
+            else:
+                logger.warning(f"Job {job_id} lost its worker, requeueing")
+                self._db.execute("UPDATE jobs SET status = 'queued', worker_id = NULL WHERE job_id = ?", (job_id,))
+
+    def heartbeat(self, worker_id: str, job_ids: List[str]) -> List[str]:
+        """
+        Renew the leases of a worker's running jobs
+        Jobs re-claimed by another worker after this one's lease expired are left alone
+
+        Returns:
+            The subset of job_ids, still leased to this worker, that have been asked to cancel
+        """
+        with self._lock:
+            if not job_ids:
+                return []
+            placeholders = ",".join("?" * len(job_ids))
+            self._db.execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE job_id IN ({placeholders}) "
+                f"AND status = 'running' AND worker_id = ?",
+                (time.time(), *job_ids, worker_id)
+            )
+            rows = self._db.execute(
+                f"SELECT job_id FROM jobs WHERE job_id IN ({placeholders}) "
+                f"AND status = 'running' AND worker_id = ? AND cancel_requested = 1",
+                (*job_ids, worker_id)
+            )
+            return [row[0] for row in rows]
+
+    def finish(
+        self,
+        job_id: str,
+        worker_id: str,
+        status: str,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None
+    ) -> bool:
+        """
+        Record a job's final status and result
+
+        Returns:
+            False if the job is no longer running under this worker's lease
+            (re-claimed by another worker, or already cancelled or failed)
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? "
+                "WHERE job_id = ? AND worker_id = ? AND status = 'running'",
+                (status, time.time(), json.dumps(result, default=str) if result is not None else None, error,
+                 job_id, worker_id)
+            )
+            return cursor.rowcount > 0
+
+    def request_cancel(self, job_id: str, session_id: Optional[str] = None) -> bool:
+        """
+        Cancel a job: queued jobs are cancelled immediately, running ones are
+        flagged for their worker to stop
+
+        Returns:
+            False if the job doesn't exist, belongs to another session (when
+            session_id is given) or has already finished
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT status, session_id FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                if row is None or row[0] in TERMINAL_STATUSES or (session_id is not None and row[1] != session_id):
+                    self._db.execute("COMMIT")
+                    return False
+
+                if row[0] == "queued":
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'cancelled', finished_at = ?, error = 'Cancelled' WHERE job_id = ?",
+                        (time.time(), job_id)
+                    )
+                    self._insert_events(job_id, [{"type": "cancelled", "agent_id": job_id, "data": "Cancelled before starting"}])
+                else:
+                    self._db.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ?", (job_id,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            return True
+
+    def add_events(self, job_id: str, events: List[Dict[str, Any]]):
+        """Append progress events for a job in one transaction"""
+        with self._lock:
+            if not events:
+                return
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._insert_events(job_id, events)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _insert_events(self, job_id: str, events: List[Dict[str, Any]]):
+        now = time.time()
+        self._db.executemany(
+            "INSERT INTO job_events (job_id, created_at, event) VALUES (?, ?, ?)",
+            [(job_id, now, json.dumps(event, default=str)) for event in events]
+        )
+
+    def events_since(self, seq: int, limit: int = 500) -> List[Tuple[int, str, Dict[str, Any]]]:
+        """Get (seq, job_id, event) tuples appended after seq, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, job_id, event FROM job_events WHERE seq > ? ORDER BY seq LIMIT ?",
+                (seq, limit)
+            )
+            return [(row_seq, job_id, json.loads(event)) for row_seq, job_id, event in rows]
+
+    def last_event_seq(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM job_events").fetchone()[0]
+
+    def prune(self):
+        """Drop events older than the event TTL"""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM job_events WHERE created_at < ?",
+                (time.time() - self.event_ttl_seconds,)
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job's row, with payload and result decoded"""
+        with self._lock:
+            cursor = self._db.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+
+            job = dict(zip([column[0] for column in cursor.description], row))
+            job["payload"] = json.loads(job["payload"])
+            job["result"] = json.loads(job["result"]) if job["result"] else None
+            job["cancel_requested"] = bool(job["cancel_requested"])
+            return job
+
+    async def wait_for_result(
+        self,
+        job_id: str,
+        timeout: Optional[float] = None,
+        poll_seconds: float = 0.25
+    ) -> Dict[str, Any]:
+        """
+        Poll until a job reaches a terminal status, then return it
+        Reads run in a worker thread so the event loop isn't blocked by a busy database
+
+        Raises:
+            asyncio.TimeoutError: If the job hasn't finished within timeout
+                (default wait_seconds) - e.g. no worker is running
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else self.wait_seconds)
+        while True:
+            job = await asyncio.to_thread(self.get, job_id)
+            if job is None:
+                raise KeyError(job_id)
+            if job["status"] in TERMINAL_STATUSES:
+                return job
+            if time.monotonic() >= deadline:
+                raise asyncio.TimeoutError(f"Job {job_id} is still {job['status']}")
+            await asyncio.sleep(poll_seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get job counts by status"""
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            return {
+                "path": self.path,
+                "queued": counts.get("queued", 0),
+                "running": counts.get("running", 0),
+                "completed": counts.get("completed", 0),
+                "failed": counts.get("failed", 0),
+                "cancelled": counts.get("cancelled", 0),
+                "lease_seconds": self.lease_seconds,
+                "max_attempts": self.max_attempts
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
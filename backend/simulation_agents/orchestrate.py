@@ -4,8 +4,11 @@ Manages execution of multiple agents working with simulated data and context
 """
 
 import asyncio
+import hashlib
 import logging
-from typing import Dict, Any, List, Optional, AsyncGenerator
+import time
+import uuid
+from typing import Dict, Any, List, Optional, AsyncGenerator, Awaitable, Callable
 from datetime import datetime
 import json
 
@@ -15,11 +18,41 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'create_agents'))
 
 from agent_types import AgentType, AgentTask, AgentConfig, Agent
 from specialized_agents import create_agent
+from scheduler import ExecutionScheduler, ExecutionTicket, DEFAULT_PRIORITY, resolve_priority
+from task_store import CompletedTaskStore, agent_type_name, task_outcome
+from orchestrator_stats import OrchestratorStats
+from chain_checkpoints import ChainCheckpointStore, step_key
+from response_cache import get_response_cache
+from similarity_cache import get_similarity_cache
+from llm_providers import get_client_pool, get_prefix_cache
+from context_budget import get_fragment_cache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_SESSION = "default"
+
+
+class AgentCancelledError(Exception):
+    """Raised inside a run that was cancelled through AgentOrchestrator.cancel"""
+
+
+class RunHandle:
+    """Tracks an in-flight run so it can be cancelled while queued or running"""
+    
+    def __init__(self, agent_id: str, ticket: ExecutionTicket):
+        self.agent_id = agent_id
+        self.ticket = ticket
+        self.cancel_requested = False
+        self.worker: Optional[asyncio.Task] = None  # Task producing the agent's output
+    
+    def cancel(self):
+        self.cancel_requested = True
+        self.ticket._notify()  # Wake the run if it is waiting for a slot
+        if self.worker is not None:
+            self.worker.cancel()
+
 
 class AgentOrchestrator:
     """
@@ -27,10 +60,28 @@ class AgentOrchestrator:
     Manages context aggregation and data flow between agents
     """
     
-    def __init__(self):
+    def __init__(
+        self,
+        session_id: str = DEFAULT_SESSION,
+        scheduler: Optional[ExecutionScheduler] = None,
+        task_store: Optional[CompletedTaskStore] = None,
+        checkpoints: Optional[ChainCheckpointStore] = None
+    ):
+        self.session_id = session_id
+        self.scheduler = scheduler or ExecutionScheduler()
+        self.checkpoints = checkpoints or ChainCheckpointStore()
         self.active_agents: Dict[str, Any] = {}
-        self.completed_tasks: Dict[str, Dict[str, Any]] = {}
+        # Queued and running agents, by agent_id. Clients choose ids, so two runs can share one
+        self._runs: Dict[str, List[RunHandle]] = {}
+        self.completed_tasks = task_store or CompletedTaskStore(namespace=session_id)
+        self.stats = OrchestratorStats(*self.completed_tasks.counts())
+        self.last_used = time.monotonic()
+        self._inflight = 0  # Runs admitted but not finished, including queued ones
         self.aggregated_context: Dict[str, Any] = {}
+        self._context_entry_sizes: Dict[str, List[int]] = {}  # Serialized size of each context entry
+        # Bumped on every context change; agents cache serialized context per version
+        self._context_id = uuid.uuid4().hex[:12]
+        self.context_version = 0
         
     async def execute_agent(
         self,
@@ -41,7 +92,11 @@ class AgentOrchestrator:
         policy_data: Optional[Dict[str, Any]] = None,
         custom_input: Optional[Dict[str, Any]] = None,
         config: Optional[AgentConfig] = None,
-        stream_callback: Optional[callable] = None
+        stream_callback: Optional[callable] = None,
+        aggregated_context: Optional[Dict[str, Any]] = None,
+        ticket: Optional[ExecutionTicket] = None,
+        priority: str = DEFAULT_PRIORITY,
+        context_versions: Optional[Dict[str, str]] = None
     ) -> Dict[str, Any]:
         """
         Execute a single agent task
@@ -55,11 +110,29 @@ class AgentOrchestrator:
             custom_input: Task-specific input
             config: Agent configuration
             stream_callback: Optional callback for streaming tokens
+            aggregated_context: Context to give the agent instead of the
+                orchestrator's shared aggregated context
+            ticket: Scheduler ticket from admission control. If omitted the
+                run is queued without a queue length limit.
+            priority: Priority class used when queueing without a ticket,
+                unless config.extra["priority"] overrides it
+            context_versions: Version tokens of simulation_data, policy_data
+                and aggregated_context, for callers that reuse the same data
+                across runs. The shared context is versioned automatically.
             
         Returns:
             Dict with agent execution results
         """
+        handle = self._register_run(agent_id, agent_type, ticket, resolve_priority(config, priority))
+        task = None
+        agent = None
+        
         try:
+            while not handle.ticket.granted:
+                self._check_cancelled(handle)
+                await handle.ticket.wait_for_update()
+            self._check_cancelled(handle)
+            
             # Create task
             task = AgentTask(
                 id=f"task-{agent_id}-{datetime.utcnow().timestamp()}",
@@ -67,10 +140,10 @@ class AgentOrchestrator:
                 agent_type=agent_type,
                 description=task_description,
                 simulation_data=simulation_data,
-                aggregated_context=self.aggregated_context,
                 policy_data=policy_data,
                 custom_input=custom_input or {},
-                config=config or AgentConfig()
+                config=config or AgentConfig(),
+                **self._context_snapshot(aggregated_context, context_versions)
             )
             
             # Create agent
@@ -81,9 +154,15 @@ class AgentOrchestrator:
             
             # Execute with streaming if callback provided
             if stream_callback and config and config.streaming:
-                full_output = ""
-                async for token in agent.stream_execute():
-                    full_output += token
+                async for token in self._stream_agent(handle, agent):
+                    if isinstance(token, dict):
+                        await stream_callback({
+                            **token,
+                            "agent_id": agent_id,
+                            "agent_type": agent_type,
+                            "timestamp": datetime.utcnow().isoformat()
+                        })
+                        continue
                     await stream_callback({
                         "type": "token",
                         "agent_id": agent_id,
@@ -93,16 +172,11 @@ class AgentOrchestrator:
                     })
                 result = agent.result
             else:
-                result = await agent.execute()
+                result = await self._run_worker(handle, agent.execute())
+            result = self._flag_approximate(agent, result)
             
             # Store completed task
-            self.completed_tasks[task.id] = {
-                "agent_id": agent_id,
-                "agent_type": agent_type,
-                "task": task.dict(),
-                "result": result,
-                "completed_at": datetime.utcnow().isoformat()
-            }
+            self._record_completed(task, agent, result)
             
             # Update aggregated context
             self._update_context(agent_type, result)
@@ -113,13 +187,26 @@ class AgentOrchestrator:
             
             logger.info(f"Completed execution of {agent_type} agent: {agent_id}")
             
+            # Agents catch their own LLM errors, so check what the agent reported
+            failed = agent.status == "failed"
             return {
-                "success": True,
+                "success": not failed,
                 "agent_id": agent_id,
                 "agent_type": agent_type,
                 "task_id": task.id,
                 "result": result,
-                "status": "completed"
+                **({"error": agent.error} if failed else {}),
+                "status": "failed" if failed else "completed"
+            }
+        
+        except AgentCancelledError:
+            self._record_cancelled(agent_id, agent_type, task, agent)
+            return {
+                "success": False,
+                "agent_id": agent_id,
+                "agent_type": agent_type,
+                "error": "Cancelled",
+                "status": "cancelled"
             }
             
         except Exception as e:
@@ -133,6 +220,8 @@ class AgentOrchestrator:
                 "error": str(e),
                 "status": "failed"
             }
+        finally:
+            self._finish_run(handle)
     
     async def execute_agent_stream(
         self,
@@ -142,12 +231,40 @@ class AgentOrchestrator:
         simulation_data: Optional[Dict[str, Any]] = None,
         policy_data: Optional[Dict[str, Any]] = None,
         custom_input: Optional[Dict[str, Any]] = None,
-        config: Optional[AgentConfig] = None
+        config: Optional[AgentConfig] = None,
+        ticket: Optional[ExecutionTicket] = None,
+        priority: str = DEFAULT_PRIORITY,
+        aggregated_context: Optional[Dict[str, Any]] = None,
+        context_versions: Optional[Dict[str, str]] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """
         Execute agent and yield streaming events
+        Yields "queued" events with the queue position while waiting for a slot,
+        and ends with a "complete" event, a "cancelled" event if the run is
+        cancelled, or an "error" event if it failed
+        aggregated_context and context_versions are as in execute_agent
         """
+        handle = self._register_run(agent_id, agent_type, ticket, resolve_priority(config, priority))
+        task = None
+        agent = None
+        
         try:
+            reported_position = None
+            while not handle.ticket.granted:
+                self._check_cancelled(handle)
+                if handle.ticket.position != reported_position:
+                    reported_position = handle.ticket.position
+                    yield {
+                        "type": "queued",
+                        "agent_id": agent_id,
+                        "agent_type": agent_type.value,
+                        "position": handle.ticket.position,
+                        "queue_length": self.scheduler.queue_length,
+                        "timestamp": datetime.utcnow().isoformat()
+                    }
+                await handle.ticket.wait_for_update()
+            self._check_cancelled(handle)
+            
             # Create task
             task = AgentTask(
                 id=f"task-{agent_id}-{datetime.utcnow().timestamp()}",
@@ -155,10 +272,10 @@ class AgentOrchestrator:
                 agent_type=agent_type,
                 description=task_description,
                 simulation_data=simulation_data,
-                aggregated_context=self.aggregated_context,
                 policy_data=policy_data,
                 custom_input=custom_input or {},
-                config=config or AgentConfig()
+                config=config or AgentConfig(),
+                **self._context_snapshot(aggregated_context, context_versions)
             )
             
             # Yield start event
@@ -176,7 +293,15 @@ class AgentOrchestrator:
             self.active_agents[agent_id] = agent
             
             # Stream tokens
-            async for token in agent.stream_execute():
+            async for token in self._stream_agent(handle, agent):
+                if isinstance(token, dict):
+                    yield {
+                        **token,
+                        "agent_id": agent_id,
+                        "agent_type": agent_type.value,
+                        "timestamp": datetime.utcnow().isoformat()
+                    }
+                    continue
                 yield {
                     "type": "stream",
                     "agent_id": agent_id,
@@ -186,20 +311,28 @@ class AgentOrchestrator:
                 }
             
             # Yield completion event
-            result = agent.result
-            self.completed_tasks[task.id] = {
-                "agent_id": agent_id,
-                "agent_type": agent_type.value,
-                "task": task.dict(),
-                "result": result,
-                "completed_at": datetime.utcnow().isoformat()
-            }
+            result = self._flag_approximate(agent, agent.result)
+            self._record_completed(task, agent, result)
             
             self._update_context(agent_type, result)
             
             if agent_id in self.active_agents:
                 del self.active_agents[agent_id]
             
+            # Agents catch their own LLM errors, so check what the agent reported
+            if agent.status == "failed":
+                yield {
+                    "type": "error",
+                    "agent_id": agent_id,
+                    "agent_type": agent_type.value,
+                    "task_id": task.id,
+                    "data": agent.error,
+                    "error": agent.error,
+                    "result": result,
+                    "timestamp": datetime.utcnow().isoformat()
+                }
+                return
+            
             yield {
                 "type": "complete",
                 "agent_id": agent_id,
@@ -208,6 +341,16 @@ class AgentOrchestrator:
                 "result": result,
                 "timestamp": datetime.utcnow().isoformat()
             }
+        
+        except AgentCancelledError:
+            self._record_cancelled(agent_id, agent_type, task, agent)
+            yield {
+                "type": "cancelled",
+                "agent_id": agent_id,
+                "agent_type": agent_type.value,
+                "data": f"{agent_type.value} agent cancelled",
+                "timestamp": datetime.utcnow().isoformat()
+            }
             
         except Exception as e:
             logger.error(f"Error streaming agent {agent_id}: {e}")
@@ -221,45 +364,226 @@ class AgentOrchestrator:
                 "error": str(e),
                 "timestamp": datetime.utcnow().isoformat()
             }
+        finally:
+            self._finish_run(handle)
+    
+    def cancel(self, agent_id: str) -> bool:
+        """
+        Cancel a queued or running agent in this session
+        Running agents have their LLM stream closed; the run then records a
+        cancelled status and frees its scheduler slot. Every run in the
+        session with this ID is cancelled.
+        
+        Returns:
+            False if no run with this ID is in progress
+        """
+        handles = self._runs.get(agent_id)
+        if not handles:
+            return False
+        
+        logger.info(f"Cancelling agent {agent_id} in session {self.session_id}")
+        for handle in list(handles):
+            handle.cancel()
+        return True
+    
+    def _register_run(
+        self,
+        agent_id: str,
+        agent_type: AgentType,
+        ticket: Optional[ExecutionTicket],
+        priority: str = DEFAULT_PRIORITY
+    ) -> "RunHandle":
+        if ticket is None:
+            ticket = self.scheduler.reserve(agent_id, agent_type, bounded=False, priority=priority)
+        handle = RunHandle(agent_id, ticket)
+        self._runs.setdefault(agent_id, []).append(handle)
+        self._inflight += 1
+        return handle
+    
+    def _finish_run(self, handle: "RunHandle"):
+        if handle.worker is not None and not handle.worker.done():
+            handle.worker.cancel()
+        handles = self._runs.get(handle.agent_id, [])
+        if handle in handles:
+            handles.remove(handle)
+        if not handles:
+            self._runs.pop(handle.agent_id, None)
+        self._inflight -= 1
+        self.last_used = time.monotonic()
+        self.scheduler.release(handle.ticket)
+    
+    def _check_cancelled(self, handle: "RunHandle"):
+        if handle.cancel_requested:
+            raise AgentCancelledError(f"Agent {handle.agent_id} was cancelled")
+    
+    async def _run_worker(self, handle: "RunHandle", coro) -> Any:
+        """
+        Await a coroutine in its own task so cancel() can stop it
+        without cancelling the caller
+        """
+        handle.worker = asyncio.ensure_future(coro)
+        try:
+            return await handle.worker
+        except asyncio.CancelledError:
+            if handle.cancel_requested and handle.worker.cancelled():
+                raise AgentCancelledError(f"Agent {handle.agent_id} was cancelled")
+            raise
+    
+    async def _stream_agent(self, handle: "RunHandle", agent: Any) -> AsyncGenerator[Any, None]:
+        """
+        Stream an agent's tokens from a worker task that cancel() can stop
+        
+        The worker only drives stream_execute; tokens are read back from the
+        agent's output buffer, so other readers can follow the same run
+        through agent.output.cursor() without another copy.
+        
+        Yields token strings, and the agent's emit() events as dicts right
+        after the token that was streamed before them.
+        """
+        async def drive():
+            async for _ in agent.stream_execute():
+                pass
+        
+        worker = asyncio.ensure_future(drive())
+        # A worker cancelled before it starts never reaches stream_execute's cleanup
+        worker.add_done_callback(lambda _: agent.output.close())
+        handle.worker = worker
+        streamed = 0
+        events_sent = 0
+        try:
+            async for token in agent.output.cursor():
+                yield token
+                streamed += 1
+                while events_sent < len(agent.stream_events) and agent.stream_events[events_sent][0] <= streamed:
+                    yield agent.stream_events[events_sent][1]
+                    events_sent += 1
+            await worker
+            # Events emitted while post-processing
+            for _, event in agent.stream_events[events_sent:]:
+                yield event
+        except asyncio.CancelledError:
+            if handle.cancel_requested and worker.cancelled():
+                raise AgentCancelledError(f"Agent {handle.agent_id} was cancelled")
+            raise
+        finally:
+            if not worker.done():
+                worker.cancel()
     
     async def execute_agent_chain(
         self,
         agents: List[Dict[str, Any]],
         simulation_data: Optional[Dict[str, Any]] = None,
-        policy_data: Optional[Dict[str, Any]] = None
+        policy_data: Optional[Dict[str, Any]] = None,
+        priority: str = "chain",
+        chain_id: Optional[str] = None,
+        resume: bool = False
     ) -> List[Dict[str, Any]]:
         """
-        Execute multiple agents in sequence, passing context between them
+        Execute multiple agents, passing context between them
+        
+        By default agents run in sequence and each one sees the full
+        aggregated context. If any entry declares ``depends_on`` (a list of
+        agent_ids from the same chain), the chain is run as a dependency graph
+        instead: agents whose dependencies have completed run concurrently and
+        each agent only sees the results of its own dependencies.
+        
+        With a chain_id, each successful step is checkpointed under a hash of
+        its inputs and upstream results. Running the chain again with
+        resume=True reuses every step whose checkpoint still matches, so only
+        the failed step and those after it are executed.
         
         Args:
             agents: List of agent configurations with type, description, etc.
             simulation_data: Initial simulation data
             policy_data: Policy documents
+            priority: Scheduler priority class for the chain's agents. An
+                entry's config.extra["priority"] overrides it.
+            chain_id: Identifier to checkpoint the chain under
+            resume: Reuse matching checkpoints from earlier runs of chain_id
             
         Returns:
-            List of results from each agent
+            List of results from each agent. Steps restored from a checkpoint
+            have "resumed": True.
+        
+        Raises:
+            SchedulerFullError: If the scheduler's queue is full. The chain is
+                admitted once, here; its steps then queue without a limit.
         """
+        self.scheduler.admit()
+        
+        # Clients choose chain ids, so each session checkpoints under its own namespace
+        checkpoint_id = self._checkpoint_id(chain_id) if chain_id else None
+        if checkpoint_id:
+            self.checkpoints.save_chain(checkpoint_id, {
+                "agents": agents,
+                "simulation_data": simulation_data,
+                "policy_data": policy_data
+            })
+        
+        # Every step gets the same inputs, so they are serialized once per chain run
+        run_id = uuid.uuid4().hex[:12]
+        versions = {"simulation_data": f"{run_id}:simulation_data", "policy_data": f"{run_id}:policy_data"}
+        
+        if any("depends_on" in agent_config for agent_config in agents):
+            results = await self._execute_agent_graph(
+                agents, simulation_data, policy_data, priority, checkpoint_id, resume, versions
+            )
+        else:
+            results = await self._execute_agent_sequence(
+                agents, simulation_data, policy_data, priority, checkpoint_id, resume, versions
+            )
+        
+        if checkpoint_id:
+            succeeded = len(results) == len(agents) and all(result["success"] for result in results)
+            self.checkpoints.set_chain_status(checkpoint_id, "completed" if succeeded else "failed")
+        
+        return results
+    
+    def get_chain(self, chain_id: str) -> Optional[Dict[str, Any]]:
+        """Get a chain run in this session - its request and status - for resuming it"""
+        chain = self.checkpoints.get_chain(self._checkpoint_id(chain_id))
+        return {**chain, "chain_id": chain_id} if chain else None
+    
+    def _checkpoint_id(self, chain_id: str) -> str:
+        return f"{self.session_id}:{chain_id}"
+    
+    async def _execute_agent_sequence(
+        self,
+        agents: List[Dict[str, Any]],
+        simulation_data: Optional[Dict[str, Any]],
+        policy_data: Optional[Dict[str, Any]],
+        priority: str,
+        chain_id: Optional[str],
+        resume: bool,
+        context_versions: Optional[Dict[str, str]] = None
+    ) -> List[Dict[str, Any]]:
+        """Execute a chain one agent at a time, stopping at the first failure"""
+        # Parse every entry up front so a bad entry fails before any agent runs
+        entries = [self._parse_chain_entry(i, agent_config) for i, agent_config in enumerate(agents)]
         results = []
         
-        for i, agent_config in enumerate(agents):
-            agent_id = agent_config.get("agent_id", f"chain-agent-{i}")
-            agent_type = AgentType(agent_config["agent_type"])
-            description = agent_config["description"]
-            custom_input = agent_config.get("custom_input", {})
-            config = agent_config.get("config")
-            
-            if config and not isinstance(config, AgentConfig):
-                config = AgentConfig(**config)
-            
-            result = await self.execute_agent(
-                agent_id=agent_id,
-                agent_type=agent_type,
-                task_description=description,
-                simulation_data=simulation_data,
-                policy_data=policy_data,
-                custom_input=custom_input,
-                config=config
+        for agent_id, agent_type, description, custom_input, config in entries:
+            key = step_key(
+                agent_type, description, custom_input, config, simulation_data, policy_data,
+                [result.get("result") for result in results]
+            )
+            result = await self._run_chain_step(
+                chain_id, resume, key, agent_id, agent_type,
+                lambda: self.execute_agent(
+                    agent_id=agent_id,
+                    agent_type=agent_type,
+                    task_description=description,
+                    simulation_data=simulation_data,
+                    policy_data=policy_data,
+                    custom_input=custom_input,
+                    config=config,
+                    priority=priority,
+                    context_versions=context_versions
+                )
             )
+            if result.get("resumed"):
+                # Later steps read the shared context, so restore this step's contribution
+                self._update_context(agent_type, result["result"])
             
             results.append(result)
             
@@ -270,21 +594,297 @@ class AgentOrchestrator:
         
         return results
     
+    async def _execute_agent_graph(
+        self,
+        agents: List[Dict[str, Any]],
+        simulation_data: Optional[Dict[str, Any]],
+        policy_data: Optional[Dict[str, Any]],
+        priority: str = "chain",
+        chain_id: Optional[str] = None,
+        resume: bool = False,
+        context_versions: Optional[Dict[str, str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Execute a chain as a dependency graph
+        
+        Every agent starts as soon as all of its dependencies have succeeded,
+        so the chain takes as long as its critical path. Agents downstream of
+        a failed agent are skipped rather than run with missing context.
+        """
+        nodes = self._build_agent_graph(agents)
+        graph_id = uuid.uuid4().hex[:12]
+        pending = dict(nodes)
+        results: Dict[str, Dict[str, Any]] = {}
+        completed_at: Dict[str, str] = {}
+        running: Dict[asyncio.Task, str] = {}
+        
+        try:
+            while pending or running:
+                # Start every agent whose dependencies have all settled.
+                # Skipping one agent can settle others, so repeat until stable.
+                progressed = True
+                while progressed:
+                    progressed = False
+                    for agent_id, node in list(pending.items()):
+                        if not all(dep in results for dep in node["depends_on"]):
+                            continue
+                        
+                        del pending[agent_id]
+                        progressed = True
+                        
+                        failed_deps = [dep for dep in node["depends_on"] if not results[dep]["success"]]
+                        if failed_deps:
+                            logger.warning(f"Skipping agent {agent_id}: dependencies failed: {failed_deps}")
+                            results[agent_id] = {
+                                "success": False,
+                                "agent_id": agent_id,
+                                "agent_type": node["agent_type"],
+                                "error": f"Skipped because dependencies failed: {', '.join(failed_deps)}",
+                                "status": "skipped"
+                            }
+                            continue
+                        
+                        context = self._dependency_context(node["depends_on"], nodes, results, completed_at)
+                        # Settled dependencies never change, so agents sharing them share a version
+                        versions = {
+                            **(context_versions or {}),
+                            "aggregated_context": f"{graph_id}:{','.join(node['depends_on'])}"
+                        }
+                        key = step_key(
+                            node["agent_type"], node["description"], node["custom_input"], node["config"],
+                            simulation_data, policy_data,
+                            [results[dep].get("result") for dep in node["depends_on"]]
+                        )
+                        task = asyncio.create_task(self._run_chain_step(
+                            chain_id, resume, key, agent_id, node["agent_type"],
+                            lambda agent_id=agent_id, node=node, context=context, versions=versions: self.execute_agent(
+                                agent_id=agent_id,
+                                agent_type=node["agent_type"],
+                                task_description=node["description"],
+                                simulation_data=simulation_data,
+                                policy_data=policy_data,
+                                custom_input=node["custom_input"],
+                                config=node["config"],
+                                aggregated_context=context,
+                                priority=priority,
+                                context_versions=versions
+                            )
+                        ))
+                        running[task] = agent_id
+                
+                if not running:
+                    break
+                
+                done, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    agent_id = running.pop(task)
+                    results[agent_id] = task.result()
+                    completed_at[agent_id] = datetime.utcnow().isoformat()
+        finally:
+            for task in running:
+                task.cancel()
+        
+        return [results[agent_id] for agent_id in nodes if agent_id in results]
+    
+    async def _run_chain_step(
+        self,
+        chain_id: Optional[str],
+        resume: bool,
+        key: str,
+        agent_id: str,
+        agent_type: AgentType,
+        run: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        """Return a step's checkpointed result when resuming, otherwise run it and checkpoint success"""
+        if chain_id and resume:
+            checkpoint = self.checkpoints.get(chain_id, key)
+            if checkpoint is not None:
+                logger.info(f"Reusing checkpoint for agent {agent_id} of chain {chain_id}")
+                return {**checkpoint, "agent_type": agent_type, "resumed": True}
+        
+        result = await run()
+        if chain_id and result["success"]:
+            self.checkpoints.put(chain_id, key, result)
+        return result
+    
+    def _parse_chain_entry(self, index: int, agent_config: Dict[str, Any]):
+        """Read agent_id, type, description, custom_input and config from a chain entry"""
+        agent_id = agent_config.get("agent_id", f"chain-agent-{index}")
+        agent_type = AgentType(agent_config["agent_type"])
+        description = agent_config["description"]
+        custom_input = agent_config.get("custom_input", {})
+        config = agent_config.get("config")
+        
+        if config and not isinstance(config, AgentConfig):
+            config = AgentConfig(**config)
+        resolve_priority(config)  # reject an unknown priority before the chain starts
+        
+        return agent_id, agent_type, description, custom_input, config
+    
+    def _build_agent_graph(self, agents: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Build the dependency graph for a chain, keyed by agent_id in chain order
+        
+        Raises:
+            ValueError: On duplicate agent_ids, unknown dependencies or cycles
+        """
+        nodes: Dict[str, Dict[str, Any]] = {}
+        
+        for i, agent_config in enumerate(agents):
+            agent_id, agent_type, description, custom_input, config = self._parse_chain_entry(i, agent_config)
+            if agent_id in nodes:
+                raise ValueError(f"Duplicate agent_id in chain: {agent_id}")
+            
+            depends_on = agent_config.get("depends_on") or []
+            if isinstance(depends_on, str):
+                depends_on = [depends_on]
+            
+            nodes[agent_id] = {
+                "agent_type": agent_type,
+                "description": description,
+                "custom_input": custom_input,
+                "config": config,
+                "depends_on": list(dict.fromkeys(depends_on)),
+            }
+        
+        for agent_id, node in nodes.items():
+            for dep in node["depends_on"]:
+                if dep not in nodes:
+                    raise ValueError(f"Agent {agent_id} depends on unknown agent: {dep}")
+        
+        # Kahn's algorithm - anything left unvisited is part of a cycle
+        remaining = {agent_id: len(node["depends_on"]) for agent_id, node in nodes.items()}
+        ready = [agent_id for agent_id, count in remaining.items() if count == 0]
+        visited = 0
+        while ready:
+            current = ready.pop()
+            visited += 1
+            for agent_id, node in nodes.items():
+                if current in node["depends_on"]:
+                    remaining[agent_id] -= 1
+                    if remaining[agent_id] == 0:
+                        ready.append(agent_id)
+        
+        if visited != len(nodes):
+            cyclic = [agent_id for agent_id, count in remaining.items() if count > 0]
+            raise ValueError(f"Dependency cycle between agents: {cyclic}")
+        
+        return nodes
+    
+    def _dependency_context(
+        self,
+        depends_on: List[str],
+        nodes: Dict[str, Dict[str, Any]],
+        results: Dict[str, Dict[str, Any]],
+        completed_at: Dict[str, str]
+    ) -> Dict[str, Any]:
+        """Build an aggregated context containing only the given dependencies' results"""
+        context: Dict[str, Any] = {}
+        
+        for dep in depends_on:
+            context_key = f"{nodes[dep]['agent_type'].value}_results"
+            context.setdefault(context_key, []).append({
+                "timestamp": completed_at.get(dep),
+                "agent_id": dep,
+                "result": results[dep].get("result")
+            })
+        
+        return context
+    
+    def _flag_approximate(self, agent: Any, result: Any) -> Any:
+        """Mark results served from a near-duplicate prompt's cached response"""
+        if agent.execution_stats.get("cache") != "approximate" or not isinstance(result, dict):
+            return result
+        return {**result, "approximate": True, "similarity": agent.execution_stats["similarity"]}
+    
+    def _record_completed(self, task: AgentTask, agent: Any, result: Optional[Dict[str, Any]]):
+        """Store a finished task and count it in the running statistics"""
+        entry = {
+            "agent_id": task.agent_id,
+            "agent_type": task.agent_type.value,
+            "task": task.dict(exclude={"aggregated_context"}),
+            "result": result,
+            "execution": agent.execution_stats,
+            "completed_at": datetime.utcnow().isoformat()
+        }
+        self.completed_tasks[task.id] = entry
+        self.stats.record(agent_type_name(task.agent_type), task_outcome(entry))
+    
+    def _record_cancelled(
+        self,
+        agent_id: str,
+        agent_type: AgentType,
+        task: Optional[AgentTask],
+        agent: Optional[Any]
+    ):
+        """Record a cancelled run; runs cancelled while still queued have no task to store"""
+        if agent_id in self.active_agents:
+            del self.active_agents[agent_id]
+        
+        if task is not None:
+            task.status = "cancelled"
+            self.completed_tasks[task.id] = {
+                "agent_id": agent_id,
+                "agent_type": agent_type.value,
+                "task": task.dict(exclude={"aggregated_context"}),
+                "result": None,
+                "status": "cancelled",
+                "execution": agent.execution_stats if agent is not None else None,
+                "completed_at": datetime.utcnow().isoformat()
+            }
+        self.stats.record(agent_type.value, "cancelled")
+        logger.info(f"Agent {agent_id} cancelled")
+    
     def _update_context(self, agent_type: AgentType, result: Dict[str, Any]):
-        """Update aggregated context with agent results"""
+        """
+        Update aggregated context with agent results
+        Lists are replaced rather than appended to, so snapshots handed to
+        running agents keep matching the version they were taken at.
+        """
         context_key = f"{agent_type.value}_results"
         
-        if context_key not in self.aggregated_context:
-            self.aggregated_context[context_key] = []
-        
-        self.aggregated_context[context_key].append({
+        entry = {
             "timestamp": datetime.utcnow().isoformat(),
             "result": result
-        })
+        }
         
         # Keep only last 10 results per agent type to manage context size
-        if len(self.aggregated_context[context_key]) > 10:
-            self.aggregated_context[context_key] = self.aggregated_context[context_key][-10:]
+        self.aggregated_context[context_key] = (self.aggregated_context.get(context_key, []) + [entry])[-10:]
+        self._context_entry_sizes[context_key] = (
+            self._context_entry_sizes.get(context_key, []) + [len(json.dumps(entry, default=str))]
+        )[-10:]
+        self.context_version += 1
+    
+    def _context_snapshot(
+        self,
+        aggregated_context: Optional[Dict[str, Any]],
+        context_versions: Optional[Dict[str, str]]
+    ) -> Dict[str, Any]:
+        """AgentTask fields for the context an agent sees: its data and version tokens"""
+        versions = dict(context_versions or {})
+        if aggregated_context is None:
+            aggregated_context = dict(self.aggregated_context)
+            versions["aggregated_context"] = f"{self._context_id}:{self.context_version}"
+        return {"aggregated_context": aggregated_context, "context_versions": versions}
+    
+    def _context_size(self) -> int:
+        """
+        Size of json.dumps(aggregated_context), from the cached entry sizes
+        Costs one step per agent type rather than re-serializing the context.
+        """
+        if not self._context_entry_sizes:
+            return 2  # "{}"
+        
+        size = 2 + 2 * (len(self._context_entry_sizes) - 1)  # braces and ", " between keys
+        for context_key, entry_sizes in self._context_entry_sizes.items():
+            # "key": [entry, entry]
+            size += len(json.dumps(context_key)) + 2 + 2 + sum(entry_sizes) + 2 * max(len(entry_sizes) - 1, 0)
+        return size
+    
+    def record_external_result(self, agent_type: AgentType, result: Dict[str, Any]):
+        """Fold a result produced outside this orchestrator (e.g. by a queue worker) into the context"""
+        self._update_context(agent_type, result)
+        self.last_used = time.monotonic()
     
     def get_context(self) -> Dict[str, Any]:
         """Get current aggregated context"""
@@ -294,48 +894,133 @@ class AgentOrchestrator:
         """Get list of currently active agent IDs"""
         return list(self.active_agents.keys())
     
-    def get_completed_tasks(self) -> Dict[str, Any]:
-        """Get all completed tasks"""
-        return self.completed_tasks
+    def get_completed_tasks(self, limit: Optional[int] = None) -> Dict[str, Any]:
+        """Get completed tasks, most recent first, including ones spilled to disk"""
+        return self.completed_tasks.to_dict(limit)
     
     def clear_context(self):
         """Clear aggregated context"""
         self.aggregated_context = {}
+        self._context_entry_sizes = {}
+        self.context_version += 1
         logger.info("Cleared aggregated context")
     
     def get_stats(self) -> Dict[str, Any]:
-        """Get orchestrator statistics"""
-        agent_type_counts = {}
-        success_count = 0
-        failure_count = 0
-        
-        for task_data in self.completed_tasks.values():
-            agent_type = task_data["agent_type"]
-            agent_type_counts[agent_type] = agent_type_counts.get(agent_type, 0) + 1
-            
-            # Check if task was successful
-            if task_data.get("result") and task_data["result"].get("success", True):
-                success_count += 1
-            else:
-                failure_count += 1
-        
+        """Get orchestrator statistics - O(1), read from counters kept up to date on completion"""
         return {
             "active_agents": len(self.active_agents),
-            "completed_tasks": len(self.completed_tasks),
-            "success_count": success_count,
-            "failure_count": failure_count,
-            "agent_type_counts": agent_type_counts,
-            "context_size": len(json.dumps(self.aggregated_context))
+            "completed_tasks": self.stats.total,
+            "session_id": self.session_id,
+            "success_count": self.stats.success_count,
+            "failure_count": self.stats.failure_count,
+            "cancelled_count": self.stats.cancelled_count,
+            "agent_type_counts": dict(self.stats.agent_type_counts),
+            "rolling": self.stats.rolling(),
+            "context_size": self._context_size(),
+            "scheduler": self.scheduler.get_stats(),
+            "task_store": self.completed_tasks.get_stats(),
+            "chain_checkpoints": self.checkpoints.get_stats(),
+            "response_cache": get_response_cache().get_stats(),
+            "similarity_cache": get_similarity_cache().get_stats(),
+            "llm_client_pool": get_client_pool().get_stats(),
+            "prefix_cache": get_prefix_cache().get_stats(),
+            "context_fragments": get_fragment_cache().get_stats()
         }
 
 
-# Global orchestrator instance
-_orchestrator = None
+class OrchestratorRegistry:
+    """
+    Per-session orchestrators, created lazily and evicted when idle
+    
+    Each session gets its own aggregated context and task history, so prompt
+    sizes follow one user's work rather than the whole server's. All sessions
+    share one scheduler because Gemini capacity is per process.
+    """
+    
+    def __init__(
+        self,
+        idle_ttl_seconds: Optional[float] = None,
+        scheduler: Optional[ExecutionScheduler] = None
+    ):
+        self.idle_ttl_seconds = idle_ttl_seconds or float(os.getenv("SESSION_IDLE_TTL_SECONDS", "1800"))
+        self.scheduler = scheduler or ExecutionScheduler()
+        self.checkpoints = ChainCheckpointStore()
+        self._orchestrators: Dict[str, AgentOrchestrator] = {}
+    
+    def get(self, session_id: Optional[str] = None) -> AgentOrchestrator:
+        """Get the orchestrator for a session, creating it on first use"""
+        session_id = session_id or DEFAULT_SESSION
+        self.evict_idle()
+        
+        orchestrator = self._orchestrators.get(session_id)
+        if orchestrator is None:
+            orchestrator = AgentOrchestrator(
+                session_id=session_id,
+                scheduler=self.scheduler,
+                checkpoints=self.checkpoints
+            )
+            self._orchestrators[session_id] = orchestrator
+            logger.info(f"Created orchestrator for session {session_id} (shard key {session_hash(session_id)[:12]})")
+        
+        orchestrator.last_used = time.monotonic()
+        return orchestrator
+    
+    def evict_idle(self):
+        """Drop orchestrators with no in-flight runs that haven't been used within the idle TTL"""
+        now = time.monotonic()
+        for session_id, orchestrator in list(self._orchestrators.items()):
+            if orchestrator._inflight or now - orchestrator.last_used < self.idle_ttl_seconds:
+                continue
+            
+            # Task history survives in the spill store under the session's namespace
+            orchestrator.completed_tasks.close()
+            del self._orchestrators[session_id]
+            logger.info(f"Evicted idle orchestrator for session {session_id}")
+    
+    def sessions(self) -> List[str]:
+        return list(self._orchestrators.keys())
+    
+    def cancel(self, agent_id: str, session_id: Optional[str] = None) -> bool:
+        """Cancel a run in one session; other sessions' runs with the same ID are left alone"""
+        orchestrator = self._orchestrators.get(session_id or DEFAULT_SESSION)
+        return orchestrator is not None and orchestrator.cancel(agent_id)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get registry-wide statistics"""
+        return {
+            "sessions": len(self._orchestrators),
+            "active_agents": sum(len(o.active_agents) for o in self._orchestrators.values()),
+            "completed_tasks": sum(o.stats.total for o in self._orchestrators.values()),
+            "idle_ttl_seconds": self.idle_ttl_seconds,
+            "scheduler": self.scheduler.get_stats(),
+            "response_cache": get_response_cache().get_stats(),
+            "similarity_cache": get_similarity_cache().get_stats(),
+            "llm_client_pool": get_client_pool().get_stats(),
+            "prefix_cache": get_prefix_cache().get_stats(),
+            "context_fragments": get_fragment_cache().get_stats()
+        }
+
+
+def session_hash(session_id: str) -> str:
+    """Stable hash of a session ID - identical across processes and restarts"""
+    return hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+
+
+def session_shard(session_id: str, num_shards: int) -> int:
+    """Route a session to one of num_shards workers"""
+    return int(session_hash(session_id)[:16], 16) % num_shards
+
+
+# Global registry of per-session orchestrators
+_registry = None
 
-def get_orchestrator() -> AgentOrchestrator:
-    """Get or create global orchestrator instance"""
-    global _orchestrator
-    if _orchestrator is None:
-        _orchestrator = AgentOrchestrator()
-    return _orchestrator
+def get_registry() -> OrchestratorRegistry:
+    """Get or create the global orchestrator registry"""
+    global _registry
+    if _registry is None:
+        _registry = OrchestratorRegistry()
+    return _registry
 
+def get_orchestrator(session_id: Optional[str] = None) -> AgentOrchestrator:
+    """Get the orchestrator for a session (the shared default session if omitted)"""
+    return get_registry().get(session_id)
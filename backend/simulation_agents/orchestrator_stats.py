@@ -0,0 +1,70 @@
+"""
+Orchestrator Statistics
+Counters updated as tasks complete, so reading them is O(1)
+"""
+
+import time
+from collections import deque
+from typing import Dict, Any, Optional
+
+# Rolling windows reported by get_stats, in minutes
+ROLLING_WINDOWS = (1, 5, 15, 60)
+
+
+class OrchestratorStats:
+    """
+    Running totals, per-type tallies and per-minute outcome buckets
+
+    Buckets older than the largest rolling window are dropped as new ones are
+    added, so memory and read cost stay constant however long the server runs.
+    """
+
+    def __init__(
+        self,
+        agent_type_counts: Optional[Dict[str, int]] = None,
+        success_count: int = 0,
+        failure_count: int = 0,
+        cancelled_count: int = 0
+    ):
+        self.agent_type_counts: Dict[str, int] = dict(agent_type_counts or {})
+        self.success_count = success_count
+        self.failure_count = failure_count
+        self.cancelled_count = cancelled_count
+
+        # (minute, {outcome: count}), oldest first
+        self._minutes: deque = deque(maxlen=max(ROLLING_WINDOWS))
+
+    @property
+    def total(self) -> int:
+        return self.success_count + self.failure_count + self.cancelled_count
+
+    def record(self, agent_type: str, outcome: str):
+        """Count one finished task with outcome success, failure or cancelled"""
+        self.agent_type_counts[agent_type] = self.agent_type_counts.get(agent_type, 0) + 1
+        setattr(self, f"{outcome}_count", getattr(self, f"{outcome}_count") + 1)
+
+        minute = int(time.time() // 60)
+        if not self._minutes or self._minutes[-1][0] != minute:
+            self._minutes.append((minute, {"success": 0, "failure": 0, "cancelled": 0}))
+        self._minutes[-1][1][outcome] += 1
+
+    def rolling(self) -> Dict[str, Dict[str, Any]]:
+        """Outcome counts and success rate over each rolling window"""
+        now_minute = int(time.time() // 60)
+        windows = {}
+
+        for window in ROLLING_WINDOWS:
+            counts = {"success": 0, "failure": 0, "cancelled": 0}
+            for minute, minute_counts in self._minutes:
+                if now_minute - minute < window:
+                    for outcome, count in minute_counts.items():
+                        counts[outcome] += count
+
+            # Cancellations are the user's choice, not a failure of the agent
+            finished = counts["success"] + counts["failure"]
+            windows[f"last_{window}m"] = {
+                **counts,
+                "success_rate": round(counts["success"] / finished, 4) if finished else None
+            }
+
+        return windows
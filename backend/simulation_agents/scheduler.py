@@ -0,0 +1,292 @@
+"""
+Execution Scheduler
+Admission control and concurrency limits for agent runs
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Set
+
+from agent_types import AgentType
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, most urgent first
+PRIORITIES = ("interactive", "chain", "background")
+DEFAULT_PRIORITY = "interactive"
+
+# Recent wait times kept per priority class for latency percentiles
+WAIT_SAMPLE_SIZE = 500
+
+
+class SchedulerFullError(Exception):
+    """Raised when the wait queue is full and a run cannot be admitted"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ExecutionTicket:
+    """
+    A single run's place in the scheduler
+    Waits in the queue until granted a slot, then holds it until released
+    """
+
+    def __init__(self, agent_id: str, agent_type: AgentType, priority: str = DEFAULT_PRIORITY):
+        self.agent_id = agent_id
+        self.agent_type = agent_type
+        self.priority = priority
+        self.position: Optional[int] = None  # 1-based queue position while waiting
+        self.granted = False
+        self.released = False
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self._changed = asyncio.Event()
+
+    async def wait_for_update(self):
+        """Wait until the ticket is granted or its queue position changes"""
+        await self._changed.wait()
+        self._changed.clear()
+
+    def _notify(self):
+        self._changed.set()
+
+
+def resolve_priority(config: Any = None, default: str = DEFAULT_PRIORITY) -> str:
+    """
+    Priority class for a run: config.extra["priority"] if set, else the
+    caller's default (usually inferred from the endpoint)
+    
+    Raises:
+        ValueError: If the requested priority is not a known class
+    """
+    extra = getattr(config, "extra", None) or {}
+    priority = str(extra.get("priority") or default).lower()
+    if priority not in PRIORITIES:
+        raise ValueError(f"Invalid priority {priority!r}, expected one of: {', '.join(PRIORITIES)}")
+    return priority
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def parse_type_limits(spec: str) -> Dict[AgentType, int]:
+    """Parse per-type limits of the form 'SIMULATION=2,REPORT=3'"""
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, value = item.partition("=")
+        try:
+            limits[AgentType(name.strip().upper())] = int(value)
+        except ValueError:
+            logger.warning(f"Ignoring invalid agent type limit: {item!r}")
+    return limits
+
+
+class ExecutionScheduler:
+    """
+    Caps the number of concurrently running agents, globally and per agent type
+
+    Runs that can't start immediately wait in a bounded queue, ordered by
+    priority class (interactive, then chain, then background) and FIFO within
+    a class. A waiting run is passed over (but keeps its place) while its type
+    is at its limit, so one saturated agent type doesn't block the others.
+    
+    To keep lower classes from starving under sustained interactive load, a
+    waiting run is promoted one class for every aging_seconds it has waited.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        type_limits: Optional[Dict[AgentType, int]] = None,
+        aging_seconds: Optional[float] = None
+    ):
+        self.max_concurrent = max_concurrent or int(os.getenv("AGENT_MAX_CONCURRENT", "8"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("AGENT_MAX_QUEUE", "64"))
+        self.type_limits = (
+            type_limits if type_limits is not None
+            else parse_type_limits(os.getenv("AGENT_TYPE_LIMITS", ""))
+        )
+        self.aging_seconds = aging_seconds or float(os.getenv("AGENT_PRIORITY_AGING_SECONDS", "30"))
+
+        self._running: Set[ExecutionTicket] = set()  # Tickets, not ids - run ids aren't unique across sessions
+        self._running_by_type: Dict[AgentType, int] = {}
+        self._waiting: List[ExecutionTicket] = []
+
+        # Exponential moving average of run duration, used for Retry-After
+        self._avg_run_seconds = 30.0
+        self.rejected_count = 0
+        
+        # Queue wait (enqueue to grant) per priority class
+        self._wait_samples: Dict[str, deque] = {
+            priority: deque(maxlen=WAIT_SAMPLE_SIZE) for priority in PRIORITIES
+        }
+        self._granted_counts: Dict[str, int] = {priority: 0 for priority in PRIORITIES}
+        self._promoted_count = 0
+
+    @property
+    def queue_length(self) -> int:
+        return len(self._waiting)
+
+    def reserve(
+        self,
+        agent_id: str,
+        agent_type: AgentType,
+        bounded: bool = True,
+        priority: str = DEFAULT_PRIORITY
+    ) -> ExecutionTicket:
+        """
+        Admit a run and queue it for a slot
+
+        Args:
+            agent_id: Run identifier
+            agent_type: Type of agent, checked against its per-type limit
+            bounded: Reject when the queue is full. Pass False for work that
+                was already admitted (e.g. later steps of a chain).
+            priority: Priority class, one of PRIORITIES
+
+        Raises:
+            SchedulerFullError: If bounded and the queue is full
+        """
+        if bounded:
+            self.admit(agent_type)
+
+        if priority not in PRIORITIES:
+            raise ValueError(f"Invalid priority {priority!r}, expected one of: {', '.join(PRIORITIES)}")
+        
+        ticket = ExecutionTicket(agent_id, agent_type, priority)
+        self._waiting.append(ticket)
+        self._dispatch()
+        return ticket
+
+    def admit(self, agent_type: Optional[AgentType] = None):
+        """
+        Check that new work may enter: the queue has room, or agent_type could start now
+
+        Raises:
+            SchedulerFullError: If the queue is full
+        """
+        if len(self._waiting) < self.max_queue:
+            return
+        if agent_type is not None and self._can_start(agent_type):
+            return
+        self.rejected_count += 1
+        retry_after = self.estimate_retry_after()
+        raise SchedulerFullError(
+            f"Agent queue is full ({len(self._waiting)} waiting). Retry in {retry_after}s.",
+            retry_after
+        )
+
+    async def wait_for_slot(self, ticket: ExecutionTicket):
+        """Wait until the ticket holds a slot"""
+        while not ticket.granted:
+            await ticket.wait_for_update()
+
+    def release(self, ticket: ExecutionTicket):
+        """Give back a slot, or leave the queue if the ticket was never granted"""
+        if ticket.released:
+            return
+        ticket.released = True
+
+        if ticket.granted:
+            self._running.discard(ticket)
+            self._running_by_type[ticket.agent_type] -= 1
+            duration = time.monotonic() - ticket.started_at
+            self._avg_run_seconds = 0.8 * self._avg_run_seconds + 0.2 * duration
+        elif ticket in self._waiting:
+            self._waiting.remove(ticket)
+
+        self._dispatch()
+
+    def estimate_retry_after(self) -> int:
+        """Rough seconds until the current queue has drained enough to admit a run"""
+        waves = (len(self._waiting) + 1) / self.max_concurrent
+        return max(1, math.ceil(self._avg_run_seconds * waves))
+
+    def _can_start(self, agent_type: AgentType) -> bool:
+        if len(self._running) >= self.max_concurrent:
+            return False
+        limit = self.type_limits.get(agent_type)
+        return limit is None or self._running_by_type.get(agent_type, 0) < limit
+
+    def _effective_rank(self, ticket: ExecutionTicket, now: float) -> int:
+        """Priority rank after aging: one class better per aging_seconds waited"""
+        promotions = int((now - ticket.enqueued_at) // self.aging_seconds)
+        return max(0, PRIORITIES.index(ticket.priority) - promotions)
+
+    def _dispatch(self):
+        """Grant slots to waiting tickets in priority order, then refresh queue positions"""
+        now = time.monotonic()
+        # sort is stable, so tickets keep FIFO order within a rank
+        self._waiting.sort(key=lambda ticket: self._effective_rank(ticket, now))
+
+        for ticket in list(self._waiting):
+            if len(self._running) >= self.max_concurrent:
+                break
+            if not self._can_start(ticket.agent_type):
+                continue
+
+            self._waiting.remove(ticket)
+            ticket.granted = True
+            ticket.position = None
+            ticket.started_at = now
+            self._running.add(ticket)
+            self._running_by_type[ticket.agent_type] = self._running_by_type.get(ticket.agent_type, 0) + 1
+            self._wait_samples[ticket.priority].append(now - ticket.enqueued_at)
+            self._granted_counts[ticket.priority] += 1
+            if self._effective_rank(ticket, now) < PRIORITIES.index(ticket.priority):
+                self._promoted_count += 1
+            ticket._notify()
+
+        for position, ticket in enumerate(self._waiting, start=1):
+            if ticket.position != position:
+                ticket.position = position
+                ticket._notify()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get scheduler statistics"""
+        return {
+            "running": len(self._running),
+            "waiting": len(self._waiting),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "running_by_type": {
+                agent_type.value: count
+                for agent_type, count in self._running_by_type.items()
+                if count
+            },
+            "type_limits": {agent_type.value: limit for agent_type, limit in self.type_limits.items()},
+            "rejected_count": self.rejected_count,
+            "avg_run_seconds": round(self._avg_run_seconds, 2),
+            "aging_seconds": self.aging_seconds,
+            "promoted_count": self._promoted_count,
+            "priorities": self.get_priority_stats()
+        }
+
+    def get_priority_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-class queue depth and wait latency over recent grants"""
+        waiting_by_priority = {priority: 0 for priority in PRIORITIES}
+        for ticket in self._waiting:
+            waiting_by_priority[ticket.priority] += 1
+
+        stats = {}
+        for priority in PRIORITIES:
+            waits = sorted(self._wait_samples[priority])
+            stats[priority] = {
+                "waiting": waiting_by_priority[priority],
+                "granted": self._granted_counts[priority],
+                "wait_avg_seconds": round(sum(waits) / len(waits), 3) if waits else None,
+                "wait_p50_seconds": round(_percentile(waits, 0.5), 3) if waits else None,
+                "wait_p95_seconds": round(_percentile(waits, 0.95), 3) if waits else None,
+                "wait_max_seconds": round(waits[-1], 3) if waits else None
+            }
+        return stats
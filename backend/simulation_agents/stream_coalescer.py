@@ -0,0 +1,169 @@
+"""
+Stream Coalescer
+Merges consecutive stream events for a WebSocket client into fewer frames
+A run's first token is sent at once; later text is flushed every N ms or M bytes
+"""
+
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Defaults for clients that don't choose their own; 0 ms sends every token as its own frame
+DEFAULT_FLUSH_MS = float(os.getenv("WS_COALESCE_MS", "50"))
+DEFAULT_FLUSH_BYTES = int(os.getenv("WS_COALESCE_BYTES", "4096"))
+
+# Events that end a run - the run's next stream event counts as a first token again
+RUN_END_TYPES = ("complete", "cancelled", "error")
+
+
+class CoalescerStats:
+    """Counters shared by every client's coalescer"""
+
+    def __init__(self):
+        self.events_in = 0
+        self.frames_out = 0
+        self.bytes_out = 0
+        self.first_token_frames = 0
+        self.size_flushes = 0
+        self.timer_flushes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "stream_events": self.events_in,
+            "stream_frames": self.frames_out,
+            "frames_saved": self.events_in - self.frames_out,
+            "events_per_frame": round(self.events_in / self.frames_out, 2) if self.frames_out else None,
+            "stream_bytes": self.bytes_out,
+            "first_token_frames": self.first_token_frames,
+            "size_flushes": self.size_flushes,
+            "timer_flushes": self.timer_flushes
+        }
+
+
+class PendingFrame:
+    """Text of one run waiting to be sent, and the timer that will send it"""
+
+    def __init__(self, event: Dict[str, Any], timer: asyncio.Task):
+        self.event = event  # First buffered event; the frame keeps its other fields
+        self.parts: List[str] = []
+        self.bytes = 0
+        self.timestamp: Optional[str] = None
+        self.timer = timer
+
+
+class StreamCoalescer:
+    """
+    Per-client buffer between the event stream and the socket
+
+    "stream" events are merged into one frame per run (same fields, the text
+    of every merged event in "data", the last event's timestamp) and sent
+    once flush_ms have passed since the run's first buffered token or
+    flush_bytes of its text are waiting. Each run is buffered separately, so
+    runs streaming side by side don't flush each other. The first token of
+    each run skips the buffer so time-to-first-token is unchanged. Any other
+    event flushes its run's buffer first (every buffer if it has no
+    agent_id), so clients always see a run's events in order.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[Dict[str, Any]], Awaitable[None]],
+        flush_ms: Optional[float] = None,
+        flush_bytes: Optional[int] = None,
+        stats: Optional[CoalescerStats] = None
+    ):
+        self.send = send
+        self.stats = stats or CoalescerStats()
+        self.flush_ms = DEFAULT_FLUSH_MS
+        self.flush_bytes = DEFAULT_FLUSH_BYTES
+        self.configure(flush_ms, flush_bytes)
+
+        self._pending: Dict[Any, PendingFrame] = {}  # By agent_id
+        self._started: set = set()  # Runs whose first token has been sent
+        self._lock = asyncio.Lock()
+
+    def configure(self, flush_ms: Optional[float] = None, flush_bytes: Optional[int] = None):
+        """Set the flush interval and size; None keeps the current value. Raises ValueError on bad values"""
+        flush_ms = self.flush_ms if flush_ms is None else max(0.0, float(flush_ms))
+        flush_bytes = self.flush_bytes if flush_bytes is None else max(1, int(flush_bytes))
+        self.flush_ms, self.flush_bytes = flush_ms, flush_bytes
+
+    async def send_event(self, event: Dict[str, Any]):
+        async with self._lock:
+            if event.get("type") == "stream" and isinstance(event.get("data"), str):
+                await self._add(event)
+                return
+
+            agent_id = event.get("agent_id")
+            if agent_id is None:
+                await self._flush_all()
+            else:
+                await self._flush(agent_id)
+            if event.get("type") in RUN_END_TYPES:
+                self._started.discard(agent_id)
+            await self.send(event)
+
+    async def _add(self, event: Dict[str, Any]):
+        self.stats.events_in += 1
+        agent_id = event.get("agent_id")
+
+        if self.flush_ms <= 0 or agent_id not in self._started:
+            self._started.add(agent_id)
+            await self._flush(agent_id)
+            self.stats.first_token_frames += 1
+            await self._send_frame(event)
+            return
+
+        pending = self._pending.get(agent_id)
+        if pending is None:
+            timer = asyncio.ensure_future(self._flush_after(agent_id, self.flush_ms / 1000))
+            pending = self._pending[agent_id] = PendingFrame(event, timer)
+        pending.timestamp = event.get("timestamp")
+        pending.parts.append(event["data"])
+        pending.bytes += len(event["data"].encode("utf-8"))
+
+        if pending.bytes >= self.flush_bytes:
+            self.stats.size_flushes += 1
+            await self._flush(agent_id)
+
+    async def _flush_after(self, agent_id: Any, delay: float):
+        await asyncio.sleep(delay)
+        async with self._lock:
+            pending = self._pending.get(agent_id)
+            if pending is None or pending.timer is not asyncio.current_task():
+                return
+            self.stats.timer_flushes += 1
+            await self._flush(agent_id)
+
+    async def _flush(self, agent_id: Any):
+        pending = self._pending.pop(agent_id, None)
+        if pending is None:
+            return
+        if pending.timer is not asyncio.current_task():
+            pending.timer.cancel()
+
+        frame = {**pending.event, "data": "".join(pending.parts)}
+        if pending.timestamp is not None:
+            frame["timestamp"] = pending.timestamp
+        await self._send_frame(frame)
+
+    async def _flush_all(self):
+        for agent_id in list(self._pending):
+            await self._flush(agent_id)
+
+    async def _send_frame(self, frame: Dict[str, Any]):
+        self.stats.frames_out += 1
+        self.stats.bytes_out += len(frame["data"].encode("utf-8"))
+        await self.send(frame)
+
+    async def flush(self):
+        """Send any buffered text now"""
+        async with self._lock:
+            await self._flush_all()
+
+    def close(self):
+        """Drop buffered text; the client is gone"""
+        for pending in self._pending.values():
+            if pending.timer is not asyncio.current_task():
+                pending.timer.cancel()
+        self._pending = {}
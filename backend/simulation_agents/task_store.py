@@ -0,0 +1,319 @@
+"""
+Completed Task Store
+Bounded in-memory store for finished agent tasks with LRU/TTL eviction
+Evicted entries are spilled to a local SQLite database and stay readable
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPILL_PATH = os.path.join(os.path.dirname(__file__), '..', '.data', 'completed_tasks.db')
+
+_CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS completed_tasks (
+        task_id TEXT,
+        agent_type TEXT,
+        success INTEGER,  -- NULL for cancelled tasks
+        spilled_at REAL,
+        payload TEXT,
+        namespace TEXT DEFAULT 'default',
+        PRIMARY KEY (namespace, task_id)
+    )
+"""
+
+
+def agent_type_name(agent_type: Any) -> str:
+    """AgentType members and plain strings both map to the type's value"""
+    return getattr(agent_type, "value", agent_type)
+
+
+def task_succeeded(entry: Dict[str, Any]) -> bool:
+    """A completed task counts as successful unless its result is missing or reports failure"""
+    result = entry.get("result")
+    return bool(result) and bool(result.get("success", True))
+
+
+def task_outcome(entry: Dict[str, Any]) -> str:
+    """Classify a stored task as success, failure or cancelled"""
+    if entry.get("status") == "cancelled":
+        return "cancelled"
+    return "success" if task_succeeded(entry) else "failure"
+
+
+class CompletedTaskStore:
+    """
+    Dict-like store of completed tasks, keyed by task ID
+
+    Keeps the most recently used entries in memory, bounded by entry count,
+    total serialized size and age. Entries pushed out of memory are written to
+    SQLite (unless spill is disabled) and are still returned by get() and
+    items(), so callers don't need to know where an entry lives. Stores with
+    different namespaces can share one spill file without seeing each other's
+    tasks. Spill writes run in order on a writer thread, so storing a task
+    never blocks the event loop on disk.
+    """
+
+    def __init__(
+        self,
+        namespace: str = "default",
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        spill_path: Optional[str] = None,
+        disk_ttl_seconds: Optional[float] = None
+    ):
+        self.max_entries = max_entries or int(os.getenv("TASK_STORE_MAX_ENTRIES", "200"))
+        self.max_bytes = max_bytes or int(os.getenv("TASK_STORE_MAX_BYTES", str(50 * 1024 * 1024)))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("TASK_STORE_TTL_SECONDS", "3600"))
+        self.disk_ttl_seconds = disk_ttl_seconds or float(os.getenv("TASK_STORE_DISK_TTL_SECONDS", str(7 * 24 * 3600)))
+        self.namespace = namespace
+
+        # task_id -> (stored_at, serialized size in bytes, entry)
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self._bytes = 0
+        self.evicted_count = 0
+
+        spill_path = spill_path if spill_path is not None else os.getenv("TASK_STORE_PATH", DEFAULT_SPILL_PATH)
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_entries = 0
+        self._lock = threading.Lock()  # Guards the connection, shared with the writer thread
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-spill")
+        self._spilling: Dict[str, Dict[str, Any]] = {}  # Evicted entries not yet written to disk
+        if spill_path:
+            try:
+                self._db = self._open_db(spill_path)
+                self._disk_entries = self._db.execute(
+                    "SELECT COUNT(*) FROM completed_tasks WHERE namespace = ?", (self.namespace,)
+                ).fetchone()[0]
+            except sqlite3.Error as e:
+                logger.error(f"Could not open task spill store at {spill_path}, evicted tasks will be dropped: {e}")
+
+    def _open_db(self, path: str) -> sqlite3.Connection:
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute(_CREATE_TABLE)
+        # Older files key tasks by task_id alone, so sessions overwrite each other's; rebuild them
+        columns = {row[1]: row[5] for row in db.execute("PRAGMA table_info(completed_tasks)")}
+        if not columns.get("namespace"):
+            namespace = "COALESCE(namespace, 'default')" if "namespace" in columns else "'default'"
+            db.execute("ALTER TABLE completed_tasks RENAME TO completed_tasks_old")
+            db.execute(_CREATE_TABLE)
+            db.execute(
+                "INSERT OR REPLACE INTO completed_tasks (task_id, agent_type, success, spilled_at, payload, namespace) "
+                f"SELECT task_id, agent_type, success, spilled_at, payload, {namespace} FROM completed_tasks_old"
+            )
+            db.execute("DROP TABLE completed_tasks_old")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_completed_tasks_namespace ON completed_tasks (namespace, spilled_at)")
+        db.commit()
+        return db
+
+    def __setitem__(self, task_id: str, entry: Dict[str, Any]):
+        self.put(task_id, entry)
+
+    def __getitem__(self, task_id: str) -> Dict[str, Any]:
+        entry = self.get(task_id)
+        if entry is None:
+            raise KeyError(task_id)
+        return entry
+
+    def __contains__(self, task_id: str) -> bool:
+        return self.get(task_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._entries) + len(self._spilling) + self._disk_entries
+
+    def put(self, task_id: str, entry: Dict[str, Any]):
+        """Store a completed task, evicting older entries if over budget"""
+        size = len(json.dumps(entry, default=str))
+
+        if task_id in self._entries:
+            self._bytes -= self._entries.pop(task_id)[1]
+        self._entries[task_id] = (time.time(), size, entry)
+        self._bytes += size
+
+        self._evict()
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Get a task from memory, falling back to the spill store"""
+        if task_id in self._entries:
+            self._entries.move_to_end(task_id)
+            return self._entries[task_id][2]
+
+        entry = self._spilling.get(task_id)
+        if entry is not None or self._db is None:
+            return entry
+        with self._lock:
+            row = self._db.execute(
+                "SELECT payload FROM completed_tasks WHERE task_id = ? AND namespace = ?",
+                (task_id, self.namespace)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def items(self, limit: Optional[int] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Iterate tasks, most recent first: in-memory entries, then spilled ones"""
+        seen = set()
+        for task_id in reversed(list(self._entries.keys())):
+            if limit is not None and len(seen) >= limit:
+                return
+            yield task_id, self._entries[task_id][2]
+            seen.add(task_id)
+
+        for task_id, entry in reversed(list(self._spilling.items())):
+            if limit is not None and len(seen) >= limit:
+                return
+            if task_id not in seen:
+                yield task_id, entry
+                seen.add(task_id)
+
+        if self._db is None:
+            return
+        query = "SELECT task_id, payload FROM completed_tasks WHERE namespace = ? ORDER BY spilled_at DESC LIMIT ?"
+        with self._lock:
+            # Read the rows at once, as the writer thread shares the connection
+            rows = self._db.execute(query, (self.namespace, -1 if limit is None else limit + len(seen))).fetchall()
+        for task_id, payload in rows:
+            if limit is not None and len(seen) >= limit:
+                return
+            if task_id not in seen:
+                yield task_id, json.loads(payload)
+                seen.add(task_id)
+
+    def values(self) -> Iterator[Dict[str, Any]]:
+        for _, entry in self.items():
+            yield entry
+
+    def to_dict(self, limit: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+        return dict(self.items(limit))
+
+    def counts(self) -> Tuple[Dict[str, int], int, int, int]:
+        """
+        Get per-type counts and success/failure/cancelled totals across memory and disk
+        Spilled entries are counted in SQL without loading their payloads.
+        """
+        agent_type_counts: Dict[str, int] = {}
+        outcomes = {"success": 0, "failure": 0, "cancelled": 0}
+
+        rows = []
+        with self._lock:
+            # Snapshot the unwritten entries under the lock so none is counted twice
+            entries = [entry for _, _, entry in self._entries.values()] + list(self._spilling.values())
+            if self._db is not None:
+                rows = self._db.execute(
+                    "SELECT agent_type, success, COUNT(*) FROM completed_tasks "
+                    "WHERE namespace = ? GROUP BY agent_type, success",
+                    (self.namespace,)
+                ).fetchall()
+
+        for entry in entries:
+            agent_type = agent_type_name(entry["agent_type"])
+            agent_type_counts[agent_type] = agent_type_counts.get(agent_type, 0) + 1
+            outcomes[task_outcome(entry)] += 1
+
+        for agent_type, success, count in rows:
+            agent_type_counts[agent_type] = agent_type_counts.get(agent_type, 0) + count
+            if success is None:
+                outcomes["cancelled"] += count
+            elif success:
+                outcomes["success"] += count
+            else:
+                outcomes["failure"] += count
+
+        return agent_type_counts, outcomes["success"], outcomes["failure"], outcomes["cancelled"]
+
+    def _evict(self):
+        """Spill expired entries, then least recently used ones until within budget"""
+        now = time.time()
+        expired = [
+            task_id for task_id, (stored_at, _, _) in self._entries.items()
+            if now - stored_at >= self.ttl_seconds
+        ]
+        for task_id in expired:
+            self._spill(task_id)
+
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._spill(next(iter(self._entries)))
+
+    def _spill(self, task_id: str):
+        _, size, entry = self._entries.pop(task_id)
+        self._bytes -= size
+        self.evicted_count += 1
+
+        if self._db is None:
+            return
+        self._spilling[task_id] = entry
+        self._writer.submit(self._write_spilled, task_id, entry)
+
+    def _write_spilled(self, task_id: str, entry: Dict[str, Any]):
+        """Write an evicted entry to SQLite; runs on the writer thread"""
+        with self._lock:
+            added = 0
+            try:
+                if self._db is None:
+                    return
+                already_spilled = self._db.execute(
+                    "SELECT 1 FROM completed_tasks WHERE task_id = ? AND namespace = ?", (task_id, self.namespace)
+                ).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO completed_tasks "
+                    "(task_id, agent_type, success, spilled_at, payload, namespace) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        task_id,
+                        agent_type_name(entry["agent_type"]),
+                        {"success": 1, "failure": 0, "cancelled": None}[task_outcome(entry)],
+                        time.time(),
+                        json.dumps(entry, default=str),
+                        self.namespace
+                    )
+                )
+                expired = self._db.execute(
+                    "DELETE FROM completed_tasks WHERE namespace = ? AND spilled_at < ?",
+                    (self.namespace, time.time() - self.disk_ttl_seconds)
+                )
+                self._db.commit()
+                added = (0 if already_spilled else 1) - expired.rowcount
+            except sqlite3.Error as e:
+                logger.error(f"Failed to spill task {task_id}: {e}")
+            finally:
+                # Move the entry's count from pending to disk in one step for __len__
+                if self._spilling.get(task_id) is entry:
+                    del self._spilling[task_id]
+                self._disk_entries += added
+
+    def flush(self):
+        """Spill every in-memory entry to disk (e.g. before discarding the store)"""
+        while self._entries:
+            self._spill(next(iter(self._entries)))
+
+    def close(self):
+        """Flush and release the spill database once the queued writes are done"""
+        self.flush()
+        self._writer.submit(self._close_db)
+        self._writer.shutdown(wait=False)
+
+    def _close_db(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get store statistics"""
+        return {
+            "memory_entries": len(self._entries),
+            "memory_bytes": self._bytes,
+            "spilled_entries": self._disk_entries,
+            "evicted_count": self.evicted_count,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds
+        }
@@ -0,0 +1,67 @@
+"""
+Regression tests for the shared output parser
+Run from backend/: python -m unittest discover tests
+"""
+
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'create_agents'))
+
+from fenced_json import FencedJsonExtractor
+from output_parser import parse_output
+
+PARAMETERS = {"traffic": {"peak_hour_congestion": "+12%"}, "note": "braces {} and \"quotes\""}
+JSON_BLOCK = f"```json\n{json.dumps(PARAMETERS)}\n```"
+
+
+def streamed_blocks(text: str):
+    extractor = FencedJsonExtractor()
+    for start in range(0, len(text), 7):
+        extractor.feed(text[start:start + 7])
+    return [block.data for block in extractor.blocks]
+
+
+class JsonBlocksTest(unittest.TestCase):
+    def assert_finds_block(self, text: str):
+        blocks = parse_output(text).json_blocks()
+        self.assertEqual([block.data for block in blocks], [PARAMETERS])
+        # validate_output and the streaming extractor must agree
+        self.assertEqual(streamed_blocks(text), [PARAMETERS])
+        self.assertEqual(parse_output(text).json_object(), (PARAMETERS, False))
+
+    def test_brace_in_string_of_other_code_block(self):
+        self.assert_finds_block('```python\nprint("{")\n```\n' + JSON_BLOCK)
+
+    def test_unclosed_brace_and_quote_in_prose(self):
+        self.assert_finds_block('Set {x to "y\n' + JSON_BLOCK)
+
+    def test_inline_fence_in_prose(self):
+        self.assert_finds_block("Use ``` fences.\n" + JSON_BLOCK)
+
+    def test_two_blocks(self):
+        text = JSON_BLOCK + "\nand\n```json\n{\"layers\": [1]}\n```"
+        self.assertEqual([block.data for block in parse_output(text).json_blocks()], [PARAMETERS, {"layers": [1]}])
+
+
+class JsonObjectTest(unittest.TestCase):
+    def test_marker(self):
+        text = f"Intro {{not json}} MAPBOX_JSON_START\n{json.dumps(PARAMETERS)}\nMAPBOX_JSON_END"
+        self.assertEqual(parse_output(text).marker("MAPBOX_JSON").data, PARAMETERS)
+
+    def test_object_with_key(self):
+        text = f'{{"other": 1}} then {json.dumps({"blocked_roads": []})}'
+        self.assertEqual(parse_output(text).json_object("blocked_roads"), ({"blocked_roads": []}, False))
+
+    def test_truncated_object_is_repaired(self):
+        text = 'Here: {"blocked_roads": [{"name": "Main St"}, {"name": "Oak'
+        self.assertEqual(parse_output(text).json_object(), ({"blocked_roads": [{"name": "Main St"}]}, True))
+
+    def test_no_json(self):
+        self.assertEqual(parse_output("nothing here").json_object(), (None, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
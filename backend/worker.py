@@ -0,0 +1,218 @@
+"""
+Agent Worker
+Runs agent jobs from the durable job queue in separate processes
+
+Usage:
+    python worker.py --processes 4 --concurrency 2
+
+Start the API with AGENT_EXECUTION_BACKEND=queue so execution requests are
+queued for these workers instead of running inside the API process.
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import time
+from typing import Dict, Any, List
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'create_agents'))
+sys.path.append(os.path.join(os.path.dirname(__file__), 'simulation_agents'))
+
+try:
+    load_dotenv()
+except:
+    pass
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Stream tokens are written to the event table in batches at most this old
+EVENT_FLUSH_SECONDS = 0.05
+
+
+class AgentWorker:
+    """
+    Claims jobs from the queue and executes them through a local orchestrator registry
+
+    Each job runs through execute_agent_stream, so the worker gets the same
+    scheduling, retries and cancellation as in-process execution. Every event
+    is appended to the queue's event table for the API process to relay.
+    Queue calls run in threads so a locked database never stalls the loop.
+    """
+
+    def __init__(self, worker_id: str, concurrency: int, poll_seconds: float, heartbeat_seconds: float):
+        from job_queue import JobQueue
+        from orchestrate import OrchestratorRegistry
+
+        self.worker_id = worker_id
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.queue = JobQueue()
+        self.registry = OrchestratorRegistry()
+        self.running: Dict[str, asyncio.Task] = {}
+        self.job_sessions: Dict[str, str] = {}  # Session of each running job, for cancelling it
+
+    async def run(self):
+        from llm_providers import warm_up_providers
+
+        await warm_up_providers()
+        logger.info(f"Worker {self.worker_id} started (concurrency {self.concurrency})")
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+        try:
+            while True:
+                job = None
+                if len(self.running) < self.concurrency:
+                    job = await asyncio.to_thread(self.queue.claim, self.worker_id)
+                if job is None:
+                    await asyncio.sleep(self.poll_seconds)
+                    continue
+
+                task = asyncio.create_task(self._run_job(job))
+                self.running[job["job_id"]] = task
+                self.job_sessions[job["job_id"]] = job["session_id"]
+                task.add_done_callback(lambda _, job_id=job["job_id"]: self._forget_job(job_id))
+        finally:
+            heartbeat.cancel()
+            for task in self.running.values():
+                task.cancel()
+
+    def _forget_job(self, job_id: str):
+        self.running.pop(job_id, None)
+        self.job_sessions.pop(job_id, None)
+
+    async def _heartbeat_loop(self):
+        """Renew leases, pass on cancel requests and prune old events"""
+        last_prune = 0.0
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                cancelled = await asyncio.to_thread(self.queue.heartbeat, self.worker_id, list(self.running.keys()))
+                for job_id in cancelled:
+                    self.registry.cancel(job_id, self.job_sessions.get(job_id))
+
+                if time.monotonic() - last_prune > 60:
+                    await asyncio.to_thread(self.queue.prune)
+                    last_prune = time.monotonic()
+            except Exception as e:
+                logger.error(f"Worker {self.worker_id} heartbeat failed: {e}")
+
+    async def _run_job(self, job: Dict[str, Any]):
+        from agent_types import AgentType, AgentConfig
+
+        job_id = job["job_id"]
+        payload = job["payload"]
+        logger.info(f"Worker {self.worker_id} running job {job_id} (attempt {job['attempts']})")
+
+        pending: List[Dict[str, Any]] = []
+        last_flush = time.monotonic()
+        task_id = None
+        final_event: Dict[str, Any] = {}
+
+        try:
+            agent_type = AgentType(job["agent_type"])
+            orchestrator = self.registry.get(job["session_id"])
+
+            async for event in orchestrator.execute_agent_stream(
+                agent_id=job_id,
+                agent_type=agent_type,
+                task_description=payload["description"],
+                simulation_data=payload.get("simulation_data"),
+                policy_data=payload.get("policy_data"),
+                custom_input=payload.get("custom_input"),
+                config=AgentConfig(**(payload.get("config") or {})),
+                priority=job["priority"],
+                aggregated_context=payload.get("aggregated_context")
+            ):
+                task_id = event.get("task_id", task_id)
+                if event["type"] in ("complete", "cancelled", "error"):
+                    final_event = event
+
+                pending.append(event)
+                if event["type"] != "stream" or time.monotonic() - last_flush >= EVENT_FLUSH_SECONDS:
+                    await asyncio.to_thread(self.queue.add_events, job_id, pending)
+                    pending = []
+                    last_flush = time.monotonic()
+
+            await asyncio.to_thread(self.queue.add_events, job_id, pending)
+
+            status = {"complete": "completed", "cancelled": "cancelled"}.get(final_event.get("type"), "failed")
+            finished = await asyncio.to_thread(
+                self.queue.finish,
+                job_id,
+                self.worker_id,
+                status,
+                result={
+                    "success": status == "completed",
+                    "agent_id": job_id,
+                    "agent_type": agent_type.value,
+                    "task_id": task_id,
+                    "result": final_event.get("result"),
+                    "status": status
+                },
+                error=final_event.get("error")
+            )
+            if finished:
+                logger.info(f"Worker {self.worker_id} finished job {job_id}: {status}")
+            else:
+                logger.warning(f"Worker {self.worker_id} lost the lease on job {job_id}, result discarded")
+
+        except Exception as e:
+            logger.error(f"Worker {self.worker_id} failed job {job_id}: {e}")
+            await asyncio.to_thread(
+                self.queue.add_events, job_id, pending + [{"type": "error", "agent_id": job_id, "error": str(e)}]
+            )
+            await asyncio.to_thread(self.queue.finish, job_id, self.worker_id, "failed", error=str(e))
+
+
+def run_worker_process(index: int, concurrency: int, poll_seconds: float, heartbeat_seconds: float):
+    """Entry point of one worker process"""
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{index}"
+    worker = AgentWorker(worker_id, concurrency, poll_seconds, heartbeat_seconds)
+    try:
+        asyncio.run(worker.run())
+    except KeyboardInterrupt:
+        logger.info(f"Worker {worker_id} stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run agent workers for the durable job queue")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("AGENT_WORKER_PROCESSES", "2")))
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("AGENT_WORKER_CONCURRENCY", "4")),
+                        help="Jobs each process runs at once")
+    parser.add_argument("--poll-seconds", type=float, default=float(os.getenv("AGENT_JOB_POLL_SECONDS", "0.2")))
+    parser.add_argument("--heartbeat-seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        run_worker_process(0, args.concurrency, args.poll_seconds, args.heartbeat_seconds)
+        return
+
+    processes = [
+        multiprocessing.Process(
+            target=run_worker_process,
+            args=(index, args.concurrency, args.poll_seconds, args.heartbeat_seconds),
+            name=f"agent-worker-{index}"
+        )
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    print(f"[OK] Started {len(processes)} agent worker processes")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()